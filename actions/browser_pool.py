@@ -0,0 +1,254 @@
+"""Pool of reusable headless browsers for web scraping."""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from sys import platform
+from typing import Callable, Dict, Iterator, List, Optional
+
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options as ChromeOptions
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.firefox.options import Options as FirefoxOptions
+from selenium.webdriver.remote.webdriver import WebDriver
+from selenium.webdriver.safari.options import Options as SafariOptions
+from webdriver_manager.firefox import GeckoDriverManager
+
+from agent.metrics import BROWSERS
+from config import Config
+
+CFG = Config()
+
+
+def create_driver(debugging_port: Optional[int] = None) -> WebDriver:
+    """Launch a headless browser
+
+    Args:
+        debugging_port (int, optional): The remote debugging port for chrome on linux.
+            Browsers running side by side must each get their own port.
+
+    Returns:
+        WebDriver: The webdriver of the launched browser
+    """
+    logging.getLogger("selenium").setLevel(logging.CRITICAL)
+
+    options_available = {
+        "chrome": ChromeOptions,
+        "safari": SafariOptions,
+        "firefox": FirefoxOptions,
+    }
+
+    options = options_available[CFG.selenium_web_browser]()
+    options.add_argument(CFG.user_agent)
+    options.add_argument('--headless')
+
+    if CFG.selenium_web_browser == "firefox":
+        service = Service(executable_path=GeckoDriverManager().install())
+        driver = webdriver.Firefox(
+            service=service, options=options
+        )
+    elif CFG.selenium_web_browser == "safari":
+        # Requires a bit more setup on the users end
+        # See https://developer.apple.com/documentation/webkit/testing_with_webdriver_in_safari
+        driver = webdriver.Safari(options=options)
+    else:
+        if platform == "linux" or platform == "linux2":
+            options.add_argument("--disable-dev-shm-usage")
+            if debugging_port is not None:
+                options.add_argument(f"--remote-debugging-port={debugging_port}")
+        options.add_argument("--no-sandbox")
+        options.add_experimental_option(
+            "prefs", {"download_restrictions": 3}
+        )
+        driver = webdriver.Chrome(options=options)
+    return driver
+
+
+class PooledDriver:
+    """A browser owned by a BrowserPool"""
+
+    def __init__(self, driver: WebDriver, port: int) -> None:
+        self.driver = driver
+        self.port = port
+        self.pages = 0
+
+
+class BrowserPool:
+    """A bounded pool of warm, reusable browsers.
+
+    At most `size` browsers are alive at once, each with its own debugging
+    port. Threads check a browser out, load pages with it and check it back
+    in. A browser is recycled after `max_pages` pages, or as soon as it
+    fails a health check or its user reports it broken.
+    """
+
+    def __init__(
+        self,
+        size: int = CFG.browser_pool_size,
+        max_pages: int = CFG.browser_max_pages,
+        base_port: int = CFG.browser_debugging_port,
+        factory: Callable[[int], WebDriver] = create_driver,
+    ) -> None:
+        self.size = size
+        self.max_pages = max_pages
+        self._factory = factory
+        self._idle: List[PooledDriver] = []
+        self._free_ports: List[int] = [base_port + i for i in range(size)]
+        self._busy = 0
+        self._launched = 0
+        self._recycled = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def checkout(self, timeout: Optional[float] = None) -> PooledDriver:
+        """Take a healthy browser from the pool, launching one if there is room
+
+        Args:
+            timeout (float, optional): Seconds to wait for a browser. Waits forever when None.
+
+        Returns:
+            PooledDriver: The checked out browser
+
+        Raises:
+            TimeoutError: If no browser became available in time
+            RuntimeError: If the pool is closed
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            pooled, port = None, None
+            with self._cond:
+                while not self._closed and not self._idle and not self._free_ports:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError("Timed out waiting for a browser")
+                    self._cond.wait(remaining)
+                if self._closed:
+                    raise RuntimeError("Browser pool is closed")
+                if self._idle:
+                    pooled = self._idle.pop()
+                else:
+                    port = self._free_ports.pop()
+                self._busy += 1
+                self._update_metrics()
+
+            if pooled is None:
+                try:
+                    return self._launch(port)
+                except Exception:
+                    with self._cond:
+                        self._busy -= 1
+                        self._free_ports.append(port)
+                        self._update_metrics()
+                        self._cond.notify()
+                    raise
+            if self._is_healthy(pooled):
+                return pooled
+            self._discard(pooled)
+
+    def checkin(self, pooled: PooledDriver, healthy: bool = True) -> None:
+        """Return a browser to the pool
+
+        Args:
+            pooled (PooledDriver): The browser to return
+            healthy (bool): False if the browser misbehaved and must not be reused
+        """
+        pooled.pages += 1
+        reuse = healthy and pooled.pages < self.max_pages and not self._closed
+        if reuse:
+            try:
+                # release the page's memory while the browser sits idle
+                pooled.driver.get("about:blank")
+            except Exception:
+                reuse = False
+
+        if not reuse:
+            self._discard(pooled)
+            return
+        with self._cond:
+            self._busy -= 1
+            self._idle.append(pooled)
+            self._update_metrics()
+            self._cond.notify()
+
+    @contextmanager
+    def driver(self, timeout: Optional[float] = None) -> Iterator[WebDriver]:
+        """Check out a browser for the duration of a with block"""
+        pooled = self.checkout(timeout)
+        healthy = False
+        try:
+            yield pooled.driver
+            healthy = True
+        finally:
+            self.checkin(pooled, healthy)
+
+    def warm(self, count: int = CFG.browser_pool_warm) -> None:
+        """Launch browsers ahead of time so page loads don't wait for browser startup
+
+        Args:
+            count (int): The number of browsers to have ready
+        """
+        launched = []
+        try:
+            for _ in range(min(count, self.size)):
+                launched.append(self.checkout())
+        except Exception as e:
+            logging.warning(f"Could not warm up the browser pool: {e}")
+        for pooled in launched:
+            pooled.pages -= 1  # warming up doesn't count as a page load
+            self.checkin(pooled)
+
+    def close(self) -> None:
+        """Quit the idle browsers and stop handing out new ones. Browsers still
+        checked out are quit when they are returned."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._busy += len(idle)
+            self._cond.notify_all()
+        for pooled in idle:
+            self._discard(pooled)
+
+    def stats(self) -> Dict[str, int]:
+        """Idle, busy, launched and recycled browser counts"""
+        with self._cond:
+            return {
+                "size": self.size,
+                "idle": len(self._idle),
+                "busy": self._busy,
+                "launched": self._launched,
+                "recycled": self._recycled,
+            }
+
+    def _launch(self, port: int) -> PooledDriver:
+        driver = self._factory(port)
+        with self._cond:
+            self._launched += 1
+        return PooledDriver(driver, port)
+
+    def _is_healthy(self, pooled: PooledDriver) -> bool:
+        try:
+            pooled.driver.execute_script("return 1;")
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, pooled: PooledDriver) -> None:
+        try:
+            pooled.driver.quit()
+        except Exception:
+            pass
+        with self._cond:
+            self._busy -= 1
+            self._recycled += 1
+            self._free_ports.append(pooled.port)
+            self._update_metrics()
+            self._cond.notify()
+
+    def _update_metrics(self) -> None:
+        BROWSERS.labels("idle").set(len(self._idle))
+        BROWSERS.labels("busy").set(self._busy)
+
+
+browser_pool = BrowserPool()
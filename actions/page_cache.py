@@ -0,0 +1,144 @@
+"""Cache of the text scraped from web pages, shared across research sessions."""
+from __future__ import annotations
+
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from actions.urls import canonicalize_url
+from agent.metrics import record_cache_lookup
+from agent.sqlite_cache import SQLiteCacheTable
+from config import Config
+
+CFG = Config()
+
+
+class PageCache:
+    """Scraped page text, kept in SQLite with an in-memory LRU in front.
+
+    Pages are fresh for `ttl` seconds. The SQLite store holds at most
+    `max_bytes` of (optionally zlib-compressed) text and the memory front
+    at most `memory_bytes`; least recently used pages are evicted first.
+    Each entry remembers how long scraping it took, so hits can be
+    reported as scrape and browser time saved. Safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        path: str = CFG.page_cache_path,
+        ttl: float = CFG.page_cache_ttl,
+        max_bytes: int = CFG.page_cache_max_bytes,
+        memory_bytes: int = CFG.page_cache_memory_bytes,
+        compress: bool = CFG.page_cache_compress,
+    ) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.compress = compress
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+        self.browser_seconds_saved = 0.0
+        # url -> (text, fetched_at, scrape_seconds, used_browser)
+        self._memory: OrderedDict[str, Tuple[str, float, float, bool]] = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        self._table = SQLiteCacheTable(
+            path, "pages",
+            "url TEXT PRIMARY KEY, text BLOB, compressed INTEGER, size INTEGER, fetched_at REAL,"
+            " last_used REAL, scrape_seconds REAL, used_browser INTEGER",
+            key_column="url", created_column="fetched_at", max_bytes=max_bytes, max_age=ttl,
+            on_evict=self._forget,
+        )
+
+    def get(self, url: str) -> Optional[str]:
+        """Get the cached text of a page
+
+        Args:
+            url (str): The url of the page
+
+        Returns:
+            Optional[str]: The text of the page, or None if it isn't cached or has expired
+        """
+        key = canonicalize_url(url)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[1] < now - self.ttl:
+                self._forget(key)
+                entry = None
+            if entry is not None:
+                self._memory.move_to_end(key)
+            else:
+                row = self._table.get(key, "text, compressed, fetched_at, scrape_seconds, used_browser", now)
+                if row is not None:
+                    data, compressed, fetched_at, scrape_seconds, used_browser = row
+                    text = zlib.decompress(data).decode("utf-8") if compressed else data.decode("utf-8")
+                    entry = (text, fetched_at, scrape_seconds, bool(used_browser))
+                    self._remember(key, entry)
+
+            record_cache_lookup("page", entry is not None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.seconds_saved += entry[2]
+            if entry[3]:
+                self.browser_seconds_saved += entry[2]
+            return entry[0]
+
+    def set(self, url: str, text: str, scrape_seconds: float, used_browser: bool) -> None:
+        """Cache the text of a page
+
+        Args:
+            url (str): The url of the page
+            text (str): The text scraped from the page
+            scrape_seconds (float): How long scraping the page took
+            used_browser (bool): Whether the page had to be rendered in a browser
+        """
+        key = canonicalize_url(url)
+        now = time.time()
+        data = text.encode("utf-8")
+        if self.compress:
+            data = zlib.compress(data, 6)
+        entry = {"url": key, "text": data, "compressed": int(self.compress), "size": len(data), "fetched_at": now,
+                 "last_used": now, "scrape_seconds": scrape_seconds, "used_browser": int(used_browser)}
+        with self._lock:
+            self._remember(key, (text, now, scrape_seconds, used_browser))
+            self._table.put(entry, now)
+
+    def stats(self) -> Dict[str, float]:
+        """Hit and miss counts, time saved and the size of the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "seconds_saved": self.seconds_saved,
+                "browser_seconds_saved": self.browser_seconds_saved,
+                "memory_bytes": self._memory_size,
+                "disk_bytes": self._table.size,
+            }
+
+    def _remember(self, key: str, entry: Tuple[str, float, float, bool]) -> None:
+        self._forget(key)
+        size = len(entry[0])
+        if size > self.memory_bytes:
+            return
+        self._memory[key] = entry
+        self._memory_size += size
+        while self._memory_size > self.memory_bytes:
+            _, (text, *_) = self._memory.popitem(last=False)
+            self._memory_size -= len(text)
+
+    def _forget(self, key: str) -> None:
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_size -= len(entry[0])
+
+
+page_cache = PageCache()
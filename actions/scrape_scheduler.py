@@ -0,0 +1,122 @@
+"""Process-wide scheduling of page loads."""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Tuple
+from urllib.parse import urlparse
+
+from config import Config
+
+CFG = Config()
+
+
+class _HostState:
+    """Concurrency and politeness state for one host"""
+
+    def __init__(self, max_per_host: int) -> None:
+        self.semaphore = asyncio.Semaphore(max_per_host)
+        self.users = 0
+        self.next_start = 0.0
+
+
+class ScrapeScheduler:
+    """Limits page loads across every research job in the process.
+
+    At most `max_concurrent` pages load at once, at most `max_per_host` of
+    them from the same host, and requests to one host start at least
+    `host_delay` seconds apart. When all slots are taken, waiting loads are
+    served by priority (lower values first), then in arrival order.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = CFG.max_concurrent_scrapes,
+        max_per_host: int = CFG.max_scrapes_per_host,
+        host_delay: float = CFG.host_scrape_delay,
+    ) -> None:
+        self.max_concurrent = max_concurrent
+        self.max_per_host = max_per_host
+        self.host_delay = host_delay
+        self._active = 0
+        self._waiters: List[Tuple[float, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._hosts: Dict[str, _HostState] = {}
+
+    @asynccontextmanager
+    async def slot(self, url: str, priority: float = 0) -> AsyncIterator[None]:
+        """Wait for a turn to load the given url
+
+        Args:
+            url (str): The url that will be loaded
+            priority (float): The priority of the load. Lower values are served first.
+        """
+        host = urlparse(url).hostname or ""
+        state = self._hosts.get(host)
+        if state is None:
+            if len(self._hosts) >= 1024:
+                self._prune()
+            state = self._hosts[host] = _HostState(self.max_per_host)
+        state.users += 1
+        try:
+            async with state.semaphore:
+                while True:
+                    await asyncio.sleep(state.next_start - time.monotonic())
+                    await self._acquire(priority)
+                    # another load of the host may have started while this one waited for a slot
+                    now = time.monotonic()
+                    if now >= state.next_start:
+                        state.next_start = now + self.host_delay
+                        break
+                    self._release()
+                try:
+                    yield
+                finally:
+                    self._release()
+        finally:
+            state.users -= 1
+            if state.users == 0 and state.next_start <= time.monotonic():
+                del self._hosts[host]
+
+    def stats(self) -> Dict[str, int]:
+        """Active and queued page loads"""
+        return {
+            "active": self._active,
+            "queued": sum(1 for _, _, waiter in self._waiters if not waiter.done()),
+            "hosts": len(self._hosts),
+        }
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        for host in [host for host, state in self._hosts.items() if state.users == 0 and state.next_start <= now]:
+            del self._hosts[host]
+
+    async def _acquire(self, priority: float) -> None:
+        if self._active < self.max_concurrent and not self._waiters:
+            self._active += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just as we were cancelled, so pass it on
+                self._release()
+            raise
+
+    def _release(self) -> None:
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                # hand the slot straight to the next waiter
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+
+scrape_scheduler = ScrapeScheduler()
@@ -0,0 +1,119 @@
+"""Canonical urls and the index of urls already visited."""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from config import Config
+
+CFG = Config()
+
+# Query parameters that only track where a visitor came from and never change the page
+TRACKING_PARAMS = frozenset({
+    "fbclid", "gclid", "dclid", "gclsrc", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid",
+    "_ga", "_gl", "_hsenc", "_hsmi", "mkt_tok", "ref_src", "ref_url", "spm",
+    "cmpid", "oly_anon_id", "oly_enc_id", "vero_id", "wickedid", "s_kwcid",
+})
+TRACKING_PREFIXES = ("utm_", "pk_", "hsa_")
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def is_tracking_param(name: str) -> bool:
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def canonicalize_url(url: str) -> str:
+    """Reduce a url to a canonical form shared by the variants that load the same page
+
+    The scheme becomes https, the host is lowercased without "www." or its default
+    port, the fragment, tracking parameters and trailing slashes are dropped, and the
+    remaining query parameters are sorted. The result identifies a page; it isn't
+    meant to be loaded, as the site may not serve every variant.
+
+    Args:
+        url (str): The url to canonicalize
+
+    Returns:
+        str: The canonical url
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS:
+        return urlunsplit((scheme, parts.netloc.lower(), parts.path, parts.query, ""))
+
+    host = (parts.hostname or "").rstrip(".")
+    # www.example.com is example.com, but www.com isn't com
+    if host.startswith("www.") and "." in host[4:]:
+        host = host[4:]
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port is not None and port != DEFAULT_PORTS[scheme]:
+        host = f"{host}:{port}"
+
+    path = parts.path.rstrip("/")
+    query = urlencode(sorted(
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not is_tracking_param(name)
+    ))
+    return urlunsplit(("https", host, path or "/", query, ""))
+
+
+class VisitedIndex:
+    """The canonical urls visited recently, with bounded memory.
+
+    Holds at most `max_urls` urls, evicting the least recently seen first.
+    With a `ttl`, urls count as visited for that many seconds only. Safe to
+    share between threads, and so between concurrent queries and runs.
+    """
+
+    def __init__(self, max_urls: int = CFG.visited_urls_max, ttl: Optional[float] = None) -> None:
+        self.max_urls = max_urls
+        self.ttl = ttl
+        self.duplicates = 0
+        self._urls: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, url: str) -> bool:
+        """Mark a url as visited
+
+        Args:
+            url (str): The url, in any of its variants
+
+        Returns:
+            bool: True if the url wasn't visited yet, False if it or a variant of it was
+        """
+        key = canonicalize_url(url)
+        now = time.monotonic()
+        with self._lock:
+            visited_at = self._urls.get(key)
+            if visited_at is not None and (self.ttl is None or now - visited_at < self.ttl):
+                self._urls.move_to_end(key)
+                self.duplicates += 1
+                return False
+            self._urls[key] = now
+            self._urls.move_to_end(key)
+            while len(self._urls) > self.max_urls:
+                self._urls.popitem(last=False)
+            return True
+
+    def __contains__(self, url: str) -> bool:
+        key = canonicalize_url(url)
+        with self._lock:
+            visited_at = self._urls.get(key)
+        return visited_at is not None and (self.ttl is None or time.monotonic() - visited_at < self.ttl)
+
+    def __len__(self) -> int:
+        return len(self._urls)
+
+    def stats(self) -> Dict[str, int]:
+        return {"urls": len(self._urls), "duplicates": self.duplicates}
+
+
+# Shared by the research runs of this process when CFG.visited_urls_shared is set
+visited_urls = VisitedIndex(ttl=CFG.visited_urls_ttl)
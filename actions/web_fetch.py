@@ -0,0 +1,80 @@
+"""Plain HTTP page fetching module."""
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import aiohttp
+
+from config import Config
+
+CFG = Config()
+
+_session: aiohttp.ClientSession | None = None
+
+
+@dataclass
+class FetchedPage:
+    """A page fetched over plain HTTP"""
+    url: str
+    status: int
+    content_type: str
+    html: str
+    # whether the body was cut off at CFG.http_max_page_bytes
+    truncated: bool = False
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Get the shared keep-alive HTTP session used to fetch pages
+
+    Returns:
+        aiohttp.ClientSession: The pooled session
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=CFG.http_connection_limit, keepalive_timeout=30),
+            timeout=aiohttp.ClientTimeout(total=CFG.http_fetch_timeout),
+            headers={"User-Agent": CFG.user_agent, "Accept-Encoding": "gzip, deflate"},
+        )
+    return _session
+
+
+async def close_session() -> None:
+    """Close the shared HTTP session, if one was opened"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def fetch_page(url: str) -> FetchedPage:
+    """Fetch a page with a single GET request. Compressed responses are decoded
+    and bodies larger than CFG.http_max_page_bytes are truncated.
+
+    Args:
+        url (str): The url of the page
+
+    Returns:
+        FetchedPage: The fetched page
+    """
+    max_bytes = CFG.http_max_page_bytes
+    async with get_session().get(url, allow_redirects=True) as response:
+        content_type = response.headers.get("Content-Type", "")
+        chunks = []
+        size = 0
+        # read one byte past the cap, to tell a body of exactly max_bytes from a longer one
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > max_bytes:
+                break
+        body = b"".join(chunks)
+        truncated = len(body) > max_bytes
+        body = body[:max_bytes]
+        html = body.decode(response.charset or "utf-8", errors="replace") if is_html(content_type) else ""
+        return FetchedPage(str(response.url), response.status, content_type, html, truncated)
+
+
+def is_html(content_type: str) -> bool:
+    """Check whether a Content-Type header is an HTML document"""
+    return content_type.split(";")[0].strip().lower() in ("text/html", "application/xhtml+xml", "")
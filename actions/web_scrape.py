@@ -1,60 +1,94 @@
 """Selenium web scraping module."""
 from __future__ import annotations
 
-import logging
 import asyncio
+import contextlib
+import time
 from pathlib import Path
-from sys import platform
-
-from bs4 import BeautifulSoup
-from webdriver_manager.chrome import ChromeDriverManager
-from webdriver_manager.firefox import GeckoDriverManager
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options as ChromeOptions
+from typing import Optional
+
 from selenium.webdriver.common.by import By
-from selenium.webdriver.firefox.options import Options as FirefoxOptions
 from selenium.webdriver.remote.webdriver import WebDriver
-from selenium.webdriver.safari.options import Options as SafariOptions
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.wait import WebDriverWait
 from fastapi import WebSocket
 
 import processing.text as summary
 
+from actions.browser_pool import browser_pool, create_driver
+from actions.page_cache import page_cache
+from actions.scrape_scheduler import scrape_scheduler
+from actions.web_fetch import FetchedPage, fetch_page, is_html
+from agent.job import ResearchJob, current_job
+from agent.metrics import SCRAPE_PHASE_SECONDS
+from agent.tracing import traced
 from config import Config
-from processing.html import extract_hyperlinks, format_hyperlinks
+from processing.dedup import NearDuplicateIndex
+from processing.html import TEXT_TAGS, extract_text, extract_text_and_links, format_hyperlinks
 
 from concurrent.futures import ThreadPoolExecutor
 
-executor = ThreadPoolExecutor()
-
 FILE_DIR = Path(__file__).parent.parent
 CFG = Config()
 
+executor = ThreadPoolExecutor(max_workers=CFG.scrape_threads, thread_name_prefix="scrape")
+
 
-async def async_browse(url: str, question: str, websocket: WebSocket) -> str:
+@traced("async_browse", "url")
+async def async_browse(url: str, question: str, websocket: WebSocket, priority: float = 0,
+                       duplicates: Optional[NearDuplicateIndex] = None) -> str:
     """Browse a website and return the answer and links to the user
 
     Args:
         url (str): The url of the website to browse
         question (str): The question asked by the user
         websocket (WebSocketManager): The websocket manager
+        priority (float): The scrape scheduler priority of the page load. Lower values go first.
+        duplicates (NearDuplicateIndex, optional): The text seen so far in the research run.
+            Parts of the page already in it are not summarized again.
 
     Returns:
         str: The answer and links to the user
     """
-    loop = asyncio.get_event_loop()
-    executor = ThreadPoolExecutor(max_workers=8)
-
     print(f"Scraping url {url} with question {question}")
     await websocket.send_json(
         {"type": "logs", "output": f"🔎 Browsing the {url} for relevant about: {question}..."})
 
+    loop = asyncio.get_event_loop()
     try:
-        driver, text = await loop.run_in_executor(executor, scrape_text_with_selenium, url)
-        await loop.run_in_executor(executor, add_header, driver)
-        summary_text = await loop.run_in_executor(executor, summary.summarize_text, url, text, question, driver)
+        with SCRAPE_PHASE_SECONDS.labels("cache_lookup").time():
+            text = await loop.run_in_executor(executor, page_cache.get, url) if CFG.page_cache_enabled else None
+        if text is not None:
+            await websocket.send_json({"type": "logs", "output": f"♻️ Using the cached text of {url}"})
+        else:
+            queued = time.monotonic()
+            async with scrape_scheduler.slot(url, priority):
+                started = time.monotonic()
+                SCRAPE_PHASE_SECONDS.labels("scheduler_wait").observe(started - queued)
+                text, fallback_reason = await scrape_text(url)
+                scrape_seconds = time.monotonic() - started
+            SCRAPE_PHASE_SECONDS.labels("scrape").observe(scrape_seconds)
+            if fallback_reason:
+                await websocket.send_json(
+                    {"type": "logs", "output": f"🌐 Rendered {url} in a browser: {fallback_reason}"})
+            else:
+                await websocket.send_json({"type": "logs", "output": f"⚡ Fetched {url} without a browser"})
+            if CFG.page_cache_enabled and text:
+                await loop.run_in_executor(
+                    executor, page_cache.set, url, text, scrape_seconds, fallback_reason is not None)
+        if duplicates is not None and text:
+            with SCRAPE_PHASE_SECONDS.labels("dedup").time():
+                deduplicated = await loop.run_in_executor(None, duplicates.deduplicate, url, text)
+            if deduplicated.is_duplicate:
+                await websocket.send_json({"type": "logs", "output": f"♊ Skipping {url}, its content was already "
+                                           f"gathered from {deduplicated.duplicate_of} (~{deduplicated.tokens_saved} tokens saved)"})
+                return f"Information gathered from url {url}: Same content as {deduplicated.duplicate_of}."
+            if deduplicated.dropped_blocks:
+                await websocket.send_json({"type": "logs", "output": f"♊ Dropped {deduplicated.dropped_blocks} of "
+                                           f"{deduplicated.blocks} near-duplicate blocks of {url} (~{deduplicated.tokens_saved} tokens saved)"})
+            text = deduplicated.text
+        with SCRAPE_PHASE_SECONDS.labels("summarize").time():
+            summary_text = await summary.summarize_text(url, text, question)
 
         await websocket.send_json(
             {"type": "logs", "output": f"📝 Information gathered from url {url}: {summary_text}"})
@@ -66,6 +100,57 @@ async def async_browse(url: str, question: str, websocket: WebSocket) -> str:
 
 
 
+async def scrape_text(url: str) -> tuple[str, Optional[str]]:
+    """Scrape text from a website, fetching it over plain HTTP when possible and
+    rendering it in a browser otherwise
+
+    Args:
+        url (str): The url of the website to scrape
+
+    Returns:
+        Tuple[str, Optional[str]]: The text scraped from the website and the reason the
+            browser was used, or None if it wasn't
+    """
+    loop = asyncio.get_event_loop()
+    reason = "the plain HTTP fast path is disabled"
+    if CFG.http_fast_path:
+        try:
+            with SCRAPE_PHASE_SECONDS.labels("http_fetch").time():
+                page = await fetch_page(url)
+        except Exception as e:
+            reason = f"plain HTTP fetch failed ({e!r})"
+        else:
+            if page.truncated:
+                print(f"Only the first {CFG.http_max_page_bytes} bytes of {url} were read")
+            with SCRAPE_PHASE_SECONDS.labels("extract_text").time():
+                text = await loop.run_in_executor(executor, html_to_text, page.html)
+            reason = browser_fallback_reason(page, text)
+            if reason is None:
+                return text, None
+
+    text = await loop.run_in_executor(executor, scrape_text_with_pool, url, current_job.get())
+    return text, reason
+
+
+def browser_fallback_reason(page: FetchedPage, text: str) -> Optional[str]:
+    """Decide whether a page fetched over plain HTTP has to be rendered in a browser
+
+    Args:
+        page (FetchedPage): The fetched page
+        text (str): The text extracted from the page
+
+    Returns:
+        Optional[str]: Why the page needs a browser, or None if the fetched text can be used
+    """
+    if page.status >= 400:
+        return f"HTTP status {page.status}"
+    if not is_html(page.content_type):
+        return f"content type {page.content_type}"
+    if len(text) < CFG.min_page_text_length:
+        return f"only {len(text)} characters of text, the page looks script-rendered"
+    return None
+
+
 def browse_website(url: str, question: str) -> tuple[str, WebDriver]:
     """Browse a website and return the answer and links to the user
 
@@ -80,11 +165,13 @@ def browse_website(url: str, question: str) -> tuple[str, WebDriver]:
     if not url:
         return "A URL was not specified, cancelling request to browse website.", None
 
-    driver, text = scrape_text_with_selenium(url)
+    driver = create_driver()
+    page_source = load_page(url, driver)
     add_header(driver)
-    summary_text = summary.summarize_text(url, text, question, driver)
+    text, hyperlinks = extract_text_and_links(page_source, url)
+    summary_text = asyncio.run(summary.summarize_text(url, text, question))
 
-    links = scrape_links_with_selenium(driver, url)
+    links = format_hyperlinks(hyperlinks)
 
     # Limit links to 5
     if len(links) > 5:
@@ -96,45 +183,55 @@ def browse_website(url: str, question: str) -> tuple[str, WebDriver]:
     return f"Answer gathered from website: {summary_text} \n \n Links: {links}", driver
 
 
-def scrape_text_with_selenium(url: str) -> tuple[WebDriver, str]:
+def scrape_text_with_pool(url: str, job: Optional[ResearchJob] = None) -> str:
+    """Scrape text from a website with a browser borrowed from the browser pool
+
+    Args:
+        url (str): The url of the website to scrape
+        job (ResearchJob, optional): The job the page is scraped for. Cancelling the job
+            quits the browser.
+
+    Returns:
+        str: The text scraped from the website
+    """
+    # includes launching a browser when none is idle
+    started = time.monotonic()
+    with browser_pool.driver() as driver, job.browser(driver) if job else contextlib.nullcontext():
+        SCRAPE_PHASE_SECONDS.labels("browser_checkout").observe(time.monotonic() - started)
+        with SCRAPE_PHASE_SECONDS.labels("page_load").time():
+            html = load_page(url, driver)
+        with SCRAPE_PHASE_SECONDS.labels("extract_text").time():
+            text = html_to_text(html)
+        add_header(driver)
+    return text
+
+
+def scrape_text_with_selenium(url: str, driver: Optional[WebDriver] = None) -> tuple[WebDriver, str]:
     """Scrape text from a website using selenium
 
     Args:
         url (str): The url of the website to scrape
+        driver (WebDriver, optional): The webdriver to load the page with. A new browser is
+            launched when None, and it is up to the caller to close it.
 
     Returns:
         Tuple[WebDriver, str]: The webdriver and the text scraped from the website
     """
-    logging.getLogger("selenium").setLevel(logging.CRITICAL)
-
-    options_available = {
-        "chrome": ChromeOptions,
-        "safari": SafariOptions,
-        "firefox": FirefoxOptions,
-    }
-
-    options = options_available[CFG.selenium_web_browser]()
-    options.add_argument(CFG.user_agent)
-    options.add_argument('--headless')
-
-    if CFG.selenium_web_browser == "firefox":
-        service = Service(executable_path=GeckoDriverManager().install())
-        driver = webdriver.Firefox(
-            service=service, options=options
-        )
-    elif CFG.selenium_web_browser == "safari":
-        # Requires a bit more setup on the users end
-        # See https://developer.apple.com/documentation/webkit/testing_with_webdriver_in_safari
-        driver = webdriver.Safari(options=options)
-    else:
-        if platform == "linux" or platform == "linux2":
-            options.add_argument("--disable-dev-shm-usage")
-            options.add_argument("--remote-debugging-port=9222")
-        options.add_argument("--no-sandbox")
-        options.add_experimental_option(
-            "prefs", {"download_restrictions": 3}
-        )
-        driver = webdriver.Chrome(options=options)
+    if driver is None:
+        driver = create_driver()
+    return driver, html_to_text(load_page(url, driver))
+
+
+def load_page(url: str, driver: WebDriver) -> str:
+    """Load a website in the browser
+
+    Args:
+        url (str): The url of the website to load
+        driver (WebDriver): The webdriver to load the website with
+
+    Returns:
+        str: The HTML of the page body, as rendered by the browser
+    """
     driver.get(url)
 
     WebDriverWait(driver, 10).until(
@@ -142,19 +239,19 @@ def scrape_text_with_selenium(url: str) -> tuple[WebDriver, str]:
     )
 
     # Get the HTML content directly from the browser's DOM
-    page_source = driver.execute_script("return document.body.outerHTML;")
-    soup = BeautifulSoup(page_source, "html.parser")
+    return driver.execute_script("return document.body.outerHTML;")
 
-    for script in soup(["script", "style"]):
-        script.extract()
 
-    # text = soup.get_text()
-    text = get_text(soup)
+def html_to_text(html: str) -> str:
+    """Extract the readable text from an HTML document
 
-    lines = (line.strip() for line in text.splitlines())
-    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-    text = "\n".join(chunk for chunk in chunks if chunk)
-    return driver, text
+    Args:
+        html (str): The HTML to extract the text from
+
+    Returns:
+        str: The text, one phrase per line
+    """
+    return extract_text(html)
 
 
 def get_text(soup):
@@ -166,11 +263,12 @@ def get_text(soup):
     Returns:
         str: The text from the soup
     """
-    text = ""
-    tags = ['h1', 'h2', 'h3', 'h4', 'h5', 'p']
-    for element in soup.find_all(tags):  # Find all the <p> elements
-        text += element.text + "\n\n"
-    return text
+    texts = []
+    for element in soup.find_all(TEXT_TAGS):  # Find all the headings and <p> elements
+        # skip elements whose text is already part of an enclosing heading or paragraph
+        if element.find_parent(TEXT_TAGS) is None:
+            texts.append(element.text)
+    return "\n\n".join(texts) + "\n\n" if texts else ""
 
 
 def scrape_links_with_selenium(driver: WebDriver, url: str) -> list[str]:
@@ -182,14 +280,7 @@ def scrape_links_with_selenium(driver: WebDriver, url: str) -> list[str]:
     Returns:
         List[str]: The links scraped from the website
     """
-    page_source = driver.page_source
-    soup = BeautifulSoup(page_source, "html.parser")
-
-    for script in soup(["script", "style"]):
-        script.extract()
-
-    hyperlinks = extract_hyperlinks(soup, url)
-
+    _, hyperlinks = extract_text_and_links(driver.page_source, url)
     return format_hyperlinks(hyperlinks)
 
 
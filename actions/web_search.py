@@ -1,25 +1,157 @@
 from __future__ import annotations
+import asyncio
 import json
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
 from duckduckgo_search import DDGS
 
-ddgs = DDGS()
+from agent.metrics import record_cache_lookup
+from config import Config
 
-def web_search(query: str, num_results: int = 4) -> str:
-    """Useful for general internet search queries."""
-    print("Searching with query {0}...".format(query))
-    search_results = []
+CFG = Config()
+
+
+class SearchBackend(ABC):
+    """A web search engine"""
+
+    @abstractmethod
+    async def search(self, query: str, num_results: int) -> List[Dict[str, str]]:
+        """Search the web
+
+        Args:
+            query (str): The search query
+            num_results (int): The maximum number of results
+
+        Returns:
+            List[Dict[str, str]]: The results, each with at least an "href" key
+        """
+
+
+class DuckDuckGoSearch(SearchBackend):
+    """Searches DuckDuckGo on a worker thread, since its client is synchronous"""
+
+    def __init__(self) -> None:
+        self._ddgs: Optional[DDGS] = None
+
+    async def search(self, query: str, num_results: int) -> List[Dict[str, str]]:
+        return await asyncio.get_event_loop().run_in_executor(None, self._search, query, num_results)
+
+    def _search(self, query: str, num_results: int) -> List[Dict[str, str]]:
+        if self._ddgs is None:
+            self._ddgs = DDGS()
+        search_results = []
+        for result in self._ddgs.text(query) or []:
+            search_results.append(result)
+            if len(search_results) >= num_results:
+                break
+        return search_results
+
+
+class SearchCache:
+    """Search results by normalized query, for `ttl` seconds and at most `max_entries` queries"""
+
+    def __init__(self, ttl: float = CFG.search_cache_ttl, max_entries: int = 1024) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Tuple[str, int], Tuple[float, List[Dict[str, str]]]] = OrderedDict()
+
+    def get(self, key: Tuple[str, int]) -> Optional[List[Dict[str, str]]]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic() - self.ttl:
+            self._entries.pop(key, None)
+            self.misses += 1
+            record_cache_lookup("search", False)
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        record_cache_lookup("search", True)
+        return entry[1]
+
+    def set(self, key: Tuple[str, int], results: List[Dict[str, str]]) -> None:
+        self._entries[key] = (time.monotonic(), results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+_backend: SearchBackend = DuckDuckGoSearch()
+_cache = SearchCache()
+_in_flight: Dict[Tuple[str, int], asyncio.Future] = {}
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def set_search_backend(backend: SearchBackend) -> None:
+    """Replace the search engine used by async_web_search, e.g. with a local stand-in"""
+    global _backend
+    _backend = backend
+    _cache._entries.clear()
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query for caching: lowercase it and collapse whitespace"""
+    return " ".join(query.lower().split())
+
+
+async def async_web_search(query: str, num_results: int = CFG.search_num_results) -> List[Dict[str, str]]:
+    """Useful for general internet search queries.
+
+    Results are cached by normalized query, identical concurrent searches share
+    one request, and at most CFG.search_concurrency searches are sent at once.
+
+    Args:
+        query (str): The search query
+        num_results (int, optional): The maximum number of results. Defaults to CFG.search_num_results.
+
+    Returns:
+        List[Dict[str, str]]: The search results
+    """
+    global _semaphore
     if not query:
-        return json.dumps(search_results)
+        return []
+
+    key = (normalize_query(query), num_results)
+    results = _cache.get(key)
+    if results is not None:
+        return [dict(result) for result in results]
+
+    in_flight = _in_flight.get(key)
+    if in_flight is None:
+        if _semaphore is None:
+            _semaphore = asyncio.Semaphore(CFG.search_concurrency)
 
-    results = ddgs.text(query)
-    if not results:
-        return json.dumps(search_results)
+        async def search() -> List[Dict[str, str]]:
+            try:
+                async with _semaphore:
+                    print("Searching with query {0}...".format(query))
+                    search_results = await _backend.search(query, num_results)
+                _cache.set(key, search_results)
+                return search_results
+            finally:
+                del _in_flight[key]
+
+        in_flight = _in_flight[key] = asyncio.ensure_future(search())
+    # shield the shared search so one caller being cancelled doesn't cancel it for the others
+    results = await asyncio.shield(in_flight)
+    return [dict(result) for result in results]
+
+
+def web_search(query: str, num_results: int = 4) -> str:
+    """Useful for general internet search queries. Blocking, JSON-encoded version of
+    async_web_search for callers outside of an event loop."""
+    return json.dumps(asyncio.run(async_web_search(query, num_results)), ensure_ascii=False)
 
-    total_added = 0
-    for j in results:
-        search_results.append(j)
-        total_added += 1
-        if total_added >= num_results:
-            break
 
-    return json.dumps(search_results, ensure_ascii=False, indent=4)
+def search_stats() -> Dict[str, float]:
+    """Search cache hit and miss counts"""
+    lookups = _cache.hits + _cache.misses
+    return {
+        "hits": _cache.hits,
+        "misses": _cache.misses,
+        "hit_rate": _cache.hits / lookups if lookups else 0.0,
+        "in_flight": len(_in_flight),
+    }
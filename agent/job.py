@@ -0,0 +1,69 @@
+"""Tracking of running research jobs, so they can be cancelled."""
+from __future__ import annotations
+
+import asyncio
+import threading
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional, Set
+
+from selenium.webdriver.remote.webdriver import WebDriver
+
+
+class JobCancelled(Exception):
+    """Raised by work that belongs to a cancelled research job"""
+
+
+class ResearchJob:
+    """A research run that can be cancelled along with everything it started.
+
+    Cancelling the job cancels its task, which abandons the LLM calls,
+    searches and page loads it is waiting on, and quits the browsers it
+    has checked out so that page loads running on worker threads stop too.
+    """
+
+    def __init__(self, job_id: Optional[str] = None) -> None:
+        self.id = job_id or uuid.uuid4().hex
+        self.task: Optional[asyncio.Task] = None
+        self.closed = False
+        self._browsers: Set[WebDriver] = set()
+        self._lock = threading.Lock()
+
+    def cancel(self) -> None:
+        """Cancel the job and quit its browsers"""
+        if self.task is not None:
+            self.task.cancel()
+        self.close()
+
+    def close(self) -> None:
+        """Quit the browsers the job still has checked out and refuse to track new ones"""
+        with self._lock:
+            self.closed = True
+            browsers, self._browsers = self._browsers, set()
+        for driver in browsers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+    @contextmanager
+    def browser(self, driver: WebDriver) -> Iterator[WebDriver]:
+        """Track a browser while the job uses it, so cancelling the job can quit it
+
+        Raises:
+            JobCancelled: If the job is already cancelled or finished
+        """
+        with self._lock:
+            if self.closed:
+                raise JobCancelled(f"Research job {self.id} was cancelled")
+            self._browsers.add(driver)
+        try:
+            yield driver
+        finally:
+            with self._lock:
+                self._browsers.discard(driver)
+
+
+# The job the current task works for. Tasks created by a job inherit it.
+current_job: ContextVar[Optional[ResearchJob]] = ContextVar("current_job", default=None)
@@ -0,0 +1,432 @@
+"""Research job submission, tracking and execution, in-process or in worker processes."""
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+import urllib.parse
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional
+
+from agent.job import ResearchJob, current_job
+from agent.llm_utils import choose_agent
+from agent.run import run_agent
+from agent.storage import outputs_store
+from config import Config
+from processing.text import get_encoding
+
+CFG = Config()
+
+JOB_STATUSES = ("queued", "running", "completed", "failed", "cancelled")
+
+
+class JobRecord:
+    """The status and event stream of a submitted research job.
+
+    Events are kept until every client following the job has read them,
+    after which only the last `event_history` are kept, so a client that
+    starts following the job late is told how many it missed. Jobs running
+    in this process wait in `wait_for_room` while a follower lags that far
+    behind, so a slow client holds the job back instead of losing events.
+    """
+
+    def __init__(self, job_id: str, request: Dict[str, Any], event_history: int = CFG.job_event_history) -> None:
+        self.id = job_id
+        self.request = request
+        self.event_history = event_history
+        self.status = "queued"
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.error: Optional[str] = None
+        self.result: Dict[str, Any] = {}
+        self.events: Deque[dict] = deque()
+        self.published = 0
+        self.followers: Dict[object, int] = {}
+        self._changed = asyncio.get_running_loop().create_future()
+        self._advanced = asyncio.get_running_loop().create_future()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("completed", "failed", "cancelled")
+
+    @property
+    def dropped(self) -> int:
+        """The number of events published but no longer kept"""
+        return self.published - len(self.events)
+
+    def publish(self, event: dict) -> None:
+        """Append an event to the job's stream"""
+        self.events.append(event)
+        self.published += 1
+        self._trim()
+        self._notify()
+
+    async def wait_for_room(self) -> None:
+        """Wait until publishing an event drops none that a follower has not read yet"""
+        while len(self.events) >= self.event_history and self._lagging():
+            await asyncio.shield(self._advanced)
+
+    def finish(self, status: str, result: Dict[str, Any], error: Optional[str]) -> None:
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished = time.time()
+        self._notify()
+
+    async def follow(self, start: int = 0) -> AsyncIterator[dict]:
+        """Iterate over the job's events from the given index, waiting for new ones
+        until the job is done"""
+        follower = object()
+        self.followers[follower] = max(start, self.dropped)
+        try:
+            if start < self.dropped:
+                yield {"type": "logs", "output": f"({self.dropped - start} earlier events of the job are no longer kept)"}
+            while True:
+                index = self.followers[follower]
+                if index < self.published:
+                    yield self.events[index - self.dropped]
+                    self.followers[follower] = index + 1
+                    self._advance()
+                    continue
+                if self.done:
+                    return
+                await asyncio.shield(self._changed)
+        finally:
+            del self.followers[follower]
+            self._advance()
+
+    def summary(self) -> Dict[str, Any]:
+        """The status of the job, without its events"""
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "request": self.request,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error,
+            "result": self.result,
+            "events": self.published,
+        }
+
+    def _lagging(self) -> bool:
+        """Whether a follower has not read the oldest kept event yet"""
+        return any(index <= self.dropped for index in self.followers.values())
+
+    def _trim(self) -> None:
+        while len(self.events) > self.event_history and not self._lagging():
+            self.events.popleft()
+
+    def _advance(self) -> None:
+        self._trim()
+        advanced, self._advanced = self._advanced, asyncio.get_running_loop().create_future()
+        advanced.set_result(None)
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.get_running_loop().create_future()
+        changed.set_result(None)
+
+
+class LocalEventSink:
+    """Passes the events of a job running in this process straight to the job manager,
+    waiting while a client following the job lags a full event history behind"""
+
+    def __init__(self, manager: JobManager, job_id: str) -> None:
+        self.manager = manager
+        self.job_id = job_id
+
+    async def send_json(self, message: dict) -> None:
+        record = self.manager.get(self.job_id)
+        if record is not None:
+            await record.wait_for_room()
+        self.manager.handle_message(("event", self.job_id, message))
+
+
+class QueueEventSink:
+    """Sends the events of a job running in a worker process to the parent process,
+    whose record keeps them until every client following the job has read them"""
+
+    def __init__(self, event_queue: multiprocessing.Queue, job_id: str) -> None:
+        self.event_queue = event_queue
+        self.job_id = job_id
+
+    async def send_json(self, message: dict) -> None:
+        self.event_queue.put(("event", self.job_id, message))
+
+
+async def execute_job(job: ResearchJob, request: Dict[str, Any], sink) -> Dict[str, Any]:
+    """Run a research job, reporting its progress to the sink
+
+    Args:
+        job (ResearchJob): The job, used to cancel the work it starts
+        request (Dict[str, Any]): The research request: task, report_type, agent and
+            optionally refresh, to redo research done earlier for the task
+        sink: Receives the job's events through an async send_json method
+
+    Returns:
+        Dict[str, Any]: The path of the report and the artifacts of the job
+    """
+    current_job.set(job)
+    task = request.get("task")
+    report_type = request.get("report_type")
+    agent = request.get("agent")
+    if not (task and report_type and agent):
+        raise ValueError("Not enough parameters provided, a task, report_type and agent are required")
+
+    # temporary so "normal agents" can still be used and not just auto generated, will be removed when we move to auto generated
+    if agent == "Auto Agent":
+        agent_dict = await choose_agent(task)
+        agent = agent_dict.get("agent")
+        agent_role_prompt = agent_dict.get("agent_role_prompt")
+    else:
+        agent_role_prompt = None
+
+    await sink.send_json({"type": "logs", "output": f"Initiated an Agent: {agent}"})
+    _, path = await run_agent(task, report_type, agent, agent_role_prompt, sink, bool(request.get("refresh")))
+    return {"path": path, "artifacts": list_artifacts(path)}
+
+
+def list_artifacts(report_path: str) -> List[str]:
+    """List the files written to the output directory of a report
+
+    Args:
+        report_path (str): The url-encoded path of the report
+
+    Returns:
+        List[str]: The url-encoded paths of the files in the report's directory
+    """
+    directory = os.path.dirname(urllib.parse.unquote(report_path))
+    return [urllib.parse.quote(f"{directory}/{name}")
+            for name in outputs_store.artifacts(os.path.basename(directory))]
+
+
+class JobManager:
+    """Accepts research jobs, runs them and keeps their status and events.
+
+    With `workers` > 0, jobs run in that many worker processes fed from a
+    local multiprocessing queue, each running up to `jobs_per_worker` jobs
+    at once; otherwise they run as tasks in this process. The records of
+    the last `history` finished jobs are kept.
+    """
+
+    def __init__(
+        self,
+        workers: int = CFG.research_workers,
+        jobs_per_worker: int = CFG.jobs_per_worker,
+        history: int = CFG.job_history,
+    ) -> None:
+        self.workers = workers
+        self.jobs_per_worker = jobs_per_worker
+        self.history = history
+        self.records: OrderedDict[str, JobRecord] = OrderedDict()
+        self._local_jobs: Dict[str, ResearchJob] = {}
+        self._processes: List[multiprocessing.Process] = []
+        self._control_queues: List[multiprocessing.Queue] = []
+        self._task_queue: Optional[multiprocessing.Queue] = None
+        self._event_queue: Optional[multiprocessing.Queue] = None
+        self._pump: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self) -> None:
+        """Start the worker processes, if any. Must be called from the event loop."""
+        self._loop = asyncio.get_running_loop()
+        if self.workers <= 0:
+            return
+        context = multiprocessing.get_context("spawn")
+        self._task_queue = context.Queue()
+        self._event_queue = context.Queue()
+        for index in range(self.workers):
+            control_queue = context.Queue()
+            process = context.Process(
+                target=worker_main,
+                args=(index, self.workers, self.jobs_per_worker, self._task_queue, self._event_queue, control_queue),
+                name=f"research-worker-{index}",
+                daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+            self._control_queues.append(control_queue)
+        self._pump = threading.Thread(target=self._pump_events, name="job-events", daemon=True)
+        self._pump.start()
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """Cancel local jobs and stop the worker processes"""
+        for job in list(self._local_jobs.values()):
+            job.cancel()
+        for control_queue in self._control_queues:
+            control_queue.put(None)
+        for _ in self._processes:
+            self._task_queue.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        if self._event_queue is not None:
+            self._event_queue.put(None)
+        self._processes.clear()
+        self._control_queues.clear()
+
+    def submit(self, request: Dict[str, Any]) -> str:
+        """Submit a research job
+
+        Args:
+            request (Dict[str, Any]): The research request: task, report_type and agent
+
+        Returns:
+            str: The id of the job
+        """
+        job_id = uuid.uuid4().hex
+        self.records[job_id] = JobRecord(job_id, request)
+        self._prune()
+        if self.workers > 0:
+            self._task_queue.put((job_id, request))
+        else:
+            job = ResearchJob(job_id)
+            self._local_jobs[job_id] = job
+            job.task = asyncio.create_task(self._run_local(job, request))
+        return job_id
+
+    def get(self, job_id: str) -> Optional[JobRecord]:
+        return self.records.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job
+
+        Returns:
+            bool: False if there is no such job or it is already done
+        """
+        record = self.records.get(job_id)
+        if record is None or record.done:
+            return False
+        if record.status == "queued":
+            # a job that has not started yet is done as soon as it is cancelled
+            record.finish("cancelled", {}, None)
+        if job_id in self._local_jobs:
+            self._local_jobs.pop(job_id).cancel()
+        else:
+            # whichever worker has the job, or picks it up later, cancels it
+            for control_queue in self._control_queues:
+                control_queue.put(job_id)
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        """The number of jobs in each status"""
+        counts = dict.fromkeys(JOB_STATUSES, 0)
+        for record in self.records.values():
+            counts[record.status] += 1
+        return counts
+
+    def handle_message(self, message: tuple) -> None:
+        """Apply a message from a running job to its record"""
+        kind, job_id, *payload = message
+        record = self.records.get(job_id)
+        if record is None or record.done:
+            return
+        if kind == "started":
+            record.status = "running"
+            record.started = time.time()
+            record.publish({"type": "job", "output": job_id})
+        elif kind == "event":
+            record.publish(payload[0])
+        elif kind == "finished":
+            status, result, error = payload
+            record.finish(status, result, error)
+
+    async def _run_local(self, job: ResearchJob, request: Dict[str, Any]) -> None:
+        self.handle_message(("started", job.id))
+        status, result, error = await run_job(job, request, LocalEventSink(self, job.id))
+        self._local_jobs.pop(job.id, None)
+        self.handle_message(("finished", job.id, status, result, error))
+
+    def _pump_events(self) -> None:
+        for message in iter(self._event_queue.get, None):
+            self._loop.call_soon_threadsafe(self.handle_message, message)
+
+    def _prune(self) -> None:
+        finished = [job_id for job_id, record in self.records.items() if record.done]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self.records[job_id]
+
+
+async def run_job(job: ResearchJob, request: Dict[str, Any], sink) -> tuple:
+    """Run a job to completion and report how it ended
+
+    Returns:
+        Tuple[str, Dict[str, Any], Optional[str]]: The final status, the result and the error, if any
+    """
+    try:
+        return "completed", await execute_job(job, request, sink), None
+    except asyncio.CancelledError:
+        return "cancelled", {}, None
+    except Exception as e:
+        print(f"Research job {job.id} failed: {e}")
+        await sink.send_json({"type": "logs", "output": f"⚠️ Research failed: {e}"})
+        return "failed", {}, str(e)
+    finally:
+        job.close()  # quit any browser still checked out for the job
+
+
+def worker_main(index: int, workers: int, jobs_per_worker: int, task_queue: multiprocessing.Queue,
+                event_queue: multiprocessing.Queue, control_queue: multiprocessing.Queue) -> None:
+    """Entry point of a research worker process"""
+    # every worker gets an equal share of the provider rate limits
+    CFG.fast_llm_rpm = max(1, CFG.fast_llm_rpm // workers)
+    CFG.fast_llm_tpm = max(1, CFG.fast_llm_tpm // workers)
+    CFG.smart_llm_rpm = max(1, CFG.smart_llm_rpm // workers)
+    CFG.smart_llm_tpm = max(1, CFG.smart_llm_tpm // workers)
+    asyncio.run(_worker_loop(index, jobs_per_worker, task_queue, event_queue, control_queue))
+
+
+async def _worker_loop(index: int, jobs_per_worker: int, task_queue: multiprocessing.Queue,
+                       event_queue: multiprocessing.Queue, control_queue: multiprocessing.Queue) -> None:
+    loop = asyncio.get_running_loop()
+    jobs: Dict[str, ResearchJob] = {}
+    cancelled = deque(maxlen=10000)
+    slots = asyncio.Semaphore(jobs_per_worker)
+
+    def cancel(job_id: str) -> None:
+        if job_id in jobs:
+            jobs[job_id].cancel()
+        else:
+            cancelled.append(job_id)
+
+    def listen() -> None:
+        for job_id in iter(control_queue.get, None):
+            loop.call_soon_threadsafe(cancel, job_id)
+
+    threading.Thread(target=listen, name="job-control", daemon=True).start()
+    # load the tokenizer before the first page needs it
+    loop.run_in_executor(None, get_encoding, CFG.fast_llm_model)
+
+    async def run(job_id: str, request: Dict[str, Any]) -> None:
+        try:
+            if job_id in cancelled:
+                event_queue.put(("finished", job_id, "cancelled", {}, None))
+                return
+            job = jobs[job_id] = ResearchJob(job_id)
+            job.task = asyncio.current_task()
+            event_queue.put(("started", job_id))
+            print(f"Worker {index} running research job {job_id}")
+            status, result, error = await run_job(job, request, QueueEventSink(event_queue, job_id))
+            event_queue.put(("finished", job_id, status, result, error))
+        finally:
+            jobs.pop(job_id, None)
+            slots.release()
+
+    running = set()
+    while True:
+        await slots.acquire()
+        item = await loop.run_in_executor(None, task_queue.get)
+        if item is None:
+            break
+        task = asyncio.create_task(run(*item))
+        running.add(task)
+        task.add_done_callback(running.discard)
+
+    for task in list(running):
+        task.cancel()
+    await asyncio.gather(*running, return_exceptions=True)
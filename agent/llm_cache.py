@@ -0,0 +1,112 @@
+"""Persistent cache of LLM responses."""
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from typing import Dict, Optional
+
+from agent.metrics import record_cache_lookup
+from agent.sqlite_cache import SQLiteCacheTable
+from config import Config
+
+CFG = Config()
+
+
+class LLMCache:
+    """A SQLite-backed cache of chat completions, keyed by a hash of the request.
+
+    Entries older than `max_age` seconds are dropped, and once the cached
+    responses exceed `max_bytes` the least recently used ones are evicted.
+    Safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        path: str = CFG.llm_cache_path,
+        max_bytes: int = CFG.llm_cache_max_bytes,
+        max_age: float = CFG.llm_cache_max_age,
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._table = SQLiteCacheTable(
+            path, "responses",
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, created REAL, last_used REAL",
+            key_column="key", created_column="created", max_bytes=max_bytes, max_age=max_age,
+        )
+
+    @staticmethod
+    def key(model: str, messages: list, temperature: float, max_tokens: Optional[int] = None) -> str:
+        """Hash the parts of a request that determine its response
+
+        Args:
+            model (str): The model of the request
+            messages (list[dict[str, str]]): The messages of the request
+            temperature (float): The temperature of the request
+            max_tokens (int, optional): The max completion tokens of the request
+
+        Returns:
+            str: The cache key
+        """
+        request = json.dumps([model, messages, temperature, max_tokens], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Get a cached response
+
+        Args:
+            key (str): The cache key of the request
+
+        Returns:
+            Optional[str]: The cached response, or None on a miss
+        """
+        with self._lock:
+            row = self._table.get(key, "response", time.time())
+            record_cache_lookup("llm", row is not None)
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, model: str, response: str) -> None:
+        """Cache a response, evicting old entries if the cache is over its size limit
+
+        Args:
+            key (str): The cache key of the request
+            model (str): The model that produced the response
+            response (str): The response to cache
+        """
+        now = time.time()
+        entry = {"key": key, "model": model, "response": response, "size": len(response.encode("utf-8")),
+                 "created": now, "last_used": now}
+        with self._lock:
+            self._table.put(entry, now)
+
+    def delete(self, key: str) -> None:
+        """Drop a cached response, e.g. one its caller couldn't parse
+
+        Args:
+            key (str): The cache key of the request
+        """
+        with self._lock:
+            self._table.delete(key)
+
+    def stats(self) -> Dict[str, float]:
+        """Hit and miss counts and the size of the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes": self._table.size,
+            }
+
+
+llm_cache = LLMCache()
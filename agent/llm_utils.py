@@ -1,25 +1,307 @@
 from __future__ import annotations
 
+import asyncio
 import json
+import random
+import threading
 
-from fastapi import WebSocket
+from fastapi import WebSocket, WebSocketDisconnect
 import time
 
+import aiohttp
 import openai
 from langchain.adapters import openai as lc_openai
 from colorama import Fore, Style
-from openai.error import APIError, RateLimitError
+from openai.error import (
+    APIConnectionError,
+    APIError,
+    RateLimitError,
+    ServiceUnavailableError,
+    Timeout,
+    TryAgain,
+)
 
+from agent.llm_cache import llm_cache
+from agent.metrics import LLM_REQUEST_SECONDS, record_llm_tokens
 from agent.prompts import auto_agent_instructions
+from agent.tracing import span, traced
 from config import Config
 
 CFG = Config()
 
 openai.api_key = CFG.openai_api_key
 
-from typing import Optional
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
 import logging
 
+T = TypeVar("T")
+
+# Errors worth retrying: the request may succeed if sent again a bit later
+TRANSIENT_ERRORS = (
+    APIConnectionError,
+    APIError,
+    RateLimitError,
+    ServiceUnavailableError,
+    Timeout,
+    TryAgain,
+    aiohttp.ClientError,
+    asyncio.TimeoutError,
+)
+
+_llm_semaphore: asyncio.Semaphore | None = None
+_aiosession: aiohttp.ClientSession | None = None
+
+
+def _validate_request(model, max_tokens, stream, websocket) -> None:
+    if model is None:
+        raise ValueError("Model cannot be None")
+    if max_tokens is not None and max_tokens > 8001:
+        raise ValueError(f"Max tokens cannot be more than 8001, but got {max_tokens}")
+    if stream and websocket is None:
+        raise ValueError("Websocket cannot be None when stream is True")
+
+
+def get_aiosession() -> aiohttp.ClientSession:
+    """Get the shared keep-alive HTTP session used by async OpenAI requests
+
+    Returns:
+        aiohttp.ClientSession: The pooled session
+    """
+    global _aiosession
+    if _aiosession is None or _aiosession.closed:
+        connector = aiohttp.TCPConnector(limit=CFG.llm_connection_limit, keepalive_timeout=60)
+        _aiosession = aiohttp.ClientSession(connector=connector)
+    return _aiosession
+
+
+async def close_aiosession() -> None:
+    """Close the shared HTTP session, if one was opened"""
+    global _aiosession
+    if _aiosession is not None and not _aiosession.closed:
+        await _aiosession.close()
+    _aiosession = None
+
+
+def get_llm_semaphore() -> asyncio.Semaphore:
+    """Get the semaphore bounding concurrent LLM requests in this process"""
+    global _llm_semaphore
+    if _llm_semaphore is None:
+        _llm_semaphore = asyncio.Semaphore(CFG.llm_concurrency)
+    return _llm_semaphore
+
+
+class TokenBucket:
+    """A budget of `per_minute` units that refills continuously.
+
+    Callers reserve units up front and are told how long to wait until the
+    reservation is covered, so waiters are served in arrival order without
+    holding a lock while they sleep. Safe to share between threads.
+    """
+
+    def __init__(self, per_minute: int) -> None:
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Reserve units from the bucket
+
+        Args:
+            amount (float): The units to take. Capped at the bucket capacity.
+
+        Returns:
+            float: Seconds to wait before the reservation is covered
+        """
+        with self._lock:
+            self._refill()
+            self.tokens -= min(amount, self.capacity)
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self, amount: float) -> None:
+        """Give back units of a reservation that was not used"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + min(amount, self.capacity))
+
+    def drain(self) -> None:
+        """Empty the bucket, e.g. after the provider reported a rate limit"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0)
+
+
+class ModelBudget:
+    """Request and token budgets plus queue statistics for one model"""
+
+    def __init__(self, rpm: int, tpm: int) -> None:
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.queued = 0
+        self.in_flight = 0
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def reserve(self, tokens: int) -> float:
+        return max(self.requests.reserve(1), self.tokens.reserve(tokens))
+
+    def refund(self, tokens: int) -> None:
+        self.requests.refund(1)
+        self.tokens.refund(tokens)
+
+    def record_wait(self, seconds: float) -> None:
+        self.calls += 1
+        self.total_wait += seconds
+        self.max_wait = max(self.max_wait, seconds)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "queue_depth": self.queued,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "avg_wait": self.total_wait / self.calls if self.calls else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+class LLMScheduler:
+    """Schedules LLM calls within per-model requests/tokens-per-minute budgets.
+
+    Calls are queued while a model's budget is exhausted and transient
+    errors are retried with jittered exponential backoff. A rate limit
+    reported by the provider drains the model's budget so that queued
+    calls back off together instead of hitting the limit one by one.
+    """
+
+    def __init__(self, max_retries: int = CFG.llm_max_retries, base_delay: float = 1.0,
+                 max_delay: float = 60.0) -> None:
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._budgets: Dict[str, ModelBudget] = {}
+        self._lock = threading.Lock()
+
+    def budget(self, model: str) -> ModelBudget:
+        """Get the budget for the given model, using the smart model limits for the smart model
+        and the fast model limits for everything else"""
+        with self._lock:
+            if model not in self._budgets:
+                if model == CFG.smart_llm_model:
+                    self._budgets[model] = ModelBudget(CFG.smart_llm_rpm, CFG.smart_llm_tpm)
+                else:
+                    self._budgets[model] = ModelBudget(CFG.fast_llm_rpm, CFG.fast_llm_tpm)
+            return self._budgets[model]
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff delay for the given retry attempt"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Queue depth, wait times and retry counts per model"""
+        with self._lock:
+            return {model: budget.stats() for model, budget in self._budgets.items()}
+
+    async def run(self, model: str, tokens: int, request: Callable[[], Awaitable[T]],
+                  retry_on: tuple = TRANSIENT_ERRORS) -> T:
+        """Run an async request once the model's budget allows it, retrying transient errors
+
+        Args:
+            model (str): The model the request is sent to
+            tokens (int): The estimated tokens used by the request
+            request (Callable[[], Awaitable]): Creates and sends the request
+            retry_on (tuple): The exception types to retry
+
+        Returns:
+            The result of the request
+        """
+        budget = self.budget(model)
+        for attempt in range(self.max_retries + 1):
+            wait = budget.reserve(tokens)
+            budget.queued += 1
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                budget.refund(tokens)
+                raise
+            finally:
+                budget.queued -= 1
+            budget.record_wait(wait)
+
+            budget.in_flight += 1
+            try:
+                return await request()
+            except retry_on as e:
+                if not self._should_retry(budget, attempt, e):
+                    raise
+            finally:
+                budget.in_flight -= 1
+            await asyncio.sleep(self.backoff(attempt))
+
+    def run_sync(self, model: str, tokens: int, request: Callable[[], T],
+                 retry_on: tuple = TRANSIENT_ERRORS) -> T:
+        """Blocking counterpart of `run` for callers on worker threads"""
+        budget = self.budget(model)
+        for attempt in range(self.max_retries + 1):
+            wait = budget.reserve(tokens)
+            budget.queued += 1
+            try:
+                time.sleep(wait)
+            finally:
+                budget.queued -= 1
+            budget.record_wait(wait)
+
+            budget.in_flight += 1
+            try:
+                return request()
+            except retry_on as e:
+                if not self._should_retry(budget, attempt, e):
+                    raise
+            finally:
+                budget.in_flight -= 1
+            time.sleep(self.backoff(attempt))
+
+    def _should_retry(self, budget: ModelBudget, attempt: int, error: Exception) -> bool:
+        if isinstance(error, RateLimitError):
+            budget.requests.drain()
+            budget.tokens.drain()
+        if attempt >= self.max_retries:
+            budget.failures += 1
+            logging.error(f"LLM request failed after {attempt + 1} attempts: {error}")
+            return False
+        budget.retries += 1
+        logging.warning(f"LLM request failed (attempt {attempt + 1}), retrying: {error}")
+        return True
+
+
+scheduler = LLMScheduler()
+
+
+def estimate_tokens(messages: list, max_tokens: Optional[int] = None) -> int:
+    """Roughly estimate the tokens a request uses: ~4 characters per prompt token
+    plus the completion allowance
+
+    Args:
+        messages (list[dict[str, str]]): The messages of the request
+        max_tokens (int, optional): The max completion tokens. Defaults to 1000 when None.
+
+    Returns:
+        int: The estimated number of tokens
+    """
+    prompt_chars = sum(len(message.get("content") or "") for message in messages)
+    return prompt_chars // 4 + (max_tokens or 1000)
+
+
 def create_chat_completion(
     messages: list,  # type: ignore
     model: Optional[str] = None,
@@ -27,6 +309,7 @@ def create_chat_completion(
     max_tokens: Optional[int] = None,
     stream: Optional[bool] = False,
     websocket: WebSocket | None = None,
+    use_cache: bool = True,
 ) -> str:
     """Create a chat completion using the OpenAI API
     Args:
@@ -35,27 +318,113 @@ def create_chat_completion(
         temperature (float, optional): The temperature to use. Defaults to 0.9.
         max_tokens (int, optional): The max tokens to use. Defaults to None.
         stream (bool, optional): Whether to stream the response. Defaults to False.
+        use_cache (bool, optional): Whether to use the LLM response cache. Defaults to True.
     Returns:
         str: The response from the chat completion
     """
 
     # validate input
-    if model is None:
-        raise ValueError("Model cannot be None")
-    if max_tokens is not None and max_tokens > 8001:
-        raise ValueError(f"Max tokens cannot be more than 8001, but got {max_tokens}")
-    if stream and websocket is None:
-        raise ValueError("Websocket cannot be None when stream is True")
+    _validate_request(model, max_tokens, stream, websocket)
+
+    cache_key = None
+    if use_cache and CFG.llm_cache_enabled and not stream:
+        cache_key = llm_cache.key(model, messages, temperature, max_tokens)
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
     # create response
-    for attempt in range(10):  # maximum of 10 attempts
-        response = send_chat_completion_request(
-            messages, model, temperature, max_tokens, stream, websocket
+    with span("create_chat_completion", model=model), LLM_REQUEST_SECONDS.labels(model).time():
+        response = scheduler.run_sync(
+            model,
+            estimate_tokens(messages, max_tokens),
+            lambda: send_chat_completion_request(messages, model, temperature, max_tokens, stream, websocket),
         )
-        return response
+    record_llm_tokens(model, messages, response)
+    if cache_key is not None:
+        llm_cache.set(cache_key, model, response)
+    return response
 
-    logging.error("Failed to get response from OpenAI API")
-    raise RuntimeError("Failed to get response from OpenAI API")
+
+@traced("create_chat_completion", "model", "stream")
+async def acreate_chat_completion(
+    messages: list,  # type: ignore
+    model: Optional[str] = None,
+    temperature: float = CFG.temperature,
+    max_tokens: Optional[int] = None,
+    stream: Optional[bool] = False,
+    websocket: WebSocket | None = None,
+    use_cache: bool = True,
+    validate: Optional[Callable[[str], Any]] = None,
+) -> str:
+    """Create a chat completion using the OpenAI API without blocking the event loop.
+
+    Requests share a pooled keep-alive HTTP session, at most
+    CFG.llm_concurrency of them are in flight per process and they are
+    scheduled within the model's rate limit budget by `scheduler`.
+    Responses are cached in `llm_cache` once `validate` accepts them; a
+    cached streamed response is replayed to the websocket as if it was
+    streamed.
+    Args:
+        messages (list[dict[str, str]]): The messages to send to the chat completion
+        model (str, optional): The model to use. Defaults to None.
+        temperature (float, optional): The temperature to use. Defaults to 0.9.
+        max_tokens (int, optional): The max tokens to use. Defaults to None.
+        stream (bool, optional): Whether to stream the response. Defaults to False.
+        websocket (WebSocket, optional): The websocket to stream to. Required when stream is True.
+        use_cache (bool, optional): Whether to use the LLM response cache. Defaults to True.
+        validate (Callable[[str], Any], optional): Checks a response before it is cached, e.g.
+            json.loads for a JSON reply, by raising on a response the caller can't use. Such a
+            response isn't cached and the error is raised; a cached one is dropped and requested again.
+    Returns:
+        str: The response from the chat completion
+    """
+    _validate_request(model, max_tokens, stream, websocket)
+    loop = asyncio.get_running_loop()
+
+    cache_key = None
+    if use_cache and CFG.llm_cache_enabled:
+        cache_key = llm_cache.key(model, messages, temperature, max_tokens)
+        cached = await loop.run_in_executor(None, llm_cache.get, cache_key)
+        if cached is not None and validate is not None:
+            try:
+                validate(cached)
+            except Exception:
+                await loop.run_in_executor(None, llm_cache.delete, cache_key)
+                cached = None
+        if cached is not None:
+            if stream:
+                await replay_response(cached, websocket)
+            return cached
+
+    # openai.aiosession is a context variable, so set it for the current task
+    openai.aiosession.set(get_aiosession())
+
+    async def request() -> str:
+        if stream:
+            return await stream_response(model, messages, temperature, max_tokens, websocket)
+        async with get_llm_semaphore():
+            result = await lc_openai.ChatCompletion.acreate(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                provider=CFG.llm_provider,
+                max_retries=0,  # retried by `scheduler`, which needs to see rate limits
+            )
+            return result["choices"][0]["message"]["content"]
+
+    # A stream that failed midway has already sent part of the report, so only
+    # retry it when it was rejected up front
+    retry_on = (RateLimitError,) if stream else TRANSIENT_ERRORS
+    with LLM_REQUEST_SECONDS.labels(model).time():
+        response = await scheduler.run(model, estimate_tokens(messages, max_tokens), request, retry_on)
+    await loop.run_in_executor(None, record_llm_tokens, model, messages, response)
+    if validate is not None:
+        validate(response)
+    if cache_key is not None:
+        await loop.run_in_executor(None, llm_cache.set, cache_key, model, response)
+    return response
 
 
 def send_chat_completion_request(
@@ -68,37 +437,141 @@ def send_chat_completion_request(
             temperature=temperature,
             max_tokens=max_tokens,
             provider=CFG.llm_provider, # Change provider here to use a different API
+            max_retries=0,  # retried by `scheduler`, which needs to see rate limits
         )
         return result["choices"][0]["message"]["content"]
     else:
         return stream_response(model, messages, temperature, max_tokens, websocket)
 
 
-async def stream_response(model, messages, temperature, max_tokens, websocket):
+class FlushPolicy:
+    """Decides when buffered streamed content is sent to the client.
+
+    Modes: "newline" sends whenever the buffer holds a line break, "time"
+    sends at most every `interval` seconds and "bytes" sends once the
+    buffer holds at least `max_bytes` bytes.
+    """
+
+    MODES = ("newline", "time", "bytes")
+
+    def __init__(
+        self,
+        mode: str = CFG.stream_flush_mode,
+        interval: float = CFG.stream_flush_interval,
+        max_bytes: int = CFG.stream_flush_bytes,
+    ) -> None:
+        if mode not in self.MODES:
+            raise ValueError(f"Stream flush mode must be one of {self.MODES}, but got {mode}")
+        self.mode = mode
+        self.interval = interval
+        self.max_bytes = max_bytes
+
+    def should_flush(self, buffer: str, since_flush: float) -> bool:
+        """Check whether the buffer should be sent
+
+        Args:
+            buffer (str): The content buffered since the last flush
+            since_flush (float): Seconds since the last flush
+
+        Returns:
+            bool: True if the buffer should be sent now
+        """
+        if self.mode == "newline":
+            return "\n" in buffer
+        if self.mode == "time":
+            return since_flush >= self.interval
+        return len(buffer.encode("utf-8")) >= self.max_bytes
+
+
+class StreamOverflowError(Exception):
+    """Raised when a client falls more than CFG.stream_buffer_size frames behind a streamed response"""
+
+
+async def stream_response(model, messages, temperature, max_tokens, websocket, flush_policy=None):
+    """Stream a chat completion to the websocket in frames chosen by the flush policy
+
+    The completion is read as fast as the model generates it, holding one of
+    the process's LLM slots, while the frames are sent to the websocket by a
+    separate task through a buffer of CFG.stream_buffer_size frames. A slow
+    client therefore never holds a slot; one that falls further behind than
+    the buffer fails its own session with StreamOverflowError.
+
+    Returns:
+        str: The whole response
+    """
+    flush_policy = flush_policy or FlushPolicy()
+    frames: asyncio.Queue = asyncio.Queue(maxsize=CFG.stream_buffer_size)
+    sender = asyncio.create_task(_send_frames(frames, websocket))
+
+    async def flush(output: str) -> None:
+        if sender.done():
+            await sender  # raises why the websocket stopped taking frames
+            raise WebSocketDisconnect(code=1006)
+        try:
+            frames.put_nowait(output)
+        except asyncio.QueueFull:
+            raise StreamOverflowError(
+                f"The client fell more than {frames.maxsize} frames behind the streamed response") from None
+
     paragraph = ""
     response = ""
+    last_flush = time.monotonic()
     print(f"streaming response...")
-
-    for chunk in lc_openai.ChatCompletion.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            provider=CFG.llm_provider,
-            stream=True,
-    ):
-        content = chunk["choices"][0].get("delta", {}).get("content")
-        if content is not None:
-            response += content
-            paragraph += content
-            if "\n" in paragraph:
-                await websocket.send_json({"type": "report", "output": paragraph})
-                paragraph = ""
+    try:
+        async with get_llm_semaphore():
+            chunks = await lc_openai.ChatCompletion.acreate(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                provider=CFG.llm_provider,
+                stream=True,
+                max_retries=0,  # retried by `scheduler`, which needs to see rate limits
+            )
+            async for chunk in chunks:
+                content = chunk["choices"][0].get("delta", {}).get("content")
+                if content is not None:
+                    response += content
+                    paragraph += content
+                    now = time.monotonic()
+                    if flush_policy.should_flush(paragraph, now - last_flush):
+                        await flush(paragraph)
+                        paragraph = ""
+                        last_flush = now
+        if paragraph:
+            await flush(paragraph)
+        # the slot is free again, wait for the client to receive the rest
+        end = asyncio.ensure_future(frames.put(None))
+        await asyncio.wait({end, sender}, return_when=asyncio.FIRST_COMPLETED)
+        end.cancel()
+        await sender
+    finally:
+        sender.cancel()
     print(f"streaming response complete")
     return response
 
 
-def choose_agent(task: str) -> str:
+async def _send_frames(frames: asyncio.Queue, websocket: WebSocket) -> None:
+    """Send the buffered frames of a streamed response until the None that ends them"""
+    while True:
+        output = await frames.get()
+        if output is None:
+            return
+        await websocket.send_json({"type": "report", "output": output})
+
+
+async def replay_response(response: str, websocket: WebSocket) -> None:
+    """Send a complete response to the websocket in the same report frames as a streamed one
+
+    Args:
+        response (str): The response to send
+        websocket (WebSocket): The websocket to send it to
+    """
+    for paragraph in response.splitlines(keepends=True):
+        await websocket.send_json({"type": "report", "output": paragraph})
+
+
+async def choose_agent(task: str) -> str:
     """Determines what agent should be used
     Args:
         task (str): The research question the user asked
@@ -107,12 +580,13 @@ def choose_agent(task: str) -> str:
         agent_role_prompt (str): The prompt for the agent
     """
     try:
-        response = create_chat_completion(
+        response = await acreate_chat_completion(
             model=CFG.smart_llm_model,
             messages=[
                 {"role": "system", "content": f"{auto_agent_instructions()}"},
                 {"role": "user", "content": f"task: {task}"}],
             temperature=0,
+            validate=json.loads,
         )
 
         return json.loads(response)
@@ -0,0 +1,73 @@
+"""Prometheus metrics of research runs, page scraping and LLM calls.
+
+The metrics are exposed at /metrics. When research runs in worker processes
+(RESEARCH_WORKERS > 0), set PROMETHEUS_MULTIPROC_DIR to an empty directory
+before starting the server, so the metrics of all processes are aggregated.
+"""
+from __future__ import annotations
+
+import os
+from typing import Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+from processing.tokens import count_tokens
+
+# Phases take from milliseconds (cache lookups) to minutes (whole runs)
+PHASE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+registry = CollectorRegistry()
+
+RESEARCH_PHASE_SECONDS = Histogram(
+    "gpt_researcher_research_phase_seconds", "Time spent in each phase of a research run",
+    ["phase"], buckets=PHASE_BUCKETS, registry=registry)
+SCRAPE_PHASE_SECONDS = Histogram(
+    "gpt_researcher_scrape_phase_seconds", "Time spent in each phase of browsing a page",
+    ["phase"], buckets=PHASE_BUCKETS, registry=registry)
+LLM_REQUEST_SECONDS = Histogram(
+    "gpt_researcher_llm_request_seconds", "Latency of LLM requests, including retries",
+    ["model"], buckets=PHASE_BUCKETS, registry=registry)
+LLM_TOKENS = Counter(
+    "gpt_researcher_llm_tokens", "Tokens sent to and generated by LLMs",
+    ["model", "kind"], registry=registry)
+CACHE_LOOKUPS = Counter(
+    "gpt_researcher_cache_lookups", "Cache lookups by cache and result (hit or miss)",
+    ["cache", "result"], registry=registry)
+BROWSERS = Gauge(
+    "gpt_researcher_browsers", "Pooled browsers by state (idle or busy)",
+    ["state"], registry=registry, multiprocess_mode="livesum")
+JOBS = Gauge(
+    "gpt_researcher_jobs", "Research jobs by status",
+    ["status"], registry=registry, multiprocess_mode="livesum")
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def record_llm_tokens(model: str, messages: list, response: str) -> None:
+    """Count the prompt and completion tokens of an LLM request. Tokenizing long
+    prompts takes a while, so call it off the event loop.
+
+    Args:
+        model (str): The model the request was sent to
+        messages (list[dict[str, str]]): The messages of the request
+        response (str): The generated text
+    """
+    prompt = sum(count_tokens(message.get("content") or "", model) for message in messages)
+    LLM_TOKENS.labels(model, "prompt").inc(prompt)
+    LLM_TOKENS.labels(model, "completion").inc(count_tokens(response, model))
+
+
+def render() -> Tuple[bytes, str]:
+    """Render the metrics of this process, or of all processes in multiprocess mode
+
+    Returns:
+        Tuple[bytes, str]: The metrics in the Prometheus text format and their content type
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        collected = CollectorRegistry()
+        multiprocess.MultiProcessCollector(collected)
+        return generate_latest(collected), CONTENT_TYPE_LATEST
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -3,19 +3,22 @@
 # libraries
 import asyncio
 import json
-import uuid
+import time
 
-from actions.web_search import web_search
+from actions.urls import VisitedIndex, visited_urls
+from actions.web_search import async_web_search
 from actions.web_scrape import async_browse
 from processing.text import \
-    write_to_file, \
     create_message, \
-    create_chat_completion, \
-    read_txt_files, \
     write_md_to_pdf
+from processing.dedup import NearDuplicateIndex
+from processing.ranking import report_context_budget, select_context
+from agent.llm_utils import acreate_chat_completion
+from agent.metrics import RESEARCH_PHASE_SECONDS
+from agent.tracing import traced
+from agent.workspace import Workspace
 from config import Config
 from agent import prompts
-import os
 import string
 
 
@@ -23,20 +26,31 @@ CFG = Config()
 
 
 class ResearchAgent:
-    def __init__(self, question, agent, agent_role_prompt, websocket):
+    def __init__(self, question, agent, agent_role_prompt, websocket, refresh=False, workspace_name=None):
         """ Initializes the research assistant with the given question.
         Args: question (str): The question to research
+                refresh (bool): Whether to redo research done earlier for the question
+                workspace_name (str): The workspace to use instead of the question's, e.g. while
+                    another run has the question's workspace
         Returns: None
         """
 
         self.question = question
         self.agent = agent
         self.agent_role_prompt = agent_role_prompt if agent_role_prompt else prompts.generate_agent_role_prompt(agent)
-        self.visited_urls = set()
+        # shared by the concurrent queries of the run; a run never skips a source because
+        # another run visited it, it only reuses the text that run cached
+        self.visited_urls = VisitedIndex()
         self.research_summary = ""
-        self.directory_name = uuid.uuid4()
-        self.dir_path = os.path.dirname(f"./outputs/{self.directory_name}/")
+        # earlier runs for the same question and agent are resumed from its checkpoints
+        self.workspace = Workspace(question, agent, refresh, name=workspace_name)
+        self.directory_name = self.workspace.id
+        self.dir_path = self.workspace.path
         self.websocket = websocket
+        # jobs that started earlier get their pages loaded first
+        self.scrape_priority = time.monotonic()
+        # text seen across all queries of the run, so mirrored pages are summarized once
+        self.duplicates = NearDuplicateIndex() if CFG.dedup_enabled else None
 
 
     async def summarize(self, text, topic):
@@ -49,7 +63,7 @@ class ResearchAgent:
         messages = [create_message(text, topic)]
         await self.websocket.send_json({"type": "logs", "output": f"📝 Summarizing text for query: {text}"})
 
-        return create_chat_completion(
+        return await acreate_chat_completion(
             model=CFG.fast_llm_model,
             messages=messages,
         )
@@ -62,14 +76,18 @@ class ResearchAgent:
 
         new_urls = []
         for url in url_set_input:
-            if url not in self.visited_urls:
-                await self.websocket.send_json({"type": "logs", "output": f"✅ Adding source url to research: {url}\n"})
-                self.visited_urls.add(url)
+            # variants of a url are visited once; marking the url before yielding
+            # keeps concurrent queries from both claiming it
+            if self.visited_urls.add(url):
                 new_urls.append(url)
+                await self.websocket.send_json({"type": "logs", "output": f"✅ Adding source url to research: {url}\n"})
+                if CFG.visited_urls_shared:
+                    # counts the urls visited by several runs; the page cache serves their text
+                    visited_urls.add(url)
 
         return new_urls
 
-    async def call_agent(self, action, stream=False, websocket=None):
+    async def call_agent(self, action, stream=False, websocket=None, validate=None):
         messages = [{
             "role": "system",
             "content": self.agent_role_prompt
@@ -77,37 +95,69 @@ class ResearchAgent:
             "role": "user",
             "content": action,
         }]
-        answer = create_chat_completion(
+        answer = await acreate_chat_completion(
             model=CFG.smart_llm_model,
             messages=messages,
             stream=stream,
             websocket=websocket,
+            validate=validate,
         )
         return answer
 
+    @traced()
     async def create_search_queries(self):
         """ Creates the search queries for the given question.
         Args: None
         Returns: list[str]: The search queries for the given question
         """
-        result = await self.call_agent(prompts.generate_search_queries_prompt(self.question))
+        if self.workspace.queries:
+            await self.websocket.send_json(
+                {"type": "logs", "output": f"♻️ Resuming research based on the following queries: {self.workspace.queries}..."})
+            return self.workspace.queries
+
+        with RESEARCH_PHASE_SECONDS.labels("create_queries").time():
+            # a reply that isn't a JSON list of queries isn't cached, so a retry asks again
+            result = await self.call_agent(prompts.generate_search_queries_prompt(self.question), validate=json.loads)
         print(result)
         await self.websocket.send_json({"type": "logs", "output": f"🧠 I will conduct my research based on the following queries: {result}..."})
-        return json.loads(result)
+        queries = json.loads(result)
+        self.workspace.set_queries(queries)
+        return queries
+
+    async def browse(self, url, query):
+        """ Browses the given url for the given query, or reuses its summary from an earlier run.
+        Args: url (str): The url to browse
+                query (str): The query to browse the url for
+        Returns: str: The information gathered from the url
+        """
+        result = self.workspace.page(url)
+        if result is not None:
+            await self.websocket.send_json({"type": "logs", "output": f"♻️ Reusing what an earlier run gathered from {url}"})
+            return result
+
+        with RESEARCH_PHASE_SECONDS.labels("browse").time():
+            result = await async_browse(url, query, self.websocket, self.scrape_priority, self.duplicates)
+        # failed pages are retried when the research is resumed
+        if not result.startswith("Error processing the url"):
+            self.workspace.save_page(url, result)
+        return result
 
+    @traced("async_search", "query")
     async def async_search(self, query):
         """ Runs the async search for the given query.
         Args: query (str): The query to run the async search for
         Returns: list[str]: The async search for the given query
         """
-        search_results = json.loads(web_search(query))
-        new_search_urls = self.get_new_urls([url.get("href") for url in search_results])
+        with RESEARCH_PHASE_SECONDS.labels("search").time():
+            search_results = await async_web_search(query)
+        new_search_urls = await self.get_new_urls(
+            [result.get("href") for result in search_results if result.get("href")])
 
         await self.websocket.send_json(
             {"type": "logs", "output": f"🌐 Browsing the following sites for relevant information: {new_search_urls}..."})
 
         # Create a list to hold the coroutine objects
-        tasks = [async_browse(url, query, self.websocket) for url in await new_search_urls]
+        tasks = [self.browse(url, query) for url in new_search_urls]
 
         # Gather the results as they become available
         responses = await asyncio.gather(*tasks, return_exceptions=True)
@@ -122,26 +172,51 @@ class ResearchAgent:
 
         await self.websocket.send_json({"type": "logs", "output": f"🔎 Running research for '{query}'..."})
 
-        responses = await self.async_search(query)
+        with RESEARCH_PHASE_SECONDS.labels("query").time():
+            responses = await self.async_search(query)
 
-        result = "\n".join(responses)
-        os.makedirs(os.path.dirname(f"./outputs/{self.directory_name}/research-{query}.txt"), exist_ok=True)
-        write_to_file(f"./outputs/{self.directory_name}/research-{query}.txt", result)
+        result = "\n".join(response for response in responses if isinstance(response, str))
+        # a query with failed pages is left incomplete, so resuming the research retries them
+        if not any(isinstance(response, BaseException) or response.startswith("Error processing the url")
+                   for response in responses):
+            self.workspace.complete(query, result)
         return result
 
+    @traced()
     async def conduct_research(self):
         """ Conducts the research for the given question.
         Args: None
         Returns: str: The research for the given question
         """
 
-        self.research_summary = read_txt_files(self.dir_path) if os.path.isdir(self.dir_path) else ""
-
-        if not self.research_summary:
-            search_queries = await self.create_search_queries()
-            for query in search_queries:
-                research_result = await self.run_search_summary(query)
-                self.research_summary += f"{research_result}\n\n"
+        self.research_summary = ""
+        search_queries = await self.create_search_queries()
+        semaphore = asyncio.Semaphore(CFG.max_concurrent_queries)
+
+        async def run_query(query):
+            research = self.workspace.completed(query)
+            if research is not None:
+                await self.websocket.send_json({"type": "logs", "output": f"♻️ Reusing the research for '{query}'"})
+                return research
+            async with semaphore:
+                return await self.run_search_summary(query)
+
+        # run the queries concurrently, but merge their results in query order
+        with RESEARCH_PHASE_SECONDS.labels("research").time():
+            research_results = await asyncio.gather(*[run_query(query) for query in search_queries],
+                                                    return_exceptions=True)
+        for query, research_result in zip(search_queries, research_results):
+            if isinstance(research_result, Exception):
+                await self.websocket.send_json(
+                    {"type": "logs", "output": f"⚠️ Research for '{query}' failed: {research_result}"})
+                continue
+            self.research_summary += f"{research_result}\n\n"
+
+        if self.duplicates is not None and self.duplicates.tokens_saved:
+            stats = self.duplicates.stats()
+            await self.websocket.send_json({"type": "logs", "output": (
+                f"♊ Skipped {stats['duplicate_pages']} duplicate pages and {stats['dropped_blocks']} near-duplicate "
+                f"blocks of text, saving ~{stats['tokens_saved']} tokens of summarization")})
 
         await self.websocket.send_json(
             {"type": "logs", "output": f"Total research words: {len(self.research_summary.split(' '))}"})
@@ -154,11 +229,12 @@ class ResearchAgent:
         Args: None
         Returns: list[str]: The concepts for the given question
         """
-        result = self.call_agent(prompts.generate_concepts_prompt(self.question, self.research_summary))
+        result = await self.call_agent(prompts.generate_concepts_prompt(self.question, self.research_summary))
 
         await self.websocket.send_json({"type": "logs", "output": f"I will research based on the following concepts: {result}\n"})
         return json.loads(result)
 
+    @traced()
     async def write_report(self, report_type, websocket):
         """ Writes the report for the given question.
         Args: None
@@ -167,10 +243,21 @@ class ResearchAgent:
         report_type_func = prompts.get_report_by_type(report_type)
         await websocket.send_json(
             {"type": "logs", "output": f"✍️ Writing {report_type} for research task: {self.question}..."})
-        answer = await self.call_agent(report_type_func(self.question, self.research_summary), stream=True,
-                                       websocket=websocket)
-
-        path = await write_md_to_pdf(report_type, self.directory_name, await answer)
+        # ranking the passages of a long research summary takes a while, so do it off the event loop
+        with RESEARCH_PHASE_SECONDS.labels("select_context").time():
+            budget = report_context_budget([self.agent_role_prompt, report_type_func(self.question, "")])
+            context, passages, total_passages = await asyncio.get_running_loop().run_in_executor(
+                None, select_context, self.research_summary, self.question, budget)
+        if passages:
+            sources = len({passage.source for passage in passages if passage.source})
+            await websocket.send_json(
+                {"type": "logs", "output": f"📚 Using the {len(passages)} most relevant of {total_passages} research passages, from {sources} sources"})
+        with RESEARCH_PHASE_SECONDS.labels("write_report").time():
+            answer = await self.call_agent(report_type_func(self.question, context), stream=True,
+                                           websocket=websocket)
+
+        with RESEARCH_PHASE_SECONDS.labels("save_report").time():
+            path = await write_md_to_pdf(report_type, self.directory_name, answer)
 
         return answer, path
 
@@ -181,5 +268,6 @@ class ResearchAgent:
         """
         concepts = await self.create_concepts()
         for concept in concepts:
-            answer = await self.call_agent(prompts.generate_lesson_prompt(concept), stream=True)
-            write_md_to_pdf("Lesson", self.directory_name, answer)
+            answer = await self.call_agent(prompts.generate_lesson_prompt(concept), stream=True,
+                                           websocket=self.websocket)
+            await write_md_to_pdf("Lesson", self.directory_name, answer)
@@ -1,59 +1,206 @@
 import asyncio
 import datetime
+import os
 
-from typing import List, Dict
-from fastapi import WebSocket
-from config import check_openai_api_key
+from typing import List, Dict, Optional, Set, Tuple
+from fastapi import WebSocket, WebSocketDisconnect
+from config import Config, check_openai_api_key
+from agent.job import current_job
+from agent.metrics import RESEARCH_PHASE_SECONDS
 from agent.research_agent import ResearchAgent
+from agent.storage import outputs_store
+from agent.tracing import current_trace, span, start_trace
+from agent.workspace import workspace_id
+
+CFG = Config()
+
+# Seconds a stopped job's last events may take to reach the client before it is unsubscribed
+STOP_FORWARD_TIMEOUT = 5.0
+
+
+class QueuedWebSocket:
+    """A websocket whose messages go through its connection's bounded send queue.
+
+    send_json waits while the queue is full, so a slow client holds back
+    only the session that is sending to it.
+    """
+
+    def __init__(self, websocket: WebSocket, queue: asyncio.Queue, sender_task: asyncio.Task):
+        self.websocket = websocket
+        self.queue = queue
+        self.sender_task = sender_task
+
+    async def send_json(self, message: dict) -> None:
+        if self.sender_task.done():
+            raise WebSocketDisconnect(code=1006)
+        try:
+            self.queue.put_nowait(message)
+            return
+        except asyncio.QueueFull:
+            pass
+
+        put = asyncio.ensure_future(self.queue.put(message))
+        await asyncio.wait({put, self.sender_task}, return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+            raise WebSocketDisconnect(code=1006)
 
 
 class WebSocketManager:
-    def __init__(self):
+    def __init__(self, jobs):
+        self.jobs = jobs
         self.active_connections: List[WebSocket] = []
         self.sender_tasks: Dict[WebSocket, asyncio.Task] = {}
         self.message_queues: Dict[WebSocket, asyncio.Queue] = {}
+        self.queued_websockets: Dict[WebSocket, QueuedWebSocket] = {}
+        self.subscriptions: Dict[WebSocket, Tuple[str, asyncio.Task]] = {}
+        self.owned_jobs: Dict[WebSocket, Set[str]] = {}
 
     async def start_sender(self, websocket: WebSocket):
         queue = self.message_queues[websocket]
         while True:
             message = await queue.get()
-            if websocket in self.active_connections:
-                await websocket.send_text(message)
-            else:
+            if websocket not in self.active_connections:
+                break
+            try:
+                await websocket.send_json(message)
+            except Exception as e:
+                print(f"Error sending to websocket, closing its send queue: {e}")
                 break
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
         self.active_connections.append(websocket)
-        self.message_queues[websocket] = asyncio.Queue()
+        self.message_queues[websocket] = asyncio.Queue(maxsize=CFG.websocket_queue_size)
         self.sender_tasks[websocket] = asyncio.create_task(self.start_sender(websocket))
+        self.queued_websockets[websocket] = QueuedWebSocket(
+            websocket, self.message_queues[websocket], self.sender_tasks[websocket])
+        self.owned_jobs[websocket] = set()
 
     async def disconnect(self, websocket: WebSocket):
+        self.unsubscribe(websocket)
+        # jobs submitted through the websocket stop with it, jobs it only followed keep running
+        for job_id in self.owned_jobs.pop(websocket):
+            self.jobs.cancel(job_id)
         self.active_connections.remove(websocket)
         self.sender_tasks[websocket].cancel()
         del self.sender_tasks[websocket]
         del self.message_queues[websocket]
-
-    async def start_streaming(self, task, report_type, agent, agent_role_prompt, websocket):
-        report, path = await run_agent(task, report_type, agent, agent_role_prompt, websocket)
-        return report, path
-
-
-async def run_agent(task, report_type, agent, agent_role_prompt, websocket):
+        del self.queued_websockets[websocket]
+
+    def queued(self, websocket: WebSocket) -> QueuedWebSocket:
+        """Get the queued sender of a connected websocket"""
+        return self.queued_websockets[websocket]
+
+    def subscribed_job(self, websocket: WebSocket) -> Optional[str]:
+        """Get the id of the unfinished job a websocket follows, if any"""
+        subscription = self.subscriptions.get(websocket)
+        if subscription is None or subscription[1].done():
+            return None
+        return subscription[0]
+
+    def start_job(self, websocket: WebSocket, request: dict) -> Optional[str]:
+        """Submit a research job for a websocket and follow it
+
+        Args:
+            websocket (WebSocket): The websocket the research reports to
+            request (dict): The research request: task, report_type and agent
+
+        Returns:
+            Optional[str]: The id of the job, or None if the websocket already follows a running job
+        """
+        if self.subscribed_job(websocket) is not None:
+            return None
+        job_id = self.jobs.submit(request)
+        self.owned_jobs[websocket].add(job_id)
+        self.subscribe(websocket, job_id)
+        return job_id
+
+    def subscribe(self, websocket: WebSocket, job_id: str, start: int = 0) -> bool:
+        """Forward the events of a job to a websocket, from the given event index
+
+        Returns:
+            bool: False if there is no such job
+        """
+        record = self.jobs.get(job_id)
+        if record is None:
+            return False
+        self.unsubscribe(websocket)
+        forwarder = asyncio.create_task(self._forward(websocket, record, start))
+        self.subscriptions[websocket] = (job_id, forwarder)
+        return True
+
+    def unsubscribe(self, websocket: WebSocket) -> None:
+        subscription = self.subscriptions.pop(websocket, None)
+        if subscription is not None:
+            subscription[1].cancel()
+
+    async def stop_job(self, websocket: WebSocket) -> bool:
+        """Cancel the job a websocket follows
+
+        Returns:
+            bool: True if a job was running
+        """
+        job_id = self.subscribed_job(websocket)
+        if job_id is None or not self.jobs.cancel(job_id):
+            return False
+        # let the forwarder pass on what the job sent before it stopped, unless the client is stuck
+        forwarder = self.subscriptions[websocket][1]
+        await asyncio.wait({forwarder}, timeout=STOP_FORWARD_TIMEOUT)
+        if not forwarder.done():
+            self.unsubscribe(websocket)
+        return True
+
+    async def _forward(self, websocket: WebSocket, record, start: int):
+        events = record.follow(start)
+        try:
+            async for event in events:
+                await self.queued(websocket).send_json(event)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            # stop following at once, so the job no longer waits for this client
+            await events.aclose()
+            if record.done:
+                self.owned_jobs.get(websocket, set()).discard(record.id)
+
+
+async def run_agent(task, report_type, agent, agent_role_prompt, websocket, refresh=False):
     check_openai_api_key()
 
     start_time = datetime.datetime.now()
 
     # await websocket.send_json({"type": "logs", "output": f"Start time: {str(start_time)}\n\n"})
 
-    assistant = ResearchAgent(task, agent, agent_role_prompt, websocket)
-    await assistant.conduct_research()
-
-    report, path = await assistant.write_report(report_type, websocket)
+    job = current_job.get()
+    trace_name = job.id if job else start_time.strftime("%Y%m%d-%H%M%S")
+    trace = start_trace(trace_name)
+
+    # the workspace is kept from retention from before it is opened until the run is done with it
+    loop = asyncio.get_running_loop()
+    directory_name = await loop.run_in_executor(None, outputs_store.claim, workspace_id(task, agent))
+    try:
+        if directory_name != workspace_id(task, agent):
+            await websocket.send_json(
+                {"type": "logs", "output": "👥 Another run is researching the same question, this run starts afresh"})
+        assistant = ResearchAgent(task, agent, agent_role_prompt, websocket, refresh, directory_name)
+        try:
+            with span("run_agent", task=task, report_type=report_type, agent=agent):
+                await assistant.conduct_research()
+
+                report, path = await assistant.write_report(report_type, websocket)
+        finally:
+            if trace is not None:
+                current_trace.set(None)
+                trace_path = os.path.join(assistant.dir_path, f"trace-{trace_name}.json")
+                await loop.run_in_executor(None, trace.save, trace_path)
+    finally:
+        await loop.run_in_executor(None, outputs_store.release, directory_name)
 
     await websocket.send_json({"type": "path", "output": path})
 
     end_time = datetime.datetime.now()
+    RESEARCH_PHASE_SECONDS.labels("run").observe((end_time - start_time).total_seconds())
     await websocket.send_json({"type": "logs", "output": f"\nEnd time: {end_time}\n"})
     await websocket.send_json({"type": "logs", "output": f"\nTotal run time: {end_time - start_time}\n"})
 
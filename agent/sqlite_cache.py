@@ -0,0 +1,118 @@
+"""SQLite storage of caches whose entries expire and are evicted by size."""
+from __future__ import annotations
+
+import os
+import sqlite3
+import time
+from typing import Any, Callable, Dict, Optional
+
+
+class SQLiteCacheTable:
+    """A SQLite table of cache entries with a time to live and a size limit.
+
+    Entries whose `created_column` is older than `max_age` seconds are
+    expired, and once the entries' `size` column adds up to more than
+    `max_bytes` the least recently used ones are evicted, down to 90% of
+    it. `schema` must declare `key_column` as primary key and the
+    `created_column`, `size` and `last_used` columns; `on_evict` is called
+    with the key of each entry evicted for size. Not thread-safe: the
+    caches using it hold their own lock around every call.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        table: str,
+        schema: str,
+        key_column: str,
+        created_column: str,
+        max_bytes: int,
+        max_age: float,
+        on_evict: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        self.path = path
+        self.table = table
+        self.schema = schema
+        self.key_column = key_column
+        self.created_column = created_column
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.on_evict = on_evict
+        self.size = 0
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def connect(self) -> sqlite3.Connection:
+        """Open the database on first use, creating the table and dropping expired entries"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} ({self.schema})")
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_last_used ON {self.table} (last_used)")
+            self.evict(time.time())
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key: str, columns: str, now: float) -> Optional[tuple]:
+        """Get columns of an entry that hasn't expired, marking it as used
+
+        Returns:
+            Optional[tuple]: The values of the columns, or None on a miss
+        """
+        conn = self.connect()
+        row = conn.execute(
+            f"SELECT {columns} FROM {self.table} WHERE {self.key_column} = ? AND {self.created_column} >= ?",
+            (key, now - self.max_age),
+        ).fetchone()
+        if row is not None:
+            conn.execute(f"UPDATE {self.table} SET last_used = ? WHERE {self.key_column} = ?", (now, key))
+            conn.commit()
+        return row
+
+    def put(self, entry: Dict[str, Any], now: float) -> None:
+        """Insert or replace an entry, evicting others if the table is over its size limit
+
+        Args:
+            entry (Dict[str, Any]): The columns of the entry, including its key and size
+            now (float): The current time
+        """
+        conn = self.connect()
+        key = entry[self.key_column]
+        old = conn.execute(f"SELECT size FROM {self.table} WHERE {self.key_column} = ?", (key,)).fetchone()
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self.table} ({', '.join(entry)}) VALUES ({', '.join('?' * len(entry))})",
+            tuple(entry.values()),
+        )
+        self.size += entry["size"] - (old[0] if old else 0)
+        if self.size > self.max_bytes:
+            self.evict(now)
+        conn.commit()
+
+    def delete(self, key: str) -> None:
+        conn = self.connect()
+        old = conn.execute(f"SELECT size FROM {self.table} WHERE {self.key_column} = ?", (key,)).fetchone()
+        if old is None:
+            return
+        conn.execute(f"DELETE FROM {self.table} WHERE {self.key_column} = ?", (key,))
+        self.size -= old[0]
+        conn.commit()
+
+    def evict(self, now: float) -> None:
+        """Drop expired entries, then the least recently used ones until the table is
+        back under 90% of max_bytes"""
+        conn = self._conn
+        conn.execute(f"DELETE FROM {self.table} WHERE {self.created_column} < ?", (now - self.max_age,))
+        self.size = conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+        if self.size <= self.max_bytes:
+            return
+        excess = self.size - int(self.max_bytes * 0.9)
+        freed = 0
+        for key, size in conn.execute(
+                f"SELECT {self.key_column}, size FROM {self.table} ORDER BY last_used").fetchall():
+            if freed >= excess:
+                break
+            conn.execute(f"DELETE FROM {self.table} WHERE {self.key_column} = ?", (key,))
+            if self.on_evict is not None:
+                self.on_evict(key)
+            freed += size
+        self.size -= freed
@@ -0,0 +1,239 @@
+"""Retention, compaction and indexing of the research outputs directory."""
+from __future__ import annotations
+
+import gzip
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from config import Config
+
+CFG = Config()
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class OutputsStore:
+    """The research workspaces under the outputs directory, with an index of their files.
+
+    Workspaces are kept for `max_age` seconds after their last change, and
+    once the outputs exceed `max_bytes` the least recently changed ones are
+    deleted first. Workspaces pinned by a running job are never deleted.
+    Pins are kept in the index, so they hold across worker processes; the
+    pins of processes that died are ignored. When a run finishes its raw
+    research text is gzipped and its files are indexed, so artifacts are
+    listed without scanning the directory tree. Safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        root: str = "outputs",
+        index_path: str = CFG.outputs_index_path,
+        max_age: float = CFG.outputs_max_age,
+        max_bytes: int = CFG.outputs_max_bytes,
+        compress: bool = CFG.outputs_compress,
+    ) -> None:
+        self.root = root
+        self.index_path = index_path
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.deleted = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def pin(self, workspace: str) -> None:
+        """Keep a workspace from being deleted while this process uses it"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT INTO pins (workspace, pid, since) VALUES (?, ?, ?)",
+                         (workspace, os.getpid(), time.time()))
+            conn.commit()
+
+    def claim(self, workspace: str) -> str:
+        """Pin a workspace for a run, or a workspace of the run's own if another run has it
+        pinned, so that two runs never write to the same workspace
+
+        Args:
+            workspace (str): The workspace of the run's question
+
+        Returns:
+            str: The pinned workspace, either the given one or one named after it
+        """
+        with self._lock:
+            conn = self._connect()
+            self._drop_dead_pins()
+            # locks the index against writes, so no other process claims the workspace meanwhile
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if conn.execute("SELECT 1 FROM pins WHERE workspace = ? LIMIT 1", (workspace,)).fetchone():
+                    workspace = f"{workspace}-{uuid.uuid4().hex[:8]}"
+                conn.execute("INSERT INTO pins (workspace, pid, since) VALUES (?, ?, ?)",
+                             (workspace, os.getpid(), time.time()))
+            finally:
+                conn.commit()
+        return workspace
+
+    def release(self, workspace: str) -> None:
+        """Compress the research text of a workspace a run is done with, index it and unpin it
+
+        The workspace stays pinned while it is compressed, and it is only compressed
+        if no other run has it pinned, as that run may still be writing to it.
+        """
+        with self._lock:
+            conn = self._connect()
+            self._drop_dead_pins()
+            pins = conn.execute("SELECT COUNT(*) FROM pins WHERE workspace = ?", (workspace,)).fetchone()[0]
+        if self.compress and pins <= 1:
+            self.compact(workspace)
+        self.index(workspace)
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT rowid FROM pins WHERE workspace = ? AND pid = ? LIMIT 1",
+                               (workspace, os.getpid())).fetchone()
+            if row is not None:
+                conn.execute("DELETE FROM pins WHERE rowid = ?", row)
+                conn.commit()
+
+    def compact(self, workspace: str) -> None:
+        """Gzip the raw research text of a workspace"""
+        path = os.path.join(self.root, workspace)
+        if not os.path.isdir(path):
+            return
+        for name in os.listdir(path):
+            if not (name.startswith("research-") and name.endswith(".txt")):
+                continue
+            source = os.path.join(path, name)
+            with open(source, "rb") as plain, gzip.open(f"{source}.gz.tmp", "wb") as compressed:
+                shutil.copyfileobj(plain, compressed)
+            os.replace(f"{source}.gz.tmp", f"{source}.gz")
+            os.remove(source)
+
+    def index(self, workspace: str) -> None:
+        """Record the files of a workspace in the index"""
+        path = os.path.join(self.root, workspace)
+        files = []
+        if os.path.isdir(path):
+            for entry in os.scandir(path):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    files.append((workspace, entry.name, stat.st_size, stat.st_mtime))
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM artifacts WHERE workspace = ?", (workspace,))
+            conn.executemany("INSERT INTO artifacts (workspace, name, size, modified) VALUES (?, ?, ?, ?)", files)
+            conn.commit()
+
+    def rebuild(self) -> None:
+        """Index every workspace in the outputs directory, e.g. after files were changed by hand"""
+        workspaces = [entry.name for entry in os.scandir(self.root) if entry.is_dir()] \
+            if os.path.isdir(self.root) else []
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM artifacts")
+            conn.commit()
+        for workspace in workspaces:
+            self.index(workspace)
+
+    def artifacts(self, workspace: str) -> List[str]:
+        """The names of the files of a workspace, from the index"""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT name FROM artifacts WHERE workspace = ? ORDER BY name", (workspace,)).fetchall()
+        return [name for name, in rows]
+
+    def lookup(self, workspace: str, name: str) -> Optional[Dict[str, float]]:
+        """The size and modification time of a workspace file, from the index"""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT size, modified FROM artifacts WHERE workspace = ? AND name = ?", (workspace, name)).fetchone()
+        return {"size": row[0], "modified": row[1]} if row else None
+
+    def enforce(self) -> List[str]:
+        """Delete the unpinned workspaces that are past max_age, then the least recently
+        changed ones until the outputs fit in max_bytes
+
+        Returns:
+            List[str]: The deleted workspaces
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            self._drop_dead_pins()
+            pinned = {workspace for workspace, in conn.execute("SELECT DISTINCT workspace FROM pins")}
+            workspaces = conn.execute(
+                "SELECT workspace, SUM(size), MAX(modified) FROM artifacts GROUP BY workspace ORDER BY MAX(modified)"
+            ).fetchall()
+
+        total = sum(size for _, size, _ in workspaces)
+        deleted = []
+        for workspace, size, modified in workspaces:
+            if workspace in pinned:
+                continue
+            if now - modified > self.max_age or total > self.max_bytes:
+                if self._delete(workspace):
+                    total -= size
+                    deleted.append(workspace)
+
+        if deleted:
+            self.deleted += len(deleted)
+            print(f"Deleted {len(deleted)} research workspaces from {self.root}")
+        return deleted
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            conn = self._connect()
+            workspaces, files, size = conn.execute(
+                "SELECT COUNT(DISTINCT workspace), COUNT(*), COALESCE(SUM(size), 0) FROM artifacts").fetchone()
+            pinned = conn.execute("SELECT COUNT(DISTINCT workspace) FROM pins").fetchone()[0]
+        return {"workspaces": workspaces, "files": files, "bytes": size, "pinned": pinned, "deleted": self.deleted}
+
+    def _delete(self, workspace: str) -> bool:
+        """Delete a workspace unless it was pinned since the pins were last read. The index
+        is locked against writes meanwhile, so no process can pin the workspace while
+        it is being deleted."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if conn.execute("SELECT 1 FROM pins WHERE workspace = ? LIMIT 1", (workspace,)).fetchone():
+                    return False
+                shutil.rmtree(os.path.join(self.root, workspace), ignore_errors=True)
+                conn.execute("DELETE FROM artifacts WHERE workspace = ?", (workspace,))
+                return True
+            finally:
+                conn.commit()
+
+    def _drop_dead_pins(self) -> None:
+        conn = self._conn
+        dead = [(pid,) for pid, in conn.execute("SELECT DISTINCT pid FROM pins") if not _pid_alive(pid)]
+        conn.executemany("DELETE FROM pins WHERE pid = ?", dead)
+        conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.index_path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS artifacts (workspace TEXT, name TEXT, size INTEGER, modified REAL,"
+                " PRIMARY KEY (workspace, name))"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS pins (workspace TEXT, pid INTEGER, since REAL)")
+            self._conn.commit()
+        return self._conn
+
+
+outputs_store = OutputsStore()
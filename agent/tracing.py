@@ -0,0 +1,184 @@
+"""Span timelines of research runs, saved in the Chrome trace event format."""
+from __future__ import annotations
+
+import asyncio
+import functools
+import inspect
+import json
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+from config import Config
+
+CFG = Config()
+
+
+class Trace:
+    """The spans of one research run.
+
+    Spans are saved as complete ("X") events of the Chrome trace event
+    format, viewable in chrome://tracing or Perfetto. Each asyncio task or
+    thread gets its own row, so work that ran concurrently is shown side by
+    side and work that was serialized is shown one after the other. Every
+    span records its id and the id of the span it was started in.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.pid = os.getpid()
+        self.events: List[Dict[str, Any]] = []
+        self._started = time.perf_counter()
+        self._span_ids = 0
+        self._lanes: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def now(self) -> float:
+        """Microseconds since the trace started"""
+        return (time.perf_counter() - self._started) * 1e6
+
+    def next_span_id(self) -> int:
+        with self._lock:
+            self._span_ids += 1
+            return self._span_ids
+
+    def lane(self, name: str) -> int:
+        """The row of the current asyncio task, or of the current thread outside a task"""
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        key = id(task) if task is not None else threading.get_ident()
+        with self._lock:
+            lane = self._lanes.get(key)
+            if lane is None:
+                lane = self._lanes[key] = len(self._lanes) + 1
+                # the row is named after the first span that ran in it
+                self.events.append({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": lane,
+                                    "args": {"name": name}})
+        return lane
+
+    def add(self, event: Dict[str, Any]) -> None:
+        with self._lock:
+            self.events.append(event)
+
+    def to_json(self) -> str:
+        with self._lock:
+            events = list(self.events)
+        return json.dumps({"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"name": self.name}})
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as file:
+            file.write(self.to_json())
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+current_span: ContextVar[int] = ContextVar("current_span", default=0)
+
+
+class Span:
+    """Records the time spent in a with block as a span of the current trace"""
+
+    __slots__ = ("trace", "name", "args", "span_id", "lane", "started", "_token")
+
+    def __init__(self, trace: Trace, name: str, args: Dict[str, Any]) -> None:
+        self.trace = trace
+        self.name = name
+        self.args = args
+
+    def __enter__(self) -> Span:
+        self.span_id = self.trace.next_span_id()
+        self.args["span_id"] = self.span_id
+        self.args["parent_id"] = current_span.get()
+        self.lane = self.trace.lane(self.name)
+        self._token = current_span.set(self.span_id)
+        self.started = self.trace.now()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        ended = self.trace.now()
+        current_span.reset(self._token)
+        if exc_type is not None:
+            self.args["error"] = repr(exc) if exc is not None else exc_type.__name__
+        self.trace.add({"name": self.name, "cat": "research", "ph": "X", "ts": self.started,
+                        "dur": ended - self.started, "pid": self.trace.pid, "tid": self.lane, "args": self.args})
+
+
+class _NoSpan:
+    """Stands in for a span when the run isn't traced"""
+
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        return None
+
+
+NO_SPAN = _NoSpan()
+
+
+def span(name: str, **args: Any):
+    """A span of the current trace, for use as a with block. Costs one context
+    variable lookup when the run isn't traced.
+
+    Args:
+        name (str): The name of the span
+        **args: Details shown with the span, e.g. the url or model
+
+    Returns:
+        A context manager timing the block
+    """
+    trace = current_trace.get()
+    if trace is None:
+        return NO_SPAN
+    return Span(trace, name, args)
+
+
+def traced(name: Optional[str] = None, *arg_names: str) -> Callable:
+    """Decorate an async function to record each call as a span
+
+    Args:
+        name (str, optional): The name of the span. Defaults to the function name.
+        *arg_names (str): Arguments of the function to show with the span
+
+    Returns:
+        The decorator
+    """
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__name__
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            trace = current_trace.get()
+            if trace is None:
+                return await func(*args, **kwargs)
+            bound = signature.bind_partial(*args, **kwargs).arguments
+            details = {arg: str(bound[arg])[:200] for arg in arg_names if arg in bound}
+            with Span(trace, span_name, details):
+                return await func(*args, **kwargs)
+
+        return wrapper
+    return decorator
+
+
+def start_trace(name: str, sample_rate: float = CFG.trace_sample_rate) -> Optional[Trace]:
+    """Start tracing the current task, for a sampled share of the calls
+
+    Args:
+        name (str): The name of the trace, e.g. the job id
+        sample_rate (float): The share of the runs to trace, from 0 (none) to 1 (all)
+
+    Returns:
+        Optional[Trace]: The trace, or None if this run isn't sampled
+    """
+    if sample_rate <= 0 or random.random() >= sample_rate:
+        return None
+    trace = Trace(name)
+    current_trace.set(trace)
+    return trace
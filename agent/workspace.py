@@ -0,0 +1,151 @@
+"""Research workspaces that checkpoint a run's progress, so it can be resumed."""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import os
+import uuid
+from typing import Dict, List, Optional
+
+from actions.urls import canonicalize_url
+from processing.text import write_to_file
+
+MANIFEST = "manifest.json"
+PAGES = "pages.jsonl"
+
+
+def workspace_id(question: str, agent: str) -> str:
+    """The id of the workspace of a question researched by an agent
+
+    Args:
+        question (str): The research question
+        agent (str): The agent researching it
+
+    Returns:
+        str: A hash of the normalized question and agent
+    """
+    key = json.dumps([" ".join(question.lower().split()), agent.strip()])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+class Workspace:
+    """The output directory of a question, with a manifest of the research done in it.
+
+    The manifest records the search queries and the file of each query whose
+    research is complete, and is rewritten after each of those steps. The summary of every
+    page browsed is appended to a log of pages. An interrupted or repeated run
+    picks up from the last completed step. With `refresh`, earlier research is
+    ignored and replaced.
+
+    A workspace is written by one run at a time: a run started while another
+    has the question's workspace is given a workspace `name` of its own, see
+    OutputsStore.claim.
+    """
+
+    def __init__(self, question: str, agent: str, refresh: bool = False, root: str = "./outputs",
+                 name: Optional[str] = None) -> None:
+        self.id = name or workspace_id(question, agent)
+        self.path = os.path.join(root, self.id)
+        os.makedirs(self.path, exist_ok=True)
+        self.manifest = {"question": question, "agent": agent, "queries": None, "completed": {}}
+        self.pages: Dict[str, str] = {}
+        if refresh:
+            write_to_file(os.path.join(self.path, PAGES), "")
+        else:
+            self._load()
+
+    @property
+    def queries(self) -> Optional[List[str]]:
+        """The search queries of the research, if they were created already"""
+        return self.manifest["queries"]
+
+    def set_queries(self, queries: List[str]) -> None:
+        self.manifest["queries"] = queries
+        self._save()
+
+    def research_path(self, query: str) -> str:
+        """The file of a query's research, named by a hash of the query, which may contain any character"""
+        digest = hashlib.sha256(query.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.path, f"research-{digest}.txt")
+
+    def completed(self, query: str) -> Optional[str]:
+        """The research of a completed query
+
+        Returns:
+            Optional[str]: The research, or None if the query isn't complete
+        """
+        filename = self.manifest["completed"].get(query)
+        if filename is None:
+            return None
+        path = os.path.join(self.path, filename)
+        try:
+            if os.path.exists(path):
+                with open(path, "r") as file:
+                    return file.read()
+            # compressed when the run that wrote it finished
+            with gzip.open(f"{path}.gz", "rt") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def complete(self, query: str, research: str) -> None:
+        """Save the research of a query and record it as complete"""
+        path = self.research_path(query)
+        write_to_file(path, research)
+        self.manifest["completed"][query] = os.path.basename(path)
+        self._save()
+
+    def page(self, url: str) -> Optional[str]:
+        """The summary of a page browsed earlier, if any"""
+        return self.pages.get(canonicalize_url(url))
+
+    def save_page(self, url: str, summary: str) -> None:
+        """Record the summary of a browsed page, appending it to the log of pages"""
+        key = canonicalize_url(url)
+        self.pages[key] = summary
+        with open(os.path.join(self.path, PAGES), "a") as file:
+            file.write(json.dumps({"url": key, "summary": summary}) + "\n")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queries": len(self.queries or []),
+            "completed_queries": len(self.manifest["completed"]),
+            "pages": len(self.pages),
+        }
+
+    def _load(self) -> None:
+        try:
+            with open(os.path.join(self.path, MANIFEST), "r") as file:
+                manifest = json.load(file)
+        except FileNotFoundError:
+            manifest = {}
+        except (OSError, ValueError) as e:
+            print(f"Ignoring the unreadable manifest of workspace {self.id}: {e}")
+            manifest = {}
+        self.manifest.update({key: manifest[key] for key in ("queries", "completed") if key in manifest})
+        pages_path = os.path.join(self.path, PAGES)
+        line = ""
+        try:
+            with open(pages_path, "r") as file:
+                for line in file:
+                    try:
+                        page = json.loads(line)
+                    except ValueError:
+                        continue  # the last record of an interrupted run may be cut off
+                    self.pages[page["url"]] = page["summary"]
+            if line and not line.endswith("\n"):
+                # start the next record on a line of its own
+                with open(pages_path, "a") as file:
+                    file.write("\n")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Ignoring the unreadable pages of workspace {self.id}: {e}")
+
+    def _save(self) -> None:
+        # written to a temporary file of its own first, so an interrupted write never leaves a broken manifest
+        path = os.path.join(self.path, MANIFEST)
+        temporary = f"{path}.{uuid.uuid4().hex}.tmp"
+        write_to_file(temporary, json.dumps(self.manifest, indent=2))
+        os.replace(temporary, path)
@@ -0,0 +1,74 @@
+"""Benchmark of relevance-ranked context selection.
+
+Times processing.ranking.select_context, and each of its stages, on synthetic
+research summaries shaped like the ones ResearchAgent collects: one summary
+per browsed page, introduced by the page's url.
+
+Usage: python -m benchmarks.context_ranking [--repeat N] [--budget TOKENS]
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from typing import Callable
+
+from benchmarks.corpus import WORDS, _sentence
+from processing.ranking import bm25_scores, pack_passages, select_context, split_passages
+from processing.text import count_tokens
+
+QUESTION = "How does the browser pool keep page loads from waiting for startup?"
+
+
+def synthetic_research(rng: random.Random, pages: int) -> str:
+    """Generate research text with summaries of the given number of pages"""
+    summaries = []
+    for page in range(pages):
+        paragraphs = "\n".join(
+            " ".join(_sentence(rng) for _ in range(rng.randint(2, 6))) for _ in range(rng.randint(3, 12))
+        )
+        summaries.append(f"Information gathered from url https://example.com/page/{page}: {paragraphs}")
+    return "\n".join(summaries)
+
+
+def best_of(repeat: int, run: Callable[[], object]) -> float:
+    """Best wall-clock seconds of `repeat` runs"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per size; the best is reported")
+    parser.add_argument("--budget", type=int, default=5000, help="the token budget of the context")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    print(f"{len(set(WORDS))} word vocabulary, question: {QUESTION}")
+    for pages in (10, 100, 1000, 5000):
+        research = synthetic_research(rng, pages)
+        passages = split_passages(research)
+        texts = [passage.text for passage in passages]
+        scores = bm25_scores(texts, QUESTION)
+
+        split = best_of(args.repeat, lambda: split_passages(research))
+        score = best_of(args.repeat, lambda: bm25_scores(texts, QUESTION))
+        pack = best_of(args.repeat, lambda: pack_passages(passages, scores, args.budget))
+        total = best_of(args.repeat, lambda: select_context(research, QUESTION, args.budget))
+
+        context, selected, _ = select_context(research, QUESTION, args.budget)
+        megabytes = len(research.encode("utf-8")) / 1e6
+        print(
+            f"{pages:5} pages, {megabytes:6.2f} MB, {count_tokens(research):8} -> {count_tokens(context):5} tokens, "
+            f"{len(passages):6} -> {len(selected):3} passages: "
+            f"split {split * 1000:7.1f} ms, score {score * 1000:7.1f} ms, pack {pack * 1000:6.1f} ms, "
+            f"total {total * 1000:7.1f} ms ({megabytes / total:.1f} MB/s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Test pages for the benchmarks.
+
+Saved real-world pages (*.html) in benchmarks/corpus/ are used when there are
+any, e.g. saved from a browser or with `curl -o benchmarks/corpus/<name>.html <url>`.
+Otherwise a deterministic synthetic corpus shaped like news and blog pages is
+generated: navigation, nested layout, scripts and styles, inline markup in
+paragraphs, and headings nested in paragraphs.
+"""
+from __future__ import annotations
+
+import random
+from pathlib import Path
+from typing import List, Tuple
+
+CORPUS_DIR = Path(__file__).parent / "corpus"
+
+WORDS = (
+    "the research agent scrapes pages and summarizes their text for each query while the "
+    "browser pool keeps warm drivers ready so that page loads never wait for startup and "
+    "results are merged into a report with sources numbers facts and statistics"
+).split()
+
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(6, 24))]
+    words[0] = words[0].capitalize()
+    return " ".join(words) + "."
+
+
+def synthetic_page(rng: random.Random, paragraphs: int) -> str:
+    """Generate an HTML page with the given number of article paragraphs"""
+    nav = "".join(f'<li><a href="/section/{i}">Section {i}</a></li>' for i in range(20))
+    body = []
+    for i in range(paragraphs):
+        if i % 12 == 0:
+            body.append(f"<h2>{_sentence(rng)}</h2>")
+        sentences = " ".join(_sentence(rng) for _ in range(rng.randint(2, 6)))
+        link = f'<a href="https://example.com/ref/{i}">reference {i}</a>'
+        body.append(f'<div class="para"><p>{sentences} See <b>{link}</b>.  <span>{_sentence(rng)}</span></p></div>')
+        if i % 25 == 0:
+            body.append(f"<script>var tracking{i} = {{'id': {i}}};</script><style>.x{i} {{color: red}}</style>")
+    return (
+        "<!DOCTYPE html><html><head><meta charset='utf-8'><title>Synthetic page</title>"
+        "<script>window.analytics = [];</script><style>body {font-family: sans-serif}</style></head>"
+        f"<body><header><nav><ul>{nav}</ul></nav></header>"
+        f"<main><article><h1>{_sentence(rng)}</h1>{''.join(body)}</article></main>"
+        f"<aside><p>Related: <h3>{_sentence(rng)}</h3></p></aside>"
+        "<footer><p>Copyright</p></footer></body></html>"
+    )
+
+
+def load_corpus() -> List[Tuple[str, str]]:
+    """Load the benchmark pages
+
+    Returns:
+        List[Tuple[str, str]]: The name and HTML of each page
+    """
+    pages = [(path.name, path.read_text(encoding="utf-8", errors="replace"))
+             for path in sorted(CORPUS_DIR.glob("*.html"))]
+    if pages:
+        return pages
+    rng = random.Random(42)
+    return [(f"synthetic-{size}.html", synthetic_page(rng, size)) for size in (10, 50, 200, 1000, 5000)]
@@ -0,0 +1,52 @@
+"""Benchmark of near-duplicate elimination.
+
+Runs processing.dedup.NearDuplicateIndex over a batch of distinct synthetic
+pages followed by mirrored copies of some of them, with a different header
+and footer and a few edits, as syndicated articles have.
+
+Usage: python -m benchmarks.dedup [--pages N] [--mirrors N]
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import time
+
+from benchmarks.corpus import _sentence
+from processing.dedup import NearDuplicateIndex
+
+
+def synthetic_text(rng: random.Random, paragraphs: int) -> str:
+    """Generate page text with the given number of paragraphs"""
+    return "\n".join(" ".join(_sentence(rng) for _ in range(rng.randint(2, 8))) for _ in range(paragraphs))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=300, help="distinct pages")
+    parser.add_argument("--mirrors", type=int, default=100, help="mirrored copies of the first pages")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    pages = [synthetic_text(rng, rng.randint(10, 60)) for _ in range(args.pages)]
+    mirrors = [f"Syndicated by example.org\n{page.replace(' the ', ' a ', 3)}\nShare this article"
+               for page in pages[:args.mirrors]]
+    megabytes = sum(len(text) for text in pages + mirrors) / 1e6
+
+    index = NearDuplicateIndex()
+    started = time.perf_counter()
+    for number, text in enumerate(pages):
+        index.deduplicate(f"https://example.com/{number}", text)
+    distinct = time.perf_counter() - started
+    for number, text in enumerate(mirrors):
+        index.deduplicate(f"https://mirror.example.org/{number}", text)
+    total = time.perf_counter() - started
+
+    print(f"{len(pages)} pages + {len(mirrors)} mirrors, {megabytes:.2f} MB")
+    print(f"distinct pages: {distinct * 1000:.0f} ms ({distinct / len(pages) * 1000:.2f} ms/page)")
+    print(f"all pages:      {total * 1000:.0f} ms ({megabytes / total:.1f} MB/s)")
+    print(index.stats())
+
+
+if __name__ == "__main__":
+    main()
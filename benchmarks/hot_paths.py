@@ -0,0 +1,265 @@
+"""Micro-benchmarks of the text processing that runs on every page, with a stored baseline.
+
+Times processing.text.split_text, actions.web_scrape.get_text,
+processing.html.split_phrases (the line and phrase cleanup of the scraped
+text), processing.html.extract_hyperlinks and format_hyperlinks, and
+processing.text.read_txt_files, on inputs from small pages to multi-megabyte
+documents. Each case reports the median of several timed samples, each
+repeating the call for at least 0.2 seconds, taken over a few rounds that
+interleave the cases.
+
+Results are compared with the baseline of the tokenizer setup in use and
+cases more than --threshold slower are flagged as regressions, failing the
+run. Each
+timing is taken right after timing a fixed pure-Python workload, and cases
+are compared by their cost relative to it, so that the machine running
+slower for a while, as shared machines do, isn't taken for a regression;
+slower cases are also re-timed (--confirm times). Cases that take less than
+--min-seconds per call are too noisy to fail the run and are only reported.
+Record the baseline on the machine that runs the comparison. split_text
+counts tokens with tiktoken, or estimates them when its data can't be
+downloaded, so each setup has a baseline of its own:
+benchmarks/hot_paths_baseline.tiktoken.json and
+benchmarks/hot_paths_baseline.estimate.json. A run without a baseline for
+its setup fails, so the gate never passes without comparing split_text.
+
+Usage: python -m benchmarks.hot_paths [--filter TEXT] [--threshold 0.25] [--min-seconds 0.001] [--save-baseline]
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Collection, Dict, List, Optional, Tuple
+
+from bs4 import BeautifulSoup
+
+from actions.web_scrape import get_text
+from benchmarks.corpus import _sentence, synthetic_page
+from config import Config
+from processing.html import extract_hyperlinks, extract_text, format_hyperlinks, split_phrases
+from processing.text import get_encoding, read_txt_files, split_text
+
+CFG = Config()
+BASELINE_DIR = Path(__file__).parent
+# Paragraph counts of the synthetic pages, from a short article to a ~2.4 MB document
+PAGE_SIZES = (10, 200, 1000, 5000)
+# Bytes of research text read by read_txt_files
+RESEARCH_SIZES = (100_000, 1_000_000, 8_000_000)
+
+
+def median_time(run: Callable[[], Any], samples: int = 7, min_sample_seconds: float = 0.2) -> float:
+    """Median seconds per call of `samples` samples, each repeating the call for at least min_sample_seconds"""
+    started = time.perf_counter()
+    run()
+    once = time.perf_counter() - started
+    number = max(1, int(min_sample_seconds / once)) if once > 0 else 1000
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        for _ in range(number):
+            run()
+        timings.append((time.perf_counter() - started) / number)
+    return statistics.median(timings)
+
+
+def calibration_work() -> int:
+    """A fixed pure-Python workload, timed next to every case as a measure of the machine's current speed"""
+    total = 0
+    for i in range(50_000):
+        total += len(str(i)) * (i & 7)
+    return total
+
+
+def research_text(rng: random.Random, size: int) -> str:
+    """Research summaries like those saved by run_search_summary, of about `size` bytes"""
+    parts = []
+    length = 0
+    page = 0
+    while length < size:
+        paragraph = " ".join(_sentence(rng) for _ in range(rng.randint(3, 12)))
+        part = f"Information gathered from url https://example.com/page/{page}: {paragraph}\n"
+        parts.append(part)
+        length += len(part)
+        page += 1
+    return "".join(parts)
+
+
+def build_cases(directory: str) -> List[Tuple[str, int, Callable[[], Any]]]:
+    """The benchmark cases: a name, the input size in bytes and the call to time
+
+    Args:
+        directory (str): A scratch directory for the files read by read_txt_files
+    """
+    rng = random.Random(42)
+    cases = []
+    for paragraphs in PAGE_SIZES:
+        html = synthetic_page(rng, paragraphs)
+        soup = BeautifulSoup(html, "lxml")
+        text = extract_text(html)
+        element_text = soup.get_text()
+        hyperlinks = extract_hyperlinks(soup, "https://example.com/article")
+        size = f"{paragraphs}p"
+
+        cases.append((f"split_text/{size}", len(text.encode("utf-8")), lambda text=text: list(split_text(text))))
+        cases.append((f"get_text/{size}", len(html.encode("utf-8")), lambda soup=soup: get_text(soup)))
+        cases.append((f"split_phrases/{size}", len(element_text.encode("utf-8")),
+                      lambda element_text=element_text: split_phrases(element_text)))
+        cases.append((f"extract_hyperlinks/{size}", len(html.encode("utf-8")),
+                      lambda soup=soup: extract_hyperlinks(soup, "https://example.com/article")))
+        cases.append((f"format_hyperlinks/{size}", sum(len(text) + len(url) for text, url in hyperlinks),
+                      lambda hyperlinks=hyperlinks: format_hyperlinks(hyperlinks)))
+
+    for size in RESEARCH_SIZES:
+        research_dir = os.path.join(directory, f"research-{size}")
+        os.makedirs(research_dir)
+        # a workspace has one research file per query; finished runs keep them gzipped
+        for query in range(4):
+            text = research_text(rng, size // 4)
+            if query % 2:
+                with gzip.open(os.path.join(research_dir, f"research-query {query}.txt.gz"), "wt") as file:
+                    file.write(text)
+            else:
+                with open(os.path.join(research_dir, f"research-query {query}.txt"), "w") as file:
+                    file.write(text)
+        cases.append((f"read_txt_files/{size // 1000}kB", size,
+                      lambda research_dir=research_dir: read_txt_files(research_dir)))
+    return cases
+
+
+def baseline_path(tokenizer: bool) -> Path:
+    """The baseline file of a tokenizer setup"""
+    return BASELINE_DIR / f"hot_paths_baseline.{'tiktoken' if tokenizer else 'estimate'}.json"
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "tokenizer": get_encoding(CFG.fast_llm_model) is not None,
+    }
+
+
+def run_cases(name_filter: str, samples: int, rounds: int, names: Optional[Collection[str]] = None) -> Dict[str, Any]:
+    """Time the cases in `rounds` interleaved rounds, each case right after the calibration
+    workload. A case's cost relative to the calibration holds while the machine runs
+    slower for a while, which a shared machine does for minutes at a time."""
+    with tempfile.TemporaryDirectory() as directory:
+        cases = [case for case in build_cases(directory)
+                 if name_filter in case[0] and (names is None or case[0] in names)]
+        timings: Dict[str, List[float]] = {name: [] for name, _, _ in cases}
+        relative: Dict[str, List[float]] = {name: [] for name, _, _ in cases}
+        for _ in range(rounds):
+            for name, _, run in cases:
+                calibration = median_time(calibration_work, samples, min_sample_seconds=0.1)
+                seconds = median_time(run, samples)
+                timings[name].append(seconds)
+                relative[name].append(seconds / calibration)
+        results = {}
+        for name, size, _ in cases:
+            seconds = statistics.median(timings[name])
+            results[name] = {"seconds": seconds, "relative": statistics.median(relative[name]), "bytes": size}
+            print(f"{name:28} {seconds * 1000:10.3f} ms  {size / seconds / 1e6 if seconds else 0:8.1f} MB/s")
+    return {"environment": environment(), "results": results}
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float, min_seconds: float) -> List[str]:
+    """Compare timings with the baseline, relative to the calibration workload timed
+    next to them, so the machine's speed at the time doesn't count
+
+    Returns:
+        List[str]: The cases that regressed by more than the threshold, among those
+            taking at least min_seconds per call
+    """
+    if any(baseline["environment"].get(key) != current["environment"][key] for key in ("python", "machine")):
+        print("the baseline was recorded with another Python version or machine, timings may not compare")
+
+    regressions = []
+    print(f"\n{'case':28} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, result in current["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            print(f"{name:28} {'-':>12} {result['seconds'] * 1000:9.3f} ms  not in the baseline")
+            continue
+        seconds = result["seconds"]
+        change = result["relative"] / old["relative"] - 1
+        flag = ""
+        if change > threshold:
+            if max(seconds, old["seconds"]) < min_seconds:
+                flag = "  slower (too short to fail the run)"
+            else:
+                flag = "  REGRESSION"
+                regressions.append(name)
+        elif change < -threshold:
+            flag = "  faster"
+        print(f"{name:28} {old['seconds'] * 1000:9.3f} ms {seconds * 1000:9.3f} ms {change:+8.1%}{flag}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="only run the cases whose name contains this text")
+    parser.add_argument("--samples", type=int, default=5, help="timed samples per case and round")
+    parser.add_argument("--rounds", type=int, default=3,
+                        help="rounds of timing every case; the median over all rounds is reported")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="the slowdown over the baseline that counts as a regression, e.g. 0.25 for 25%%")
+    parser.add_argument("--min-seconds", type=float, default=0.001,
+                        help="cases faster than this per call are reported but never fail the run")
+    parser.add_argument("--confirm", type=int, default=2,
+                        help="times to re-time the cases that were slower; a case that is faster in any "
+                             "of them isn't a regression")
+    parser.add_argument("--baseline", type=Path,
+                        help="the baseline file. Defaults to the one of the tokenizer setup in use")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="record the results as the new baseline instead of comparing with it")
+    args = parser.parse_args()
+
+    current = run_cases(args.filter, args.samples, args.rounds)
+    args.baseline = args.baseline or baseline_path(current["environment"]["tokenizer"])
+    if args.save_baseline:
+        if args.filter and args.baseline.exists():
+            # keep the cases that weren't run
+            baseline = json.loads(args.baseline.read_text())
+            baseline["results"].update(current["results"])
+            current["results"] = baseline["results"]
+        args.baseline.write_text(json.dumps(current, indent=2, sort_keys=True) + "\n")
+        print(f"saved the baseline to {args.baseline}")
+        return
+
+    if not args.baseline.exists():
+        print(f"no baseline at {args.baseline}, record one for this tokenizer setup with --save-baseline")
+        sys.exit(1)
+    baseline = json.loads(args.baseline.read_text())
+    if baseline["environment"].get("tokenizer") != current["environment"]["tokenizer"]:
+        print(f"{args.baseline} was recorded with another tokenizer setup, so split_text can't be compared")
+        sys.exit(1)
+    regressions = compare(current, baseline, args.threshold, args.min_seconds)
+    for _ in range(args.confirm):
+        if not regressions:
+            break
+        # the speed of a shared machine drifts, so a case only regressed if it stays slower
+        print(f"\nre-timing the {len(regressions)} cases that were slower")
+        retimed = run_cases(args.filter, args.samples, args.rounds, regressions)
+        for name, result in retimed["results"].items():
+            if result["relative"] < current["results"][name]["relative"]:
+                current["results"][name] = result
+        regressions = compare(
+            {"environment": current["environment"], "results": {name: current["results"][name] for name in regressions}},
+            baseline, args.threshold, args.min_seconds)
+    if regressions:
+        print(f"\n{len(regressions)} cases regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    print(f"\nno regressions beyond {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Benchmark of HTML-to-text extraction.
+
+Compares the previous extraction (BeautifulSoup with html.parser, string
+concatenation, separate cleanup passes and a second parse for links) with
+processing.html.extract_text_and_links over the benchmark corpus.
+
+Usage: python -m benchmarks.html_extraction [--repeat N]
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from typing import Callable, List, Tuple
+
+from bs4 import BeautifulSoup
+
+from benchmarks.corpus import load_corpus
+from processing.html import extract_hyperlinks, extract_text_and_links
+
+
+def legacy_extract(html: str, base_url: str) -> Tuple[str, List[Tuple[str, str]]]:
+    """The extraction as it was done before extract_text_and_links"""
+    soup = BeautifulSoup(html, "html.parser")
+    for script in soup(["script", "style"]):
+        script.extract()
+    text = ""
+    for element in soup.find_all(["h1", "h2", "h3", "h4", "h5", "p"]):
+        text += element.text + "\n\n"
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    text = "\n".join(chunk for chunk in chunks if chunk)
+
+    soup = BeautifulSoup(html, "html.parser")
+    for script in soup(["script", "style"]):
+        script.extract()
+    return text, extract_hyperlinks(soup, base_url)
+
+
+def measure(extract: Callable[[str, str], tuple], pages: List[Tuple[str, str]], repeat: int) -> float:
+    """Best wall-clock seconds of `repeat` runs over all pages"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _, html in pages:
+            extract(html, "https://example.com/")
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per implementation; the best is reported")
+    args = parser.parse_args()
+
+    pages = load_corpus()
+    megabytes = sum(len(html.encode("utf-8")) for _, html in pages) / 1e6
+    print(f"{len(pages)} pages, {megabytes:.2f} MB")
+
+    for name, html in pages:
+        legacy_text, _ = legacy_extract(html, "https://example.com/")
+        text, links = extract_text_and_links(html, "https://example.com/")
+        print(f"  {name}: {len(legacy_text)} -> {len(text)} characters of text, {len(links)} links")
+
+    legacy = measure(legacy_extract, pages, args.repeat)
+    current = measure(extract_text_and_links, pages, args.repeat)
+    print(f"legacy:  {legacy:.3f}s ({megabytes / legacy:.1f} MB/s)")
+    print(f"current: {current:.3f}s ({megabytes / current:.1f} MB/s)")
+    print(f"speedup: {legacy / current:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
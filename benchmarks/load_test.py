@@ -0,0 +1,461 @@
+"""Offline end-to-end benchmark and load test of research runs.
+
+OpenAI, web search and the websites are replaced by the local stand-ins of
+benchmarks.standins, so runs are repeatable and need no network or API key.
+N simulated clients each run research tasks one after the other, either
+through the /ws endpoint of a server (--target ws) or by calling run_agent
+directly (--target run_agent). Either way the code under test runs in its
+own process, which is what the RSS and thread counts are measured on.
+
+Reports throughput, p50/p95/p99 run latency and time to the first report
+text, peak RSS and the peak browser and thread counts. Results are saved as
+JSON under benchmarks/results/ and compared with the previous result of the
+same target and load, so successive commits can be compared.
+
+The server runs research jobs in its own process (RESEARCH_WORKERS=0), as
+the local search stand-in isn't installed in worker processes. The LLM and
+page caches and the LLM rate limits are disabled unless set otherwise in the
+environment, so every run does the full work without waiting on budgets the
+fake model doesn't have. Settings like HOST_SCRAPE_DELAY are taken from the
+environment as usual.
+
+Usage: python -m benchmarks.load_test [--target ws|run_agent] [--clients N] [--runs N]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import glob
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+from benchmarks.standins import LocalSearch, StandinOptions, Standins
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+
+
+def percentile(values: List[float], p: float) -> float:
+    """The p-th percentile of the values, by the nearest-rank method"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "max": max(values, default=0.0),
+    }
+
+
+def process_status(pid: int) -> Dict[str, int]:
+    """Peak and current RSS in kB and the thread count of a process, from /proc on Linux"""
+    status = {}
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                key, _, value = line.partition(":")
+                if key in ("VmHWM", "VmRSS", "Threads"):
+                    status[key] = int(value.split()[0])
+    except OSError:
+        if pid == os.getpid():
+            status = {"VmHWM": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                      "Threads": threading.active_count()}
+    return status
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def benchmark_env(api_base: str, workdir: str) -> Dict[str, str]:
+    """The environment of the research code under test"""
+    env = {
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "benchmark"),
+        "OPENAI_API_BASE": api_base,
+        "RESEARCH_WORKERS": "0",
+        "LLM_CACHE_ENABLED": os.environ.get("LLM_CACHE_ENABLED", "False"),
+        "PAGE_CACHE_ENABLED": os.environ.get("PAGE_CACHE_ENABLED", "False"),
+        "BROWSER_POOL_WARM": os.environ.get("BROWSER_POOL_WARM", "0"),
+        # the fake model has no rate limits to stay within
+        **{limit: os.environ.get(limit, str(10 ** 9))
+           for limit in ("FAST_LLM_RPM", "FAST_LLM_TPM", "SMART_LLM_RPM", "SMART_LLM_TPM")},
+        "PDF_MODE": "lazy",
+        "BENCHMARK_WORKDIR": workdir,
+    }
+    return env
+
+
+def serve(port: int, env: Dict[str, str], site_urls: List[str], pages: int, search_latency: float) -> None:
+    """Run the server under test. Runs in a separate process."""
+    # main mounts the client directory relative to the repository
+    os.chdir(REPO_DIR)
+    import uvicorn
+
+    import main
+    from actions.web_search import set_search_backend
+
+    set_search_backend(LocalSearch(site_urls, pages, search_latency))
+    os.chdir(env["BENCHMARK_WORKDIR"])
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+class RunResult:
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.seconds: Optional[float] = None
+        self.first_report: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def report(self) -> None:
+        if self.first_report is None:
+            self.first_report = time.perf_counter() - self.started
+
+    def finish(self, error: Optional[str] = None) -> None:
+        self.seconds = time.perf_counter() - self.started
+        self.error = error
+
+
+class Sampler:
+    """Samples the process and browser counts of the system under test while it runs"""
+
+    def __init__(self, pid: int, browser_stats) -> None:
+        self.pid = pid
+        self.browser_stats = browser_stats
+        self.max_threads = 0
+        self.max_busy_browsers = 0
+        self.browsers: Dict[str, int] = {}
+        self.status: Dict[str, int] = {}
+
+    async def sample(self) -> None:
+        self.status = process_status(self.pid)
+        self.max_threads = max(self.max_threads, self.status.get("Threads", 0))
+        try:
+            self.browsers = await self.browser_stats()
+        except Exception:
+            return
+        self.max_busy_browsers = max(self.max_busy_browsers, self.browsers.get("busy", 0))
+
+    async def run(self, interval: float = 0.25) -> None:
+        while True:
+            await self.sample()
+            await asyncio.sleep(interval)
+
+    def usage(self) -> Dict[str, Any]:
+        return {"peak_rss_kb": self.status.get("VmHWM", 0), "max_threads": self.max_threads,
+                "max_busy_browsers": self.max_busy_browsers, "browsers": self.browsers}
+
+
+async def ws_client(session: aiohttp.ClientSession, url: str, client: int, runs: int, timeout: float,
+                    results: List[RunResult]) -> None:
+    """Run research tasks one after the other over one websocket, as the web client does"""
+    async with session.ws_connect(f"{url}/ws", max_msg_size=0) as ws:
+        for run in range(runs):
+            result = RunResult()
+            results.append(result)
+            request = {"task": f"benchmark question {client}-{run}", "report_type": "research_report",
+                       "agent": "Auto Agent"}
+            await ws.send_str("start " + json.dumps(request))
+            job_id = None
+            while result.seconds is None:
+                if time.perf_counter() - result.started > timeout:
+                    result.finish(f"timed out after {timeout} s")
+                    break
+                try:
+                    message = await ws.receive_json(timeout=1)
+                except asyncio.TimeoutError:
+                    # a failed job sends no final message, so check on it
+                    if job_id is not None:
+                        async with session.get(f"{url}/jobs/{job_id}") as response:
+                            job = await response.json()
+                        if job["status"] in ("failed", "cancelled"):
+                            result.finish(job.get("error") or job["status"])
+                    continue
+                if message["type"] == "job":
+                    job_id = message["output"]
+                elif message["type"] == "report":
+                    result.report()
+                elif message["type"] == "logs" and message["output"].startswith("\nTotal run time"):
+                    result.finish()
+
+
+async def run_ws(args, standins: Standins, env: Dict[str, str]) -> Dict[str, Any]:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    server = multiprocessing.get_context("spawn").Process(
+        target=serve, args=(port, env, standins.site_urls, args.pages, args.search_latency), daemon=True)
+    server.start()
+    results: List[RunResult] = []
+    try:
+        async with aiohttp.ClientSession() as session:
+            for _ in range(300):
+                try:
+                    async with session.get(f"{url}/jobs") as response:
+                        if response.status == 200:
+                            break
+                except aiohttp.ClientError:
+                    pass
+                if not server.is_alive():
+                    raise RuntimeError("The server under test exited on startup")
+                await asyncio.sleep(0.1)
+
+            async def browser_stats() -> Dict[str, int]:
+                async with session.get(f"{url}/scrape/stats") as response:
+                    return (await response.json())["browsers"]
+
+            sampler = Sampler(server.pid, browser_stats)
+            sampling = asyncio.create_task(sampler.run())
+            started = time.perf_counter()
+            await asyncio.gather(*[ws_client(session, url, client, args.runs, args.timeout, results)
+                                   for client in range(args.clients)])
+            wall = time.perf_counter() - started
+            sampling.cancel()
+            await sampler.sample()
+    finally:
+        server.terminate()
+        server.join(10)
+    return {"results": results, "wall": wall, "usage": sampler.usage()}
+
+
+class RunSink:
+    """Receives the messages of a run_agent call in place of a websocket"""
+
+    def __init__(self, result: RunResult) -> None:
+        self.result = result
+
+    async def send_json(self, message: dict) -> None:
+        if message["type"] == "report":
+            self.result.report()
+
+
+async def agent_clients(args, site_urls: List[str]) -> Dict[str, Any]:
+    from actions.browser_pool import browser_pool
+    from actions.web_fetch import close_session
+    from actions.web_search import set_search_backend
+    from agent.llm_utils import close_aiosession
+    from agent.run import run_agent
+
+    set_search_backend(LocalSearch(site_urls, args.pages, args.search_latency))
+    results: List[RunResult] = []
+
+    async def client(number: int) -> None:
+        for run in range(args.runs):
+            result = RunResult()
+            results.append(result)
+            try:
+                await asyncio.wait_for(run_agent(
+                    f"benchmark question {number}-{run}", "research_report", "💻 Benchmark Agent", None,
+                    RunSink(result)), args.timeout)
+                result.finish()
+            except Exception as e:
+                result.finish(repr(e))
+
+    async def browser_stats() -> Dict[str, int]:
+        return browser_pool.stats()
+
+    sampler = Sampler(os.getpid(), browser_stats)
+    sampling = asyncio.create_task(sampler.run())
+    started = time.perf_counter()
+    await asyncio.gather(*[client(number) for number in range(args.clients)])
+    wall = time.perf_counter() - started
+    sampling.cancel()
+    await sampler.sample()
+    await close_aiosession()
+    await close_session()
+    browser_pool.close()
+    return {"results": results, "wall": wall, "usage": sampler.usage()}
+
+
+def run_agent_process(args, site_urls: List[str], workdir: str, connection) -> None:
+    """Run the clients calling run_agent. Runs in a separate process, so the
+    research code is measured on its own and sees the benchmark environment."""
+    os.chdir(workdir)
+    connection.send(asyncio.run(agent_clients(args, site_urls)))
+    connection.close()
+
+
+async def run_in_process(args, standins: Standins, env: Dict[str, str]) -> Dict[str, Any]:
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.get_context("spawn").Process(
+        target=run_agent_process, args=(args, standins.site_urls, env["BENCHMARK_WORKDIR"], sender), daemon=True)
+    process.start()
+    sender.close()
+    try:
+        # the stand-ins keep serving on this event loop while waiting
+        return await asyncio.get_running_loop().run_in_executor(None, receiver.recv)
+    except EOFError:
+        raise RuntimeError("The run_agent clients exited without results")
+    finally:
+        process.join(10)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_result(path: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The latest saved result, other than the given one, of a benchmark with the same parameters"""
+    for candidate in sorted(glob.glob(os.path.join(RESULTS_DIR, "load_test-*.json")), reverse=True):
+        if os.path.abspath(candidate) == os.path.abspath(path):
+            continue
+        with open(candidate) as file:
+            result = json.load(file)
+        if result.get("params") == params:
+            return result
+    return None
+
+
+COMPARED = (
+    ("throughput_per_minute", "runs/min", True),
+    ("latency.p50", "p50 s", False),
+    ("latency.p95", "p95 s", False),
+    ("latency.p99", "p99 s", False),
+    ("first_report.p50", "first report p50 s", False),
+    ("peak_rss_mb", "peak RSS MB", False),
+    ("max_threads", "threads", False),
+    ("max_busy_browsers", "busy browsers", False),
+)
+
+
+def lookup(result: Dict[str, Any], key: str) -> Optional[float]:
+    value: Any = result
+    for part in key.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def print_result(result: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> None:
+    print(f"{result['runs']} runs by {result['params']['clients']} clients over {result['params']['target']}, "
+          f"{result['failures']} failed, {result['wall_seconds']:.1f} s")
+    for error in result["errors"]:
+        print(f"  error: {error}")
+    if baseline:
+        print(f"compared with {baseline.get('commit')} at {baseline.get('timestamp')}")
+    for key, label, higher_is_better in COMPARED:
+        value = lookup(result, key)
+        line = f"  {label:20} {value:10.2f}"
+        old = lookup(baseline, key) if baseline else None
+        if old:
+            change = (value - old) / old * 100
+            better = change > 0 if higher_is_better else change < 0
+            line += f"   was {old:10.2f} ({change:+.1f}%{'' if abs(change) < 5 else ' better' if better else ' worse'})"
+        print(line)
+    print(f"  stand-in requests: {result['standin_requests']}")
+
+
+async def benchmark(args) -> Dict[str, Any]:
+    options = StandinOptions(pages=args.pages, hosts=args.hosts, js_every=args.js_every,
+                             llm_latency=args.llm_latency, llm_stream_delay=args.llm_stream_delay,
+                             page_latency=args.page_latency)
+    standins = Standins(options)
+    await standins.start()
+    workdir = tempfile.mkdtemp(prefix="gpt-researcher-benchmark-")
+    env = benchmark_env(standins.api_base, workdir)
+    # inherited by the processes under test, which read their configuration on import
+    os.environ.update(env)
+    try:
+        if args.target == "ws":
+            run = await run_ws(args, standins, env)
+        else:
+            run = await run_in_process(args, standins, env)
+    finally:
+        await standins.stop()
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results: List[RunResult] = run["results"]
+    usage = run["usage"]
+    succeeded = [result for result in results if result.error is None]
+    return {
+        "benchmark": "load_test",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "params": {
+            "target": args.target, "clients": args.clients, "runs": args.runs, "pages": args.pages,
+            "hosts": len(standins.site_urls), "js_every": args.js_every, "llm_latency": args.llm_latency,
+            "llm_stream_delay": args.llm_stream_delay, "search_latency": args.search_latency,
+            "page_latency": args.page_latency,
+        },
+        "runs": len(results),
+        "failures": len(results) - len(succeeded),
+        "errors": sorted({result.error for result in results if result.error})[:5],
+        "wall_seconds": run["wall"],
+        "throughput_per_minute": len(succeeded) / run["wall"] * 60 if run["wall"] else 0.0,
+        "latency": summarize([result.seconds for result in succeeded]),
+        "first_report": summarize([result.first_report for result in succeeded if result.first_report is not None]),
+        "peak_rss_mb": usage["peak_rss_kb"] / 1024,
+        "max_threads": usage["max_threads"],
+        "max_busy_browsers": usage["max_busy_browsers"],
+        "browsers": usage["browsers"],
+        "standin_requests": standins.stats(),
+        "workdir": workdir if args.keep_workdir else None,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=("ws", "run_agent"), default="ws",
+                        help="drive the /ws endpoint of a server process, or run_agent in this process")
+    parser.add_argument("--clients", type=int, default=4, help="concurrent clients")
+    parser.add_argument("--runs", type=int, default=2, help="research runs per client, one after the other")
+    parser.add_argument("--pages", type=int, default=200, help="pages in the site corpus")
+    parser.add_argument("--hosts", type=int, default=4, help="loopback addresses the corpus is served on")
+    parser.add_argument("--js-every", type=int, default=0,
+                        help="render every N-th page with a script, so it needs a browser (0: none)")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds before the fake model answers")
+    parser.add_argument("--llm-stream-delay", type=float, default=0.02, help="seconds between streamed chunks")
+    parser.add_argument("--search-latency", type=float, default=0.2, help="seconds per search")
+    parser.add_argument("--page-latency", type=float, default=0.05, help="seconds per page load")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds before a run counts as failed")
+    parser.add_argument("--keep-workdir", action="store_true",
+                        help="keep the outputs and caches of the runs in their temporary directory")
+    parser.add_argument("--output", help="the result file. Defaults to benchmarks/results/load_test-<time>.json")
+    parser.add_argument("--compare", help="a result file to compare with. Defaults to the previous result "
+                                          "with the same parameters")
+    args = parser.parse_args()
+
+    result = asyncio.run(benchmark(args))
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"load_test-{time.strftime('%Y%m%d-%H%M%S')}-{result['commit'] or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(result, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    else:
+        baseline = previous_result(output, result["params"])
+    print_result(result, baseline)
+    print(f"saved to {output}")
+    sys.exit(1 if result["failures"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""Local stand-ins for the services a research run depends on.
+
+- A fake OpenAI-compatible chat completions API at /v1/chat/completions,
+  with configurable latency and streaming. It recognizes the prompts of the
+  agent choice, the search queries, the page summaries and the report, and
+  answers each in the shape the agent expects.
+- A static corpus of synthetic pages at /site/<n>.html, from benchmarks.corpus.
+  Every `js_every`-th page is rendered by a script, so it needs a browser.
+- LocalSearch, a search backend that answers queries with corpus pages.
+
+The pages are served on several loopback addresses (127.0.0.1, 127.0.0.2, ...)
+so that per-host scrape limits apply as they would across real websites.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+import re
+import time
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+from actions.web_search import SearchBackend
+from benchmarks.corpus import _sentence, synthetic_page
+
+QUESTION = re.compile(r'from the following: "(.*?)"You must', re.DOTALL)
+ASPECTS = ("overview", "history", "statistics", "outlook")
+
+
+@dataclass
+class StandinOptions:
+    pages: int = 200
+    hosts: int = 4
+    js_every: int = 0
+    llm_latency: float = 0.5
+    llm_stream_delay: float = 0.02
+    summary_words: int = 120
+    report_words: int = 800
+    page_latency: float = 0.05
+
+
+def _words(seed: str, count: int) -> str:
+    rng = random.Random(zlib.crc32(seed.encode("utf-8")))
+    sentences = []
+    words = 0
+    while words < count:
+        sentence = _sentence(rng)
+        sentences.append(sentence)
+        words += sentence.count(" ") + 1
+    return " ".join(sentences)
+
+
+class Standins:
+    """The fake OpenAI API and the page corpus, served by one aiohttp app"""
+
+    def __init__(self, options: StandinOptions) -> None:
+        self.options = options
+        self.requests: Counter = Counter()
+        self.site_urls: List[str] = []
+        self.api_base = ""
+        self._runner: Optional[web.AppRunner] = None
+        rng = random.Random(42)
+        self.corpus = [synthetic_page(rng, rng.randint(10, 60)) for _ in range(options.pages)]
+
+    def respond(self, prompt: str) -> str:
+        """The text the fake model answers a prompt with"""
+        if prompt.startswith("task:"):
+            self.requests["llm_agent"] += 1
+            return json.dumps({"agent": "💻 Benchmark Agent", "agent_role_prompt": "You are a research assistant."})
+        match = QUESTION.search(prompt)
+        if match:
+            self.requests["llm_queries"] += 1
+            return json.dumps([f"{match.group(1)} {aspect}" for aspect in ASPECTS])
+        if "in a detailed report" in prompt:
+            self.requests["llm_report"] += 1
+            paragraphs = [_words(f"{prompt[-200:]}{i}", 100) for i in range(max(1, self.options.report_words // 100))]
+            return "# Report\n\n" + "\n\n".join(paragraphs)
+        self.requests["llm_summary"] += 1
+        return _words(prompt[:2000], self.options.summary_words)
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        text = self.respond(body["messages"][-1]["content"])
+        await asyncio.sleep(self.options.llm_latency)
+        completion_id = f"chatcmpl-{self.requests.total()}"
+        if not body.get("stream"):
+            return web.json_response({
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        pieces = re.findall(r"\S+\s*", text)
+        for start in range(0, len(pieces), 4):
+            chunk = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [{"index": 0, "delta": {"content": "".join(pieces[start:start + 4])}, "finish_reason": None}],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            await asyncio.sleep(self.options.llm_stream_delay)
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def page(self, request: web.Request) -> web.Response:
+        number = int(request.match_info["number"])
+        if not 0 <= number < len(self.corpus):
+            raise web.HTTPNotFound()
+        self.requests["pages"] += 1
+        await asyncio.sleep(self.options.page_latency)
+        html = self.corpus[number]
+        if self.options.js_every and number % self.options.js_every == 0:
+            # the text only exists once the script ran, as on single-page apps
+            html = ("<html><body><div id='app'></div><script>document.getElementById('app').innerHTML = "
+                    f"{json.dumps(html)};</script></body></html>")
+        return web.Response(text=html, content_type="text/html")
+
+    async def start(self, port: int = 0) -> None:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_get(r"/site/{number:\d+}.html", self.page)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.api_base = f"http://127.0.0.1:{port}/v1"
+        self.site_urls = [f"http://127.0.0.1:{port}"]
+        for host in range(2, self.options.hosts + 1):
+            try:
+                await web.TCPSite(self._runner, f"127.0.0.{host}", port).start()
+            except OSError as e:
+                print(f"Serving the corpus on {len(self.site_urls)} hosts only, 127.0.0.{host} is unavailable: {e}")
+                break
+            self.site_urls.append(f"http://127.0.0.{host}:{port}")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.requests)
+
+
+class LocalSearch(SearchBackend):
+    """Answers search queries with corpus pages, picked by a hash of the query"""
+
+    def __init__(self, site_urls: List[str], pages: int, latency: float = 0.2) -> None:
+        self.site_urls = site_urls
+        self.pages = pages
+        self.latency = latency
+
+    async def search(self, query: str, num_results: int) -> List[Dict[str, str]]:
+        await asyncio.sleep(self.latency)
+        start = zlib.crc32(query.encode("utf-8"))
+        results = []
+        for k in range(num_results):
+            number = (start + k * 7919) % self.pages
+            site = self.site_urls[number % len(self.site_urls)]
+            results.append({"title": f"Page {number}", "href": f"{site}/site/{number}.html", "body": ""})
+        return results
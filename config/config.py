@@ -21,12 +21,82 @@ class Config(metaclass=Singleton):
         self.allow_downloads = False
 
         self.selenium_web_browser = os.getenv("USE_WEB_BROWSER", "chrome")
+        self.browser_pool_size = int(os.getenv("BROWSER_POOL_SIZE", 4))
+        self.browser_pool_warm = int(os.getenv("BROWSER_POOL_WARM", 2))
+        self.browser_max_pages = int(os.getenv("BROWSER_MAX_PAGES", 50))
+        self.browser_debugging_port = int(os.getenv("BROWSER_DEBUGGING_PORT", 9222))
+        self.search_num_results = int(os.getenv("SEARCH_NUM_RESULTS", 4))
+        self.search_concurrency = int(os.getenv("SEARCH_CONCURRENCY", 4))
+        self.search_cache_ttl = float(os.getenv("SEARCH_CACHE_TTL", 3600))
+        self.visited_urls_max = int(os.getenv("VISITED_URLS_MAX", 100000))
+        # Urls are deduplicated per run, so every run keeps all of its sources. When shared, the urls
+        # of all runs are also recorded, counting those visited by several runs within VISITED_URLS_TTL;
+        # their text comes from the page cache rather than being fetched again, if it is enabled
+        self.visited_urls_shared = os.getenv("VISITED_URLS_SHARED", "False") == "True"
+        self.visited_urls_ttl = float(os.getenv("VISITED_URLS_TTL", 3600))
+        self.max_concurrent_scrapes = int(os.getenv("MAX_CONCURRENT_SCRAPES", 8))
+        self.max_scrapes_per_host = int(os.getenv("MAX_SCRAPES_PER_HOST", 2))
+        self.host_scrape_delay = float(os.getenv("HOST_SCRAPE_DELAY", 1.0))
+        self.scrape_threads = int(os.getenv("SCRAPE_THREADS", 16))
+        self.page_cache_enabled = os.getenv("PAGE_CACHE_ENABLED", "True") == "True"
+        self.page_cache_path = os.getenv("PAGE_CACHE_PATH", ".cache/page_cache.sqlite3")
+        self.page_cache_ttl = float(os.getenv("PAGE_CACHE_TTL", 24 * 3600))
+        self.page_cache_max_bytes = int(os.getenv("PAGE_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+        self.page_cache_memory_bytes = int(os.getenv("PAGE_CACHE_MEMORY_BYTES", 32 * 1024 * 1024))
+        self.page_cache_compress = os.getenv("PAGE_CACHE_COMPRESS", "True") == "True"
+        self.pdf_mode = os.getenv("PDF_MODE", "lazy")
+        self.pdf_workers = int(os.getenv("PDF_WORKERS", 2))
+        self.outputs_index_path = os.getenv("OUTPUTS_INDEX_PATH", ".cache/outputs_index.sqlite3")
+        self.outputs_max_age = float(os.getenv("OUTPUTS_MAX_AGE", 30 * 24 * 3600))
+        self.outputs_max_bytes = int(os.getenv("OUTPUTS_MAX_BYTES", 1024 * 1024 * 1024))
+        self.outputs_compress = os.getenv("OUTPUTS_COMPRESS", "True") == "True"
+        self.outputs_cleanup_interval = float(os.getenv("OUTPUTS_CLEANUP_INTERVAL", 3600))
+        self.trace_sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", 0))
+        self.http_fast_path = os.getenv("HTTP_FAST_PATH", "True") == "True"
+        self.http_fetch_timeout = float(os.getenv("HTTP_FETCH_TIMEOUT", 15))
+        self.http_connection_limit = int(os.getenv("HTTP_CONNECTION_LIMIT", 64))
+        self.http_max_page_bytes = int(os.getenv("HTTP_MAX_PAGE_BYTES", 5 * 1024 * 1024))
+        self.min_page_text_length = int(os.getenv("MIN_PAGE_TEXT_LENGTH", 300))
         self.llm_provider = os.getenv("LLM_PROVIDER", "ChatOpenAI")
         self.fast_llm_model = os.getenv("FAST_LLM_MODEL", "gpt-3.5-turbo-16k")
         self.smart_llm_model = os.getenv("SMART_LLM_MODEL", "gpt-4")
         self.fast_token_limit = int(os.getenv("FAST_TOKEN_LIMIT", 4000))
         self.smart_token_limit = int(os.getenv("SMART_TOKEN_LIMIT", 8000))
         self.browse_chunk_max_length = int(os.getenv("BROWSE_CHUNK_MAX_LENGTH", 8192))
+        self.chunk_overlap_tokens = int(os.getenv("CHUNK_OVERLAP_TOKENS", 0))
+        # Tokens of research given to the smart model to write the report from. When 0, they are
+        # what SMART_TOKEN_LIMIT leaves next to the report prompt and REPORT_COMPLETION_TOKENS
+        self.report_context_tokens = int(os.getenv("REPORT_CONTEXT_TOKENS", 0))
+        self.report_completion_tokens = int(os.getenv("REPORT_COMPLETION_TOKENS", 2000))
+        self.dedup_enabled = os.getenv("DEDUP_ENABLED", "True") == "True"
+        self.dedup_threshold = float(os.getenv("DEDUP_THRESHOLD", 0.8))
+        self.dedup_block_tokens = int(os.getenv("DEDUP_BLOCK_TOKENS", 256))
+        self.llm_concurrency = int(os.getenv("LLM_CONCURRENCY", 8))
+        self.max_concurrent_queries = int(os.getenv("MAX_CONCURRENT_QUERIES", 4))
+        self.summary_concurrency = int(os.getenv("SUMMARY_CONCURRENCY", 4))
+        self.llm_connection_limit = int(os.getenv("LLM_CONNECTION_LIMIT", 32))
+        self.llm_max_retries = int(os.getenv("LLM_MAX_RETRIES", 6))
+        self.llm_cache_enabled = os.getenv("LLM_CACHE_ENABLED", "True") == "True"
+        self.llm_cache_path = os.getenv("LLM_CACHE_PATH", ".cache/llm_cache.sqlite3")
+        self.llm_cache_max_bytes = int(os.getenv("LLM_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+        self.llm_cache_max_age = float(os.getenv("LLM_CACHE_MAX_AGE", 7 * 24 * 3600))
+        self.fast_llm_rpm = int(os.getenv("FAST_LLM_RPM", 3500))
+        self.fast_llm_tpm = int(os.getenv("FAST_LLM_TPM", 180000))
+        self.smart_llm_rpm = int(os.getenv("SMART_LLM_RPM", 200))
+        self.smart_llm_tpm = int(os.getenv("SMART_LLM_TPM", 40000))
+
+        self.websocket_queue_size = int(os.getenv("WEBSOCKET_QUEUE_SIZE", 64))
+        self.stream_flush_mode = os.getenv("STREAM_FLUSH_MODE", "newline")
+        self.stream_flush_interval = float(os.getenv("STREAM_FLUSH_INTERVAL", 0.25))
+        self.stream_flush_bytes = int(os.getenv("STREAM_FLUSH_BYTES", 512))
+        # Streamed frames buffered for a client that is behind; a client further behind fails its session
+        self.stream_buffer_size = int(os.getenv("STREAM_BUFFER_SIZE", 256))
+
+        self.research_workers = int(os.getenv("RESEARCH_WORKERS", 0))
+        self.jobs_per_worker = int(os.getenv("JOBS_PER_WORKER", 4))
+        self.job_history = int(os.getenv("JOB_HISTORY", 1000))
+        # Events kept per job for clients that follow it late; the report itself is saved to the outputs
+        self.job_event_history = int(os.getenv("JOB_EVENT_HISTORY", 500))
 
         self.openai_api_key = os.getenv("OPENAI_API_KEY")
         self.temperature = float(os.getenv("TEMPERATURE", "1"))
@@ -61,6 +131,10 @@ class Config(metaclass=Singleton):
         """Set the browse_website command chunk max length value."""
         self.browse_chunk_max_length = value
 
+    def set_llm_concurrency(self, value: int) -> None:
+        """Set the max number of concurrent LLM requests per process."""
+        self.llm_concurrency = value
+
     def set_openai_api_key(self, value: str) -> None:
         """Set the OpenAI API key value."""
         self.openai_api_key = value
@@ -1,22 +1,40 @@
-from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
+import asyncio
 import json
 import os
 
-from agent.llm_utils import choose_agent
+from actions.browser_pool import browser_pool
+from actions.page_cache import page_cache
+from actions.scrape_scheduler import scrape_scheduler
+from actions.urls import visited_urls
+from actions.web_fetch import close_session
+from actions.web_search import search_stats
+from agent.llm_cache import llm_cache
+from agent.jobs import JobManager
+from agent.metrics import JOBS, render as render_metrics
+from agent.llm_utils import close_aiosession, scheduler
 from agent.run import WebSocketManager
+from agent.storage import outputs_store
+from config import Config
+from processing.pdf import pdf_renderer
+from processing.text import get_encoding
 
 
 class ResearchRequest(BaseModel):
     task: str
     report_type: str
     agent: str
+    refresh: bool = False
 
 
+CFG = Config()
 
 app = FastAPI()
+cleanup_tasks = set()
 app.mount("/site", StaticFiles(directory="client"), name="site")
 app.mount("/static", StaticFiles(directory="client/static"), name="static")
 # Dynamic directory for outputs once first research is run
@@ -25,10 +43,42 @@ def startup_event():
     if not os.path.isdir("outputs"):
         os.makedirs("outputs")
     app.mount("/outputs", StaticFiles(directory="outputs"), name="outputs")
+    jobs.start()
+    if jobs.workers <= 0:
+        # launch browsers and load the tokenizer (downloaded on first use) in the
+        # background so startup isn't held up
+        asyncio.get_event_loop().run_in_executor(None, browser_pool.warm)
+        asyncio.get_event_loop().run_in_executor(None, get_encoding, CFG.fast_llm_model)
+    cleanup_tasks.add(asyncio.get_event_loop().create_task(clean_outputs()))
+
+
+async def clean_outputs():
+    """Index the outputs on startup, then enforce their retention periodically"""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, outputs_store.rebuild)
+    while True:
+        try:
+            await loop.run_in_executor(None, outputs_store.enforce)
+        except Exception as e:
+            print(f"Error cleaning up the outputs: {e}")
+        await asyncio.sleep(CFG.outputs_cleanup_interval)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in cleanup_tasks:
+        task.cancel()
+    jobs.shutdown()
+    await close_aiosession()
+    await close_session()
+    browser_pool.close()
+    pdf_renderer.close()
+
 
 templates = Jinja2Templates(directory="client")
 
-manager = WebSocketManager()
+jobs = JobManager()
+manager = WebSocketManager(jobs)
 
 
 @app.get("/")
@@ -36,6 +86,89 @@ async def read_root(request: Request):
     return templates.TemplateResponse('index.html', {"request": request, "report": None})
 
 
+@app.get("/llm/stats")
+async def llm_stats():
+    return {"models": scheduler.stats(), "cache": llm_cache.stats()}
+
+
+@app.get("/scrape/stats")
+async def scrape_stats():
+    return {
+        "scheduler": scrape_scheduler.stats(),
+        "browsers": browser_pool.stats(),
+        "page_cache": page_cache.stats(),
+        "search": search_stats(),
+        "visited_urls": visited_urls.stats(),
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    for status, count in jobs.stats().items():
+        JOBS.labels(status).set(count)
+    content, content_type = render_metrics()
+    return Response(content, media_type=content_type)
+
+
+@app.get("/outputs/stats")
+async def outputs_stats():
+    return {"outputs": outputs_store.stats(), "pdf": pdf_renderer.stats()}
+
+
+@app.get("/outputs/{directory}/{name}.pdf")
+async def report_pdf(directory: str, name: str):
+    # registered before the /outputs mount, so PDFs are rendered on their first download
+    outputs = os.path.realpath("outputs")
+    md_path = os.path.realpath(os.path.join(outputs, directory, f"{name}.md"))
+    if os.path.dirname(os.path.dirname(md_path)) != outputs:
+        raise HTTPException(status_code=404)
+    if not os.path.exists(md_path):
+        pdf_path = f"{md_path[:-3]}.pdf"
+        if os.path.exists(pdf_path):
+            return FileResponse(pdf_path, media_type="application/pdf")
+        raise HTTPException(status_code=404)
+    pdf_path, rendered = await pdf_renderer.render(md_path)
+    if rendered:
+        # the PDF counts toward the size of its workspace
+        workspace = os.path.basename(os.path.dirname(md_path))
+        await asyncio.get_running_loop().run_in_executor(None, outputs_store.index, workspace)
+    return FileResponse(pdf_path, media_type="application/pdf", filename=f"{name}.pdf")
+
+
+@app.post("/jobs")
+async def submit_job(research_request: ResearchRequest):
+    return {"job_id": jobs.submit(research_request.dict())}
+
+
+@app.get("/jobs")
+async def job_stats():
+    return jobs.stats()
+
+
+def get_job(job_id: str):
+    record = jobs.get(job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return record
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    return get_job(job_id).summary()
+
+
+@app.get("/jobs/{job_id}/artifacts")
+async def job_artifacts(job_id: str):
+    record = get_job(job_id)
+    return {"job_id": job_id, "status": record.status, "artifacts": record.result.get("artifacts", [])}
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    get_job(job_id)
+    return {"job_id": job_id, "cancelled": jobs.cancel(job_id)}
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await manager.connect(websocket)
@@ -44,22 +177,16 @@ async def websocket_endpoint(websocket: WebSocket):
             data = await websocket.receive_text()
             if data.startswith("start"):
                 json_data = json.loads(data[6:])
-                task = json_data.get("task")
-                report_type = json_data.get("report_type")
-                agent = json_data.get("agent")
-                # temporary so "normal agents" can still be used and not just auto generated, will be removed when we move to auto generated
-                if agent == "Auto Agent":
-                    agent_dict = choose_agent(task)
-                    agent = agent_dict.get("agent")
-                    agent_role_prompt = agent_dict.get("agent_role_prompt")
-                else:
-                    agent_role_prompt = None
-
-                await websocket.send_json({"type": "logs", "output": f"Initiated an Agent: {agent}"})
-                if task and report_type and agent:
-                    await manager.start_streaming(task, report_type, agent, agent_role_prompt, websocket)
-                else:
-                    print("Error: not enough parameters provided.")
+                if manager.start_job(websocket, json_data) is None:
+                    await manager.queued(websocket).send_json(
+                        {"type": "logs", "output": "A research task is already running, send 'stop' to cancel it."})
+            elif data.startswith("subscribe"):
+                job_id = data[10:].strip()
+                if not manager.subscribe(websocket, job_id):
+                    await manager.queued(websocket).send_json({"type": "logs", "output": f"Unknown job: {job_id}"})
+            elif data.startswith("stop"):
+                if await manager.stop_job(websocket):
+                    await manager.queued(websocket).send_json({"type": "logs", "output": "🛑 Research stopped."})
 
     except WebSocketDisconnect:
         await manager.disconnect(websocket)
@@ -0,0 +1,164 @@
+"""Near-duplicate detection of scraped page text"""
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import Config
+from processing.text import count_tokens, split_text
+
+CFG = Config()
+
+SHINGLE_WORDS = 3
+# Blocks with fewer shingles than this are too short to compare reliably and are always kept
+MIN_SHINGLES = 8
+# Signature rows per LSH band. With 64 permutations, blocks that are 80% similar share
+# a band with 99.98% probability, and 50% similar ones with 64%.
+BAND_ROWS = 4
+
+
+@dataclass
+class DeduplicatedText:
+    """The text of a page without the blocks that were already seen"""
+    text: str
+    blocks: int
+    dropped_blocks: int
+    tokens_saved: int
+    # the url that most of the dropped blocks were first seen on
+    duplicate_of: Optional[str]
+
+    @property
+    def is_duplicate(self) -> bool:
+        return self.blocks > 0 and self.dropped_blocks == self.blocks
+
+
+class NearDuplicateIndex:
+    """The MinHash signatures of the text blocks seen in a research run.
+
+    Page text is split into blocks of up to `block_tokens` tokens. A block
+    whose estimated Jaccard similarity of word 3-shingles to an earlier
+    block reaches `threshold` is dropped, so mirrored and syndicated pages
+    are summarized once. Signatures are `num_perm` minimums of universal
+    hash permutations. Only the earlier blocks that share a band of their
+    signature (locality-sensitive hashing) are compared, so lookups stay
+    fast as the run collects thousands of blocks. Pages are deduplicated one
+    at a time, so the index can be used from executor threads.
+    """
+
+    def __init__(
+        self,
+        threshold: float = CFG.dedup_threshold,
+        block_tokens: int = CFG.dedup_block_tokens,
+        num_perm: int = 64,
+        seed: int = 1,
+    ) -> None:
+        self.threshold = threshold
+        self.block_tokens = block_tokens
+        rng = np.random.default_rng(seed)
+        # odd multipliers, for multiply-add-shift hashing
+        self._a = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+        self._signatures: List[np.ndarray] = []
+        self._sources: List[str] = []
+        # band index -> band of a signature -> the indexes of the blocks with that band
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(num_perm // BAND_ROWS)]
+        self.pages = 0
+        self.duplicate_pages = 0
+        self.dropped_blocks = 0
+        self.tokens_saved = 0
+        self._lock = threading.Lock()
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """The MinHash signature of a text's word shingles
+
+        Returns:
+            Optional[np.ndarray]: The signature, or None if the text is too short to compare
+        """
+        words = text.lower().split()
+        shingles = zip(*(words[i:] for i in range(SHINGLE_WORDS)))
+        hashes = np.fromiter(map(hash, shingles), dtype=np.int64, count=max(0, len(words) - SHINGLE_WORDS + 1))
+        if len(hashes) < MIN_SHINGLES:
+            return None
+        # each permutation is the high half of a * h + b modulo 2**64, which NumPy wraps to natively
+        with np.errstate(over="ignore"):
+            return ((np.outer(np.unique(hashes).view(np.uint64), self._a) + self._b) >> np.uint64(32)).min(axis=0)
+
+    def deduplicate(self, url: str, text: str) -> DeduplicatedText:
+        """Drop the blocks of a page's text that are near-duplicates of blocks seen before,
+        and remember the rest
+
+        Args:
+            url (str): The url of the page
+            text (str): The text of the page
+
+        Returns:
+            DeduplicatedText: The remaining text and what was dropped
+        """
+        blocks = list(split_text(text, self.block_tokens, overlap_tokens=0))
+        with self._lock:
+            return self._deduplicate(url, blocks)
+
+    def _deduplicate(self, url: str, blocks: List[str]) -> DeduplicatedText:
+        self.pages += 1
+        kept = []
+        dropped = 0
+        tokens_saved = 0
+        duplicate_of: Dict[str, int] = {}
+        for block in blocks:
+            signature = self.signature(block)
+            if signature is None:
+                kept.append(block)
+                continue
+            candidates = self._candidates(signature)
+            if candidates:
+                similarities = (np.array([self._signatures[i] for i in candidates]) == signature).mean(axis=1)
+                best = int(similarities.argmax())
+                match = candidates[best]
+                if similarities[best] >= self.threshold:
+                    dropped += 1
+                    tokens_saved += count_tokens(block)
+                    source = self._sources[match]
+                    if source != url:
+                        duplicate_of[source] = duplicate_of.get(source, 0) + 1
+                    continue
+            kept.append(block)
+            self._add(url, signature)
+
+        result = DeduplicatedText(
+            text="\n".join(kept),
+            blocks=len(blocks),
+            dropped_blocks=dropped,
+            tokens_saved=tokens_saved,
+            duplicate_of=max(duplicate_of, key=duplicate_of.get) if duplicate_of else None,
+        )
+        self.dropped_blocks += dropped
+        self.tokens_saved += tokens_saved
+        self.duplicate_pages += result.is_duplicate
+        return result
+
+    def _bands(self, signature: np.ndarray) -> List[bytes]:
+        return signature.view(f"V{BAND_ROWS * signature.itemsize}").tolist()
+
+    def _candidates(self, signature: np.ndarray) -> List[int]:
+        candidates = set()
+        for buckets, band in zip(self._buckets, self._bands(signature)):
+            candidates.update(buckets.get(band, ()))
+        return sorted(candidates)
+
+    def _add(self, url: str, signature: np.ndarray) -> None:
+        index = len(self._signatures)
+        for buckets, band in zip(self._buckets, self._bands(signature)):
+            buckets.setdefault(band, []).append(index)
+        self._signatures.append(signature)
+        self._sources.append(url)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "pages": self.pages,
+                "duplicate_pages": self.duplicate_pages,
+                "blocks": len(self._sources),
+                "dropped_blocks": self.dropped_blocks,
+                "tokens_saved": self.tokens_saved,
+            }
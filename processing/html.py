@@ -1,9 +1,15 @@
 """HTML processing functions"""
 from __future__ import annotations
 
+import lxml.etree
+import lxml.html
 from bs4 import BeautifulSoup
 from requests.compat import urljoin
 
+# The tags whose text makes up the readable text of a page
+TEXT_TAGS = ("h1", "h2", "h3", "h4", "h5", "p")
+UTF8_PARSER = lxml.html.HTMLParser(encoding="utf-8")
+
 
 def extract_hyperlinks(soup: BeautifulSoup, base_url: str) -> list[tuple[str, str]]:
     """Extract hyperlinks from a BeautifulSoup object
@@ -31,3 +37,74 @@ def format_hyperlinks(hyperlinks: list[tuple[str, str]]) -> list[str]:
         List[str]: The formatted hyperlinks
     """
     return [f"{link_text} ({link_url})" for link_text, link_url in hyperlinks]
+
+
+def extract_text(html: str) -> str:
+    """Extract the readable text of an HTML document
+
+    Args:
+        html (str): The HTML document
+
+    Returns:
+        str: The text of the headings and paragraphs, one phrase per line
+    """
+    return extract_text_and_links(html, None)[0]
+
+
+def extract_text_and_links(html: str, base_url: str | None) -> tuple[str, list[tuple[str, str]]]:
+    """Extract the readable text and the hyperlinks of an HTML document from a single parse
+
+    The text of a heading or paragraph nested in another one is only included once.
+
+    Args:
+        html (str): The HTML document
+        base_url (str | None): The base URL to resolve links against. Links are not
+            extracted when None.
+
+    Returns:
+        Tuple[str, List[Tuple[str, str]]]: The text, one phrase per line, and the hyperlinks
+    """
+    if not html or html.isspace():
+        return "", []
+    try:
+        document = lxml.html.document_fromstring(html)
+    except ValueError:
+        # lxml refuses str input that declares its own encoding
+        document = lxml.html.document_fromstring(html.encode("utf-8"), parser=UTF8_PARSER)
+    except lxml.etree.ParserError:
+        return "", []
+    lxml.etree.strip_elements(document, "script", "style", lxml.etree.Comment, with_tail=False)
+
+    phrases = []
+    hyperlinks = []
+    tags = TEXT_TAGS if base_url is None else TEXT_TAGS + ("a",)
+    for element in document.iter(*tags):
+        if element.tag == "a":
+            href = element.get("href")
+            if href is not None:
+                hyperlinks.append((element.text_content(), urljoin(base_url, href)))
+            continue
+        # the text of nested headings and paragraphs is already part of the outermost one
+        if next(element.iterancestors(*TEXT_TAGS), None) is not None:
+            continue
+        phrases.extend(split_phrases(element.text_content()))
+
+    return "\n".join(phrases), hyperlinks
+
+
+def split_phrases(text: str) -> list[str]:
+    """Split text into phrases at line breaks and double spaces, dropping blank ones
+
+    Args:
+        text (str): The text of an element
+
+    Returns:
+        List[str]: The stripped phrases
+    """
+    phrases = []
+    for line in text.splitlines():
+        for phrase in line.split("  "):
+            phrase = phrase.strip()
+            if phrase:
+                phrases.append(phrase)
+    return phrases
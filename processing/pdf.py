@@ -0,0 +1,103 @@
+"""PDF rendering of markdown reports in worker processes, cached by content."""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from config import Config
+
+CFG = Config()
+
+
+def pdf_path(md_path: str, digest: str) -> str:
+    """The path of the PDF of a markdown file with the given content hash"""
+    return f"{md_path[:-3]}.{digest[:16]}.pdf"
+
+
+def render(md_path: str, pdf_path: str) -> None:
+    """Render a markdown file to PDF, replacing the PDFs of its earlier versions.
+    Runs in a worker process."""
+    # imported here, so only the worker processes load weasyprint
+    from md2pdf.core import md2pdf
+
+    # rendered next to its destination first, so a half-written PDF is never served
+    partial_path = f"{pdf_path}.{os.getpid()}.tmp"
+    md2pdf(partial_path, md_content=None, md_file_path=md_path, css_file_path=None, base_url=None)
+    os.replace(partial_path, pdf_path)
+    directory, stem = os.path.split(md_path[:-3])
+    earlier = re.compile(rf"{re.escape(stem)}\.[0-9a-f]{{16}}\.pdf")
+    for name in os.listdir(directory):
+        if earlier.fullmatch(name) and name != os.path.basename(pdf_path):
+            os.remove(os.path.join(directory, name))
+
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+class PdfRenderer:
+    """Renders markdown reports to PDF off the event loop.
+
+    Rendering runs in a pool of `workers` processes, started on first use.
+    The PDF of a report is stored next to its markdown, named by the hash
+    of the markdown, so a report is rendered once however often it is
+    downloaded, a report whose markdown changes is rendered again, and the
+    PDF counts toward, and is deleted with, the report's workspace.
+    Concurrent requests for the same markdown share one rendering.
+    """
+
+    def __init__(self, workers: int = CFG.pdf_workers) -> None:
+        self.workers = workers
+        self.rendered = 0
+        self.hits = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._rendering: Dict[str, asyncio.Future] = {}
+
+    async def render(self, md_path: str) -> Tuple[str, bool]:
+        """Get the PDF of a markdown file, rendering it if its content wasn't rendered before
+
+        Args:
+            md_path (str): The path of the markdown file
+
+        Returns:
+            Tuple[str, bool]: The path of the PDF, and whether it was rendered by this call
+        """
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(None, file_hash, md_path)
+        path = pdf_path(md_path, digest)
+        if os.path.exists(path):
+            self.hits += 1
+            return path, False
+
+        rendering = self._rendering.get(path)
+        if rendering is None:
+            rendering = loop.run_in_executor(self._get_pool(), render, md_path, path)
+            self._rendering[path] = rendering
+            rendering.add_done_callback(lambda _: self._rendering.pop(path, None))
+            self.rendered += 1
+        # shielded, so a request that goes away doesn't cancel the rendering others wait for
+        await asyncio.shield(rendering)
+        return path, True
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> Dict[str, int]:
+        return {"rendered": self.rendered, "hits": self.hits, "rendering": len(self._rendering)}
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawned rather than forked, as the server process runs threads
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+
+pdf_renderer = PdfRenderer()
@@ -0,0 +1,178 @@
+"""Relevance ranking of research passages"""
+import re
+import string
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from config import Config
+from processing.text import count_tokens, split_text
+
+CFG = Config()
+
+WORD = re.compile(r"\w+")
+# Each browsed page's summary starts with one of these, see actions.web_scrape.async_browse
+SOURCE_MARKER = re.compile(r"(Information gathered from url|Error processing the url) (\S+): ")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how in is it of on or that the this to was "
+    "what when where which who why will with".split()
+)
+_SEPARATORS = (string.punctuation.replace("_", "") + string.whitespace).encode()
+SEPARATORS = bytes.maketrans(_SEPARATORS, b" " * len(_SEPARATORS))
+PASSAGE_TOKENS = 200
+# Tokens the chat format adds around each message
+MESSAGE_TOKENS = 4
+
+
+@dataclass
+class Passage:
+    """A piece of research text and the url it was gathered from"""
+    text: str
+    source: Optional[str]
+    tokens: int
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase words"""
+    return WORD.findall(text.lower())
+
+
+def split_passages(research: str, max_tokens: int = PASSAGE_TOKENS) -> List[Passage]:
+    """Split research text into passages of at most max_tokens tokens, keeping their source urls
+
+    Args:
+        research (str): Summaries of browsed pages, each introduced by its source marker
+        max_tokens (int, optional): The maximum tokens of a passage. Defaults to PASSAGE_TOKENS.
+
+    Returns:
+        List[Passage]: The passages in their original order, without the pages that failed
+    """
+    passages = []
+    markers = list(SOURCE_MARKER.finditer(research))
+    sections = [(None, True, 0, markers[0].start() if markers else len(research))]
+    for marker, following in zip(markers, markers[1:] + [None]):
+        end = following.start() if following else len(research)
+        sections.append((marker.group(2), marker.group(1).startswith("Information"), marker.end(), end))
+
+    for source, gathered, start, end in sections:
+        if not gathered:
+            continue
+        for text in split_text(research[start:end].strip(), max_tokens, overlap_tokens=0):
+            text = text.strip()
+            if text:
+                passages.append(Passage(text, source, count_tokens(text)))
+    return passages
+
+
+def bm25_scores(passages: List[str], query: str, k1: float = 1.5, b: float = 0.75) -> np.ndarray:
+    """Score passages against a query with Okapi BM25
+
+    Args:
+        passages (List[str]): The passages to score
+        query (str): The query
+        k1 (float, optional): Term frequency saturation. Defaults to 1.5.
+        b (float, optional): Passage length normalization. Defaults to 0.75.
+
+    Returns:
+        np.ndarray: The score of each passage
+    """
+    terms = {term: column for column, term in enumerate(sorted(set(tokenize(query)) - STOPWORDS))}
+    if not terms or not passages:
+        return np.zeros(len(passages))
+
+    # Only the query terms are counted, the rest of the vocabulary doesn't affect the scores.
+    # Passages are reduced to words each padded with its own spaces, so that a term's count is
+    # the count of the padded term, which bytes.count finds far faster than splitting out words.
+    padded = [b" " + passage.lower().encode().translate(SEPARATORS).replace(b" ", b"  ") + b" "
+              for passage in passages]
+    frequencies = np.zeros((len(passages), len(terms)))
+    for term, column in terms.items():
+        needle = f" {term} ".encode()
+        frequencies[:, column] = [passage.count(needle) for passage in padded]
+    # the length in characters is as good a measure as words for length normalization
+    lengths = np.fromiter(map(len, passages), dtype=float, count=len(passages))
+
+    document_frequencies = np.count_nonzero(frequencies, axis=0)
+    idf = np.log1p((len(passages) - document_frequencies + 0.5) / (document_frequencies + 0.5))
+    norms = k1 * (1 - b + b * lengths / max(lengths.mean(), 1))
+    return (frequencies * (k1 + 1) / (frequencies + norms[:, None])) @ idf
+
+
+def pack_passages(passages: List[Passage], scores: np.ndarray, max_tokens: int) -> List[Passage]:
+    """Pick the highest-scoring passages that fit together in max_tokens tokens
+
+    The first passage picked from a url also pays for the header that introduces the url.
+
+    Returns:
+        List[Passage]: The picked passages in their original order
+    """
+    picked = []
+    introduced = set()
+    total = 0
+    # stable sort, so equally relevant passages keep their order
+    for index in np.argsort(-scores, kind="stable"):
+        passage = passages[index]
+        tokens = passage.tokens + 1
+        if passage.source not in introduced:
+            tokens += count_tokens(source_header(passage.source))
+        if total + tokens <= max_tokens:
+            picked.append(index)
+            introduced.add(passage.source)
+            total += tokens
+    return [passages[index] for index in sorted(picked)]
+
+
+def source_header(source: Optional[str]) -> str:
+    """The text that introduces the passages from a url"""
+    return f"\n\nInformation gathered from url {source}: " if source else "\n\n"
+
+
+def format_passages(passages: List[Passage]) -> str:
+    """Join passages back into research text, introducing each run of passages from the same url"""
+    text = ""
+    source = None
+    for index, passage in enumerate(passages):
+        if index == 0 or passage.source != source:
+            source = passage.source
+            text += source_header(source)
+        else:
+            text += "\n"
+        text += passage.text
+    return text.strip()
+
+
+def select_context(research: str, question: str, max_tokens: int) -> Tuple[str, List[Passage], int]:
+    """Reduce research text to the passages most relevant to the question that fit in max_tokens
+
+    Args:
+        research (str): The research text
+        question (str): The research question
+        max_tokens (int): The token budget of the context
+
+    Returns:
+        Tuple[str, List[Passage], int]: The context, the passages it is made of (empty if the
+            research fits as it is) and the number of passages the research was split into
+    """
+    if len(research) <= max_tokens or count_tokens(research) <= max_tokens:
+        return research, [], 0
+    passages = split_passages(research)
+    scores = bm25_scores([passage.text for passage in passages], question)
+    selected = pack_passages(passages, scores, max_tokens)
+    return format_passages(selected), selected, len(passages)
+
+
+def report_context_budget(messages: List[str]) -> int:
+    """The tokens of research that fit in a report request to the smart model
+
+    Args:
+        messages (List[str]): The messages of the request without the research
+
+    Returns:
+        int: REPORT_CONTEXT_TOKENS if set, otherwise what the smart model's token limit
+            leaves next to the messages and the report
+    """
+    if CFG.report_context_tokens:
+        return CFG.report_context_tokens
+    prompt_tokens = sum(count_tokens(message) + MESSAGE_TOKENS for message in messages)
+    return max(0, CFG.smart_token_limit - prompt_tokens - CFG.report_completion_tokens)
@@ -1,58 +1,143 @@
 """Text processing functions"""
+import asyncio
+import gzip
+import re
 import urllib
-from typing import Dict, Generator, Optional
+from typing import Dict, Generator, List, Optional, Tuple
 import string
 
 from selenium.webdriver.remote.webdriver import WebDriver
 
 from config import Config
-from agent.llm_utils import create_chat_completion
+from agent.llm_utils import acreate_chat_completion
+from agent.tracing import traced
+from processing.pdf import pdf_renderer
+from processing.tokens import CHARS_PER_TOKEN, count_tokens, get_encoding
 import os
-from md2pdf.core import md2pdf
 
 CFG = Config()
 
 
-def split_text(text: str, max_length: int = 8192) -> Generator[str, None, None]:
-    """Split text into chunks of a maximum length
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def chunk_token_budget() -> int:
+    """The maximum tokens of a chunk sent to the fast model"""
+    return min(CFG.browse_chunk_max_length, CFG.fast_token_limit)
+
+
+def split_text(
+    text: str,
+    max_tokens: Optional[int] = None,
+    overlap_tokens: int = CFG.chunk_overlap_tokens,
+    model: str = CFG.fast_llm_model,
+) -> Generator[str, None, None]:
+    """Split text into chunks of at most max_tokens tokens
+
+    Chunks are packed with whole paragraphs where possible. Paragraphs that don't fit in
+    a chunk are split into sentences, and sentences that still don't fit are split at
+    token boundaries.
 
     Args:
         text (str): The text to split
-        max_length (int, optional): The maximum length of each chunk. Defaults to 8192.
+        max_tokens (int, optional): The maximum tokens of each chunk. Defaults to chunk_token_budget().
+        overlap_tokens (int, optional): The tokens of trailing paragraphs of a chunk to repeat
+            at the start of the next one. Defaults to CFG.chunk_overlap_tokens.
+        model (str, optional): The model whose tokenizer to use. Defaults to the fast model.
 
     Yields:
         str: The next chunk of text
-
-    Raises:
-        ValueError: If the text is longer than the maximum length
     """
-    paragraphs = text.split("\n")
-    current_length = 0
-    current_chunk = []
-
-    for paragraph in paragraphs:
-        if current_length + len(paragraph) + 1 <= max_length:
-            current_chunk.append(paragraph)
-            current_length += len(paragraph) + 1
-        else:
-            yield "\n".join(current_chunk)
-            current_chunk = [paragraph]
-            current_length = len(paragraph) + 1
+    max_tokens = max_tokens or chunk_token_budget()
+    if not text:
+        return
+    # Short text fits without tokenizing it, as no token is shorter than one byte, and
+    # text that is unlikely to be much longer than the budget is worth counting in one
+    # go before splitting it
+    if len(text.encode("utf-8")) <= max_tokens or (
+        len(text) <= 2 * CHARS_PER_TOKEN * max_tokens and count_tokens(text, model) <= max_tokens
+    ):
+        yield text
+        return
+
+    current_chunk: List[Tuple[str, int]] = []
+    current_tokens = 0
+    for piece, tokens in _split_pieces(text, max_tokens, model):
+        # pieces are joined with a newline, which is one more token
+        if current_chunk and current_tokens + tokens + 1 > max_tokens:
+            yield "\n".join(piece for piece, _ in current_chunk)
+            current_chunk = _overlap(current_chunk, overlap_tokens)
+            current_tokens = sum(tokens + 1 for _, tokens in current_chunk)
+            if current_tokens + tokens + 1 > max_tokens:
+                current_chunk, current_tokens = [], 0
+        current_chunk.append((piece, tokens))
+        current_tokens += tokens + 1
 
     if current_chunk:
-        yield "\n".join(current_chunk)
+        yield "\n".join(piece for piece, _ in current_chunk)
 
 
-def summarize_text(
-    url: str, text: str, question: str, driver: Optional[WebDriver] = None
-) -> str:
+def _split_pieces(text: str, max_tokens: int, model: str) -> Generator[Tuple[str, int], None, None]:
+    """Split text into paragraphs, or smaller pieces for paragraphs that don't fit in
+    max_tokens, along with their token counts"""
+    encoding = get_encoding(model)
+    paragraphs = text.split("\n")
+    if encoding is None:
+        paragraph_tokens = [count_tokens(paragraph, model) for paragraph in paragraphs]
+    else:
+        paragraph_tokens = [len(ids) for ids in encoding.encode_ordinary_batch(paragraphs)]
+
+    for paragraph, tokens in zip(paragraphs, paragraph_tokens):
+        if tokens < max_tokens:
+            yield paragraph, tokens
+            continue
+        for sentence in SENTENCE_END.split(paragraph):
+            tokens = count_tokens(sentence, model)
+            if tokens < max_tokens:
+                yield sentence, tokens
+            elif encoding is None:
+                # cut the sentence in proportion to its estimated tokens, shrinking pieces
+                # of text denser than the average, e.g. CJK text between ASCII
+                step = max(1, (max_tokens - 1) * len(sentence) // tokens)
+                start = 0
+                while start < len(sentence):
+                    piece = sentence[start:start + step]
+                    piece_tokens = count_tokens(piece, model)
+                    while piece_tokens >= max_tokens and len(piece) > 1:
+                        piece = piece[:max(1, len(piece) * (max_tokens - 1) // piece_tokens)]
+                        piece_tokens = count_tokens(piece, model)
+                    yield piece, piece_tokens
+                    start += len(piece)
+            else:
+                token_ids = encoding.encode_ordinary(sentence)
+                for start in range(0, len(token_ids), max_tokens - 1):
+                    piece_ids = token_ids[start:start + max_tokens - 1]
+                    yield encoding.decode(piece_ids), len(piece_ids)
+
+
+def _overlap(chunk: List[Tuple[str, int]], overlap_tokens: int) -> List[Tuple[str, int]]:
+    """The trailing pieces of a chunk that fit in overlap_tokens"""
+    overlap = []
+    total = 0
+    for piece, tokens in reversed(chunk):
+        total += tokens + 1
+        if total > overlap_tokens:
+            break
+        overlap.append((piece, tokens))
+    return overlap[::-1]
+
+
+@traced("summarize_text", "url")
+async def summarize_text(url: str, text: str, question: str) -> str:
     """Summarize text using the OpenAI API
 
+    The chunks are summarized concurrently, then their summaries are combined
+    level by level in groups that fit in a chunk, until one summary is left.
+
     Args:
         url (str): The url of the text
         text (str): The text to summarize
         question (str): The question to ask the model
-        driver (WebDriver): The webdriver to use to scroll the page
 
     Returns:
         str: The summary of the text
@@ -60,37 +145,61 @@ def summarize_text(
     if not text:
         return "Error: No text to summarize"
 
-    summaries = []
-    chunks = list(split_text(text))
-    scroll_ratio = 1 / len(chunks)
+    semaphore = asyncio.Semaphore(CFG.summary_concurrency)
 
-    for i, chunk in enumerate(chunks):
-        if driver:
-            scroll_to_percentage(driver, scroll_ratio * i)
+    async def summarize(chunk: str) -> str:
+        async with semaphore:
+            return await acreate_chat_completion(
+                model=CFG.fast_llm_model,
+                messages=[create_message(chunk, question)],
+            )
 
-        memory_to_add = f"Source: {url}\n" f"Raw content part#{i + 1}: {chunk}"
+    async def reduce(group: List[str]) -> str:
+        return await summarize("\n".join(group)) if len(group) > 1 else group[0]
 
-        #MEMORY.add_documents([Document(page_content=memory_to_add)])
+    # tokenizing a long page takes a while, so split it off the event loop
+    chunks = await asyncio.get_running_loop().run_in_executor(None, lambda: list(split_text(text)))
+    summaries = await asyncio.gather(*[summarize(chunk) for chunk in chunks])
 
-        messages = [create_message(chunk, question)]
+    while len(summaries) > 1:
+        groups = group_summaries(summaries, chunk_token_budget())
+        if len(groups) == 1:
+            break
+        summaries = await asyncio.gather(*[reduce(group) for group in groups])
+    else:
+        # a single chunk is already answered by its own summary
+        return summaries[0]
 
-        summary = create_chat_completion(
-            model=CFG.fast_llm_model,
-            messages=messages,
-        )
-        summaries.append(summary)
-        memory_to_add = f"Source: {url}\n" f"Content summary part#{i + 1}: {summary}"
+    return await summarize("\n".join(summaries))
 
-        #MEMORY.add_documents([Document(page_content=memory_to_add)])
 
+def group_summaries(summaries: List[str], max_tokens: int) -> List[List[str]]:
+    """Group consecutive summaries so each group's combined text fits in max_tokens
 
-    combined_summary = "\n".join(summaries)
-    messages = [create_message(combined_summary, question)]
+    Args:
+        summaries (List[str]): The summaries to group
+        max_tokens (int): The maximum combined tokens of a group
 
-    return create_chat_completion(
-        model=CFG.fast_llm_model,
-        messages=messages,
-    )
+    Returns:
+        List[List[str]]: The groups. Summaries are paired up regardless of length when
+            none of them fit together, so every level of the reduction shrinks.
+    """
+    groups = []
+    current_group = []
+    current_tokens = 0
+    for summary in summaries:
+        tokens = count_tokens(summary)
+        if current_group and current_tokens + tokens + 1 > max_tokens:
+            groups.append(current_group)
+            current_group = []
+            current_tokens = 0
+        current_group.append(summary)
+        current_tokens += tokens + 1
+    groups.append(current_group)
+
+    if len(groups) == len(summaries) > 1:
+        groups = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+    return groups
 
 
 def scroll_to_percentage(driver: WebDriver, ratio: float) -> None:
@@ -136,11 +245,26 @@ def write_to_file(filename: str, text: str) -> None:
     with open(filename, "w") as file:
         file.write(text)
 
-async def write_md_to_pdf(task: str, directory_name: str, text: str) -> None:
+async def write_md_to_pdf(task: str, directory_name: str, text: str) -> str:
+    """Write a report as markdown and get the link to its PDF
+
+    The PDF is rendered in a worker process, right away in "eager" PDF mode, or
+    when it is first downloaded in "lazy" mode.
+
+    Args:
+        task (str): The name of the report
+        directory_name (str): The output directory of the report
+        text (str): The report, in markdown
+
+    Returns:
+        str: The url-encoded path of the PDF
+    """
     file_path = f"./outputs/{directory_name}/{task}"
-    write_to_file(f"{file_path}.md", text)
-    md_to_pdf(f"{file_path}.md", f"{file_path}.pdf")
-    print(f"{task} written to {file_path}.pdf")
+    await asyncio.get_running_loop().run_in_executor(None, write_to_file, f"{file_path}.md", text)
+
+    if CFG.pdf_mode == "eager":
+        await pdf_renderer.render(f"{file_path}.md")
+        print(f"{task} rendered to PDF")
 
     encoded_file_path = urllib.parse.quote(f"{file_path}.pdf")
 
@@ -153,13 +277,8 @@ def read_txt_files(directory):
         if filename.endswith('.txt'):
             with open(os.path.join(directory, filename), 'r') as file:
                 all_text += file.read() + '\n'
+        elif filename.endswith('.txt.gz'):
+            with gzip.open(os.path.join(directory, filename), 'rt') as file:
+                all_text += file.read() + '\n'
 
     return all_text
-
-
-def md_to_pdf(input_file, output_file):
-    md2pdf(output_file,
-           md_content=None,
-           md_file_path=input_file,
-           css_file_path=None,
-           base_url=None)
@@ -0,0 +1,83 @@
+"""Token counting, shared by the text processing and the LLM usage metrics"""
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import tiktoken
+
+from config import Config
+
+CFG = Config()
+
+# Every token covers at least one character, and English text averages about four
+CHARS_PER_TOKEN = 4
+# Seconds to wait before trying again to load a tokenizer that failed to load
+RETRY_LOAD_AFTER = 300
+
+_encodings: Dict[str, tiktoken.Encoding] = {}
+_failed: Dict[str, Tuple[float, str]] = {}
+_lock = threading.Lock()
+
+
+def get_encoding(model: str) -> Optional[tiktoken.Encoding]:
+    """Get the (cached) tokenizer of the given model
+
+    A tokenizer that can't be loaded isn't tried again for RETRY_LOAD_AFTER
+    seconds, so a failed download doesn't hold up every call, nor disable
+    counting for the lifetime of the process.
+
+    Args:
+        model (str): The model name
+
+    Returns:
+        Optional[tiktoken.Encoding]: The model's tokenizer, cl100k_base for unknown models,
+            or None if the tokenizer data can't be loaded (it is downloaded on first use)
+    """
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return encoding
+    with _lock:
+        if model in _encodings:
+            return _encodings[model]
+        failed_at, _ = _failed.get(model, (None, None))
+        if failed_at is not None and time.monotonic() - failed_at < RETRY_LOAD_AFTER:
+            return None
+        try:
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            if failed_at is None:
+                logging.warning(f"Could not load the tokenizer for {model}, estimating tokens instead: {e}")
+            _failed[model] = (time.monotonic(), str(e))
+            return None
+        _failed.pop(model, None)
+        _encodings[model] = encoding
+        return encoding
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the tokens of the given text without a tokenizer: about four ASCII
+    characters per token, and one token per byte of other characters, which is the
+    most a byte-level tokenizer can use for them (CJK text or emoji take 1-4 tokens
+    per character)"""
+    ascii_bytes = len(text.encode("ascii", errors="ignore"))
+    return -(-ascii_bytes // CHARS_PER_TOKEN) + len(text.encode("utf-8")) - ascii_bytes
+
+
+def count_tokens(text: str, model: str = CFG.fast_llm_model) -> int:
+    """Count the tokens of the given text
+
+    Args:
+        text (str): The text to count the tokens of
+        model (str, optional): The model whose tokenizer to use. Defaults to the fast model.
+
+    Returns:
+        int: The number of tokens, or an estimate when the tokenizer is unavailable
+    """
+    encoding = get_encoding(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode_ordinary(text))
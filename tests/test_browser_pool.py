@@ -0,0 +1,103 @@
+"""Tests of the pool of reusable browsers."""
+import threading
+
+import pytest
+
+from actions.browser_pool import BrowserPool
+
+
+class FakeDriver:
+    def __init__(self, port: int) -> None:
+        self.port = port
+        self.crashed = False
+        self.quit_calls = 0
+        self.pages = []
+
+    def execute_script(self, script: str):
+        if self.crashed:
+            raise RuntimeError("chrome not reachable")
+        return 1
+
+    def get(self, url: str) -> None:
+        if self.crashed:
+            raise RuntimeError("chrome not reachable")
+        self.pages.append(url)
+
+    def quit(self) -> None:
+        self.quit_calls += 1
+
+
+def make_pool(**kwargs) -> BrowserPool:
+    return BrowserPool(base_port=9000, factory=FakeDriver, **kwargs)
+
+
+def test_a_returned_browser_is_reused():
+    pool = make_pool(size=2)
+    with pool.driver() as driver:
+        first = driver
+    with pool.driver() as driver:
+        assert driver is first
+    assert first.pages == ["about:blank", "about:blank"]
+    assert pool.stats() == {"size": 2, "idle": 1, "busy": 0, "launched": 1, "recycled": 0}
+
+
+def test_browsers_running_side_by_side_get_ports_of_their_own():
+    pool = make_pool(size=2)
+    first, second = pool.checkout(), pool.checkout()
+    assert {first.port, second.port} == {9000, 9001}
+    with pytest.raises(TimeoutError):
+        pool.checkout(timeout=0.05)
+    pool.checkin(first)
+    assert pool.checkout(timeout=0.05) is first
+
+
+def test_a_checkout_waits_for_a_browser_to_be_returned():
+    pool = make_pool(size=1)
+    pooled = pool.checkout()
+    threading.Timer(0.05, pool.checkin, (pooled,)).start()
+    assert pool.checkout(timeout=5) is pooled
+
+
+def test_a_crashed_browser_is_replaced():
+    pool = make_pool(size=1)
+    pooled = pool.checkout()
+    pool.checkin(pooled)
+    pooled.driver.crashed = True
+
+    replacement = pool.checkout(timeout=1)
+    assert replacement is not pooled
+    assert replacement.port == pooled.port
+    assert pooled.driver.quit_calls == 1
+    assert pool.stats()["launched"] == 2 and pool.stats()["recycled"] == 1
+
+
+def test_a_browser_that_failed_a_page_load_is_not_reused():
+    pool = make_pool(size=1)
+    with pytest.raises(ValueError):
+        with pool.driver() as driver:
+            raise ValueError("page crashed")
+    assert driver.quit_calls == 1
+    with pool.driver() as replacement:
+        assert replacement is not driver
+
+
+def test_a_browser_is_recycled_after_max_pages():
+    pool = make_pool(size=1, max_pages=2)
+    drivers = []
+    for _ in range(3):
+        with pool.driver() as driver:
+            drivers.append(driver)
+    assert drivers[0] is drivers[1] is not drivers[2]
+    assert drivers[0].quit_calls == 1
+
+
+def test_closing_quits_idle_browsers_and_those_returned_later():
+    pool = make_pool(size=2)
+    idle, busy = pool.checkout(), pool.checkout()
+    pool.checkin(idle)
+    pool.close()
+    assert idle.driver.quit_calls == 1
+    pool.checkin(busy)
+    assert busy.driver.quit_calls == 1
+    with pytest.raises(RuntimeError):
+        pool.checkout()
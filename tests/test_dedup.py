@@ -0,0 +1,89 @@
+"""Tests of near-duplicate detection of page text."""
+import random
+import threading
+
+from processing.dedup import NearDuplicateIndex
+from processing.text import count_tokens
+
+WORDS = [f"word{number}" for number in range(2000)]
+
+
+def paragraph(rng: random.Random, sentences: int = 6) -> str:
+    return " ".join(" ".join(rng.choice(WORDS) for _ in range(10)) + "." for _ in range(sentences))
+
+
+def page(rng: random.Random, paragraphs: int = 6) -> str:
+    return "\n".join(paragraph(rng) for _ in range(paragraphs))
+
+
+def test_an_exact_copy_of_a_page_is_a_duplicate():
+    text = page(random.Random(1))
+    index = NearDuplicateIndex(block_tokens=128)
+    first = index.deduplicate("https://example.com/a", text)
+    copy = index.deduplicate("https://mirror.example.org/a", text)
+
+    assert first.dropped_blocks == 0 and first.text.split() == text.split()
+    assert copy.is_duplicate
+    assert copy.duplicate_of == "https://example.com/a"
+    assert copy.text == ""
+
+
+def test_drops_only_the_near_duplicate_blocks_of_a_page():
+    rng = random.Random(2)
+    original = page(rng)
+    new_paragraph = paragraph(rng, 12)
+    # a mirrored copy with an edited word and a paragraph of its own
+    mirror = original.replace("word", "wrd", 1) + "\n" + new_paragraph
+    index = NearDuplicateIndex(block_tokens=128)
+    index.deduplicate("https://example.com/a", original)
+    deduplicated = index.deduplicate("https://mirror.example.org/a", mirror)
+
+    assert not deduplicated.is_duplicate
+    assert 0 < deduplicated.dropped_blocks < deduplicated.blocks
+    assert new_paragraph in " ".join(deduplicated.text.split())
+    assert deduplicated.duplicate_of == "https://example.com/a"
+
+
+def test_distinct_pages_are_kept_whole():
+    rng = random.Random(3)
+    index = NearDuplicateIndex(block_tokens=128)
+    index.deduplicate("https://example.com/a", page(rng))
+    text = page(rng)
+    deduplicated = index.deduplicate("https://example.com/b", text)
+    assert deduplicated.dropped_blocks == 0
+    assert deduplicated.tokens_saved == 0
+    assert deduplicated.text.split() == text.split()
+
+
+def test_counts_the_tokens_saved_and_reports_stats():
+    rng = random.Random(4)
+    text = page(rng)
+    index = NearDuplicateIndex(block_tokens=128)
+    first = index.deduplicate("https://example.com/a", text)
+    copy = index.deduplicate("https://mirror.example.org/a", text)
+    other = index.deduplicate("https://example.com/b", page(rng))
+
+    # the blocks are joined by newlines, which the dropped blocks don't include
+    assert count_tokens(text) - first.blocks <= copy.tokens_saved <= count_tokens(text)
+    assert index.stats() == {
+        "pages": 3,
+        "duplicate_pages": 1,
+        "blocks": first.blocks + other.blocks,
+        "dropped_blocks": copy.blocks,
+        "tokens_saved": copy.tokens_saved,
+    }
+
+
+def test_pages_deduplicated_from_several_threads_are_each_counted():
+    rng = random.Random(5)
+    text = page(rng)
+    index = NearDuplicateIndex(block_tokens=128)
+    threads = [threading.Thread(target=index.deduplicate, args=(f"https://example.com/{number}", text))
+               for number in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = index.stats()
+    assert stats["pages"] == 8
+    assert stats["duplicate_pages"] == 7
@@ -0,0 +1,88 @@
+"""Tests of the event history of research jobs."""
+import asyncio
+
+from agent.jobs import JobRecord
+
+
+async def collect(record: JobRecord, start: int = 0) -> list:
+    return [event async for event in record.follow(start)]
+
+
+def test_keeps_only_the_last_events():
+    async def run():
+        record = JobRecord("job", {}, event_history=10)
+        for number in range(100):
+            record.publish({"type": "logs", "output": str(number)})
+        assert len(record.events) == 10
+        assert record.published == 100
+        record.finish("completed", {"path": "outputs/job/research_report.md"}, None)
+        return await collect(record)
+
+    events = asyncio.run(run())
+    assert events[0] == {"type": "logs", "output": "(90 earlier events of the job are no longer kept)"}
+    assert [event["output"] for event in events[1:]] == [str(number) for number in range(90, 100)]
+
+
+def test_a_slow_follower_gets_every_event_a_fast_one_got():
+    async def run():
+        record = JobRecord("job", {}, event_history=3)
+        fast = asyncio.create_task(collect(record))
+
+        async def slow_collect():
+            events = []
+            async for event in record.follow():
+                events.append(event)
+                await asyncio.sleep(0.01)
+            return events
+
+        slow = asyncio.create_task(slow_collect())
+        await asyncio.sleep(0)
+        for number in range(10):
+            record.publish({"type": "report", "output": str(number)})
+        record.finish("completed", {"path": "outputs/job/research_report.md"}, None)
+        fast_events = await fast
+        assert len(record.events) == 10  # the slow follower has not read them yet
+        slow_events = await slow
+        assert len(record.events) == 3
+        return fast_events, slow_events, await collect(record)
+
+    fast_events, slow_events, late = asyncio.run(run())
+    numbers = [str(number) for number in range(10)]
+    assert [event["output"] for event in fast_events] == numbers
+    assert [event["output"] for event in slow_events] == numbers
+    assert [event["output"] for event in late] == [
+        "(7 earlier events of the job are no longer kept)", "7", "8", "9"]
+
+
+def test_publishing_waits_while_a_follower_lags_a_full_history_behind():
+    async def run():
+        record = JobRecord("job", {}, event_history=3)
+        events = record.follow()
+        for number in range(3):
+            record.publish({"type": "report", "output": str(number)})
+        assert (await events.__anext__())["output"] == "0"
+        waiting = asyncio.create_task(record.wait_for_room())
+        await asyncio.sleep(0.01)
+        blocked = not waiting.done()
+        await events.__anext__()  # reading "1" marks "0" as read
+        await asyncio.wait_for(waiting, 1)
+        await events.aclose()
+        return blocked, list(record.followers)
+
+    blocked, followers = asyncio.run(run())
+    assert blocked
+    assert followers == []
+
+
+def test_a_follower_waits_for_new_events():
+    async def run():
+        record = JobRecord("job", {}, event_history=10)
+        following = asyncio.create_task(collect(record))
+        await asyncio.sleep(0)
+        record.publish({"type": "logs", "output": "first"})
+        await asyncio.sleep(0)
+        record.publish({"type": "logs", "output": "second"})
+        record.finish("completed", {}, None)
+        return await following
+
+    assert [event["output"] for event in asyncio.run(run())] == ["first", "second"]
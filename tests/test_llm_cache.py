@@ -0,0 +1,61 @@
+"""Tests of the LLM response cache."""
+import asyncio
+import json
+
+import pytest
+
+from agent import llm_utils
+from agent.llm_cache import LLMCache
+
+MODEL = "test-model"
+MESSAGES = [{"role": "user", "content": "list the queries"}]
+
+
+@pytest.fixture
+def replies(monkeypatch, tmp_path):
+    """Answers requests with the queued replies, caching them in a fresh cache"""
+    queued = []
+
+    async def acreate(**kwargs):
+        return {"choices": [{"message": {"role": "assistant", "content": queued.pop(0)}}]}
+
+    monkeypatch.setattr(llm_utils, "llm_cache", LLMCache(str(tmp_path / "llm_cache.sqlite3")))
+    monkeypatch.setattr(llm_utils.CFG, "llm_cache_enabled", True)
+    monkeypatch.setattr(llm_utils.lc_openai.ChatCompletion, "acreate", acreate)
+    return queued
+
+
+def complete(**kwargs) -> str:
+    async def run() -> str:
+        try:
+            return await llm_utils.acreate_chat_completion(MESSAGES, model=MODEL, **kwargs)
+        finally:
+            await llm_utils.close_aiosession()
+    return asyncio.run(run())
+
+
+def test_the_key_depends_on_max_tokens():
+    assert LLMCache.key(MODEL, MESSAGES, 0, 100) != LLMCache.key(MODEL, MESSAGES, 0, 200)
+
+
+def test_replays_a_cached_reply(replies):
+    replies.append('["a", "b"]')
+    assert complete(validate=json.loads) == '["a", "b"]'
+    assert complete(validate=json.loads) == '["a", "b"]'
+    assert replies == []
+
+
+def test_a_reply_that_fails_validation_is_not_cached(replies):
+    replies.extend(["Sure! Here are the queries:", '["a", "b"]'])
+    with pytest.raises(json.JSONDecodeError):
+        complete(validate=json.loads)
+    assert complete(validate=json.loads) == '["a", "b"]'
+    assert llm_utils.llm_cache.stats()["hits"] == 0
+
+
+def test_a_cached_reply_that_fails_validation_is_requested_again(replies):
+    replies.extend(["not json", '["a"]'])
+    assert complete() == "not json"
+    assert complete(validate=json.loads) == '["a"]'
+    assert complete(validate=json.loads) == '["a"]'
+    assert replies == []
@@ -0,0 +1,42 @@
+"""Tests of the rate limit handling of LLM requests."""
+import asyncio
+
+from openai.error import RateLimitError
+
+from agent import llm_utils
+
+MODEL = "test-model"
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+def test_rate_limit_drains_the_budget_and_is_retried_once(monkeypatch):
+    calls = []
+
+    async def acreate(**kwargs):
+        calls.append(kwargs)
+        if len(calls) == 1:
+            raise RateLimitError("Rate limit reached")
+        return {"choices": [{"message": {"role": "assistant", "content": "hi"}}]}
+
+    scheduler = llm_utils.LLMScheduler(max_retries=3)
+    budget = scheduler._budgets[MODEL] = llm_utils.ModelBudget(rpm=600, tpm=6_000_000)
+    monkeypatch.setattr(scheduler, "backoff", lambda attempt: 0)
+    monkeypatch.setattr(llm_utils, "scheduler", scheduler)
+    monkeypatch.setattr(llm_utils.lc_openai.ChatCompletion, "acreate", acreate)
+
+    async def run() -> str:
+        try:
+            return await llm_utils.acreate_chat_completion(MESSAGES, model=MODEL, use_cache=False)
+        finally:
+            await llm_utils.close_aiosession()
+
+    response = asyncio.run(run())
+
+    assert response == "hi"
+    assert len(calls) == 2
+    # the provider's retries are off, so the rate limit reaches the scheduler
+    assert all(call["max_retries"] == 0 for call in calls)
+    assert budget.retries == 1
+    assert budget.failures == 0
+    # the drained budget made the retry wait for a request to refill
+    assert budget.max_wait > 0
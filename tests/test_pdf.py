@@ -0,0 +1,73 @@
+"""Tests of rendering reports to PDF."""
+import asyncio
+import os
+import sys
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+from agent.storage import OutputsStore
+from processing.pdf import PdfRenderer
+
+
+def fake_md2pdf(monkeypatch) -> list:
+    rendered = []
+    core = types.ModuleType("md2pdf.core")
+
+    def md2pdf(output, md_content=None, md_file_path=None, css_file_path=None, base_url=None):
+        rendered.append(md_file_path)
+        with open(output, "wb") as file:
+            file.write(b"%PDF-" + open(md_file_path, "rb").read())
+
+    core.md2pdf = md2pdf
+    monkeypatch.setitem(sys.modules, "md2pdf", types.ModuleType("md2pdf"))
+    monkeypatch.setitem(sys.modules, "md2pdf.core", core)
+    return rendered
+
+
+def make_renderer() -> PdfRenderer:
+    renderer = PdfRenderer()
+    renderer._pool = ThreadPoolExecutor(1)
+    return renderer
+
+
+def test_renders_a_report_once_next_to_its_markdown(tmp_path, monkeypatch):
+    rendered = fake_md2pdf(monkeypatch)
+    md_path = tmp_path / "workspace" / "research_report.md"
+    md_path.parent.mkdir()
+    md_path.write_text("# Report")
+    renderer = make_renderer()
+
+    async def run():
+        return await renderer.render(str(md_path)), await renderer.render(str(md_path))
+
+    (first, was_rendered), (second, rendered_again) = asyncio.run(run())
+    assert first == second and os.path.dirname(first) == str(md_path.parent)
+    assert was_rendered and not rendered_again
+    assert len(rendered) == 1
+
+
+def test_replaces_the_pdf_of_an_earlier_version_of_a_report(tmp_path, monkeypatch):
+    fake_md2pdf(monkeypatch)
+    md_path = tmp_path / "research_report.md"
+    md_path.write_text("# Report")
+    renderer = make_renderer()
+    first, _ = asyncio.run(renderer.render(str(md_path)))
+    md_path.write_text("# Revised report")
+    second, _ = asyncio.run(renderer.render(str(md_path)))
+
+    assert first != second
+    assert sorted(os.listdir(tmp_path)) == sorted(["research_report.md", os.path.basename(second)])
+
+
+def test_a_pdf_is_deleted_with_its_workspace(tmp_path, monkeypatch):
+    fake_md2pdf(monkeypatch)
+    store = OutputsStore(root=str(tmp_path / "outputs"), index_path=str(tmp_path / "index.sqlite3"), max_bytes=0)
+    md_path = tmp_path / "outputs" / "workspace" / "research_report.md"
+    md_path.parent.mkdir(parents=True)
+    md_path.write_text("# Report")
+    pdf_path, _ = asyncio.run(make_renderer().render(str(md_path)))
+    store.index("workspace")
+
+    assert os.path.basename(pdf_path) in store.artifacts("workspace")
+    assert store.enforce() == ["workspace"]
+    assert not os.path.exists(pdf_path)
@@ -0,0 +1,74 @@
+"""Tests of fitting research to the report's context budget."""
+import random
+import re
+
+from processing import ranking
+from processing.ranking import report_context_budget, select_context
+from processing.tokens import count_tokens
+
+WORDS = [f"word{number}" for number in range(500)]
+
+
+def page(rng: random.Random, topic: str, sentences: int = 20) -> str:
+    return " ".join(" ".join(rng.choice(WORDS) for _ in range(8)) + f" {topic}." for _ in range(sentences))
+
+
+def research(urls: dict) -> str:
+    return "\n".join(f"Information gathered from url {url}: {text}" for url, text in urls.items())
+
+
+def test_research_that_fits_is_passed_through_unchanged():
+    text = research({"https://example.com/a": "Everest is 8849 m tall."})
+    assert select_context(text, "How tall is Everest?", 1000) == (text, [], 0)
+
+
+def test_selects_the_relevant_passages_within_the_budget():
+    rng = random.Random(1)
+    text = research({
+        "https://example.com/everest": page(rng, "everest"),
+        "https://example.com/rivers": page(rng, "rivers"),
+        "https://example.com/deserts": page(rng, "deserts"),
+    })
+    context, passages, total = select_context(text, "everest", 500)
+
+    assert count_tokens(context) <= 500
+    assert 0 < len(passages) < total
+    assert {passage.source for passage in passages} == {"https://example.com/everest"}
+    assert context.startswith("Information gathered from url https://example.com/everest: ")
+
+
+def test_keeps_the_source_url_of_every_selected_passage():
+    rng = random.Random(2)
+    urls = {f"https://example.com/{number}": page(rng, "mountains", 8) for number in range(6)}
+    context, passages, _ = select_context(research(urls), "mountains", 800)
+
+    assert count_tokens(context) <= 800
+    assert len({passage.source for passage in passages}) > 1
+    for passage in passages:
+        # the closest header before a passage introduces its own url
+        headers = re.findall(r"Information gathered from url (\S+): ", context[:context.index(passage.text)])
+        assert headers[-1] == passage.source
+
+
+def test_leaves_failed_pages_out_of_the_context():
+    rng = random.Random(3)
+    text = research({"https://example.com/a": page(rng, "everest")}) + \
+        "\nError processing the url https://example.com/b: timed out everest everest"
+    _, passages, _ = select_context(text, "everest", 200)
+    assert passages and all(passage.source == "https://example.com/a" for passage in passages)
+
+
+def test_the_budget_is_what_the_token_limit_leaves_for_the_research(monkeypatch):
+    monkeypatch.setattr(ranking.CFG, "report_context_tokens", 0)
+    monkeypatch.setattr(ranking.CFG, "report_completion_tokens", 2000)
+    monkeypatch.setattr(ranking.CFG, "smart_token_limit", 8000)
+    messages = ["You are a research assistant.", "Write a report about: everest " * 20]
+    budget = report_context_budget(messages)
+    assert budget < 6000
+    assert budget + sum(count_tokens(message) for message in messages) + 2000 <= 8000
+
+    monkeypatch.setattr(ranking.CFG, "smart_token_limit", 32000)
+    assert report_context_budget(messages) == budget + 24000
+
+    monkeypatch.setattr(ranking.CFG, "report_context_tokens", 3000)
+    assert report_context_budget(messages) == 3000
@@ -0,0 +1,78 @@
+"""Tests of the process-wide scheduling of page loads."""
+import asyncio
+import time
+
+from actions.scrape_scheduler import ScrapeScheduler
+
+
+async def load(scheduler: ScrapeScheduler, url: str, starts: list, seconds: float) -> None:
+    async with scheduler.slot(url):
+        starts.append((url, time.monotonic()))
+        await asyncio.sleep(seconds)
+
+
+def test_spaces_the_loads_of_a_host_while_the_global_slots_are_full():
+    async def run():
+        scheduler = ScrapeScheduler(max_concurrent=1, max_per_host=2, host_delay=0.2)
+        starts = []
+        # the other host holds the only slot while both loads of example.com wait for it
+        await asyncio.gather(
+            load(scheduler, "https://other.org/a", starts, 0.3),
+            load(scheduler, "https://example.com/a", starts, 0.01),
+            load(scheduler, "https://example.com/b", starts, 0.01),
+        )
+        return [start for url, start in starts if "example.com" in url]
+
+    first, second = asyncio.run(run())
+    assert second - first >= 0.2
+
+
+async def count_concurrent(scheduler: ScrapeScheduler, urls: list) -> dict:
+    """The most loads that ran at once, overall and per host"""
+    running = {"all": 0}
+    most = {"all": 0}
+
+    async def load_url(url: str) -> None:
+        host = url.split("/")[2]
+        async with scheduler.slot(url):
+            for key in ("all", host):
+                running[key] = running.get(key, 0) + 1
+                most[key] = max(most.get(key, 0), running[key])
+            await asyncio.sleep(0.02)
+            for key in ("all", host):
+                running[key] -= 1
+
+    await asyncio.gather(*[load_url(url) for url in urls])
+    return most
+
+
+def test_limits_the_loads_running_at_once():
+    scheduler = ScrapeScheduler(max_concurrent=3, max_per_host=10, host_delay=0)
+    urls = [f"https://site{number}.example.com/" for number in range(10)]
+    assert asyncio.run(count_concurrent(scheduler, urls))["all"] == 3
+    assert scheduler.stats() == {"active": 0, "queued": 0, "hosts": 0}
+
+
+def test_limits_the_loads_of_a_host_running_at_once():
+    scheduler = ScrapeScheduler(max_concurrent=10, max_per_host=2, host_delay=0)
+    urls = [f"https://example.com/{number}" for number in range(6)] + ["https://example.org/a"]
+    most = asyncio.run(count_concurrent(scheduler, urls))
+    assert most["example.com"] == 2
+    assert most["all"] == 3
+
+
+def test_waiting_loads_are_served_by_priority():
+    async def run():
+        scheduler = ScrapeScheduler(max_concurrent=1, max_per_host=10, host_delay=0)
+        order = []
+
+        async def load_url(url: str, priority: float) -> None:
+            async with scheduler.slot(url, priority):
+                order.append(url)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(load_url("https://a.example.com/", 0), load_url("https://b.example.com/", 5),
+                             load_url("https://c.example.com/", 1))
+        return order
+
+    assert asyncio.run(run()) == ["https://a.example.com/", "https://c.example.com/", "https://b.example.com/"]
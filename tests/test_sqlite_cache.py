@@ -0,0 +1,51 @@
+"""Tests of the SQLite storage shared by the LLM and page caches."""
+import time
+
+from actions.page_cache import PageCache
+from agent.llm_cache import LLMCache
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = LLMCache(str(tmp_path / "llm_cache.sqlite3"), max_age=60)
+    cache.set("fresh", "model", "reply")
+    cache.set("stale", "model", "reply")
+    cache._table.connect().execute("UPDATE responses SET created = ? WHERE key = 'stale'", (time.time() - 120,))
+    assert cache.get("fresh") == "reply"
+    assert cache.get("stale") is None
+
+
+def test_evicts_the_least_recently_used_entries_beyond_the_size_limit(tmp_path):
+    cache = LLMCache(str(tmp_path / "llm_cache.sqlite3"), max_bytes=350)
+    for key in ("a", "b", "c"):
+        cache.set(key, "model", key * 100)
+        time.sleep(0.01)
+    # "a" was used last, so "b" is evicted when "d" no longer fits
+    assert cache.get("a") == "a" * 100
+    cache.set("d", "model", "d" * 100)
+    assert cache.get("b") is None
+    assert cache.get("a") == "a" * 100
+    assert cache.get("c") == "c" * 100
+    assert cache.stats()["bytes"] <= 350
+
+
+def test_the_size_is_kept_across_replacements_and_deletions(tmp_path):
+    cache = LLMCache(str(tmp_path / "llm_cache.sqlite3"))
+    cache.set("a", "model", "x" * 10)
+    cache.set("a", "model", "x" * 30)
+    cache.set("b", "model", "x" * 5)
+    assert cache.stats()["bytes"] == 35
+    cache.delete("a")
+    assert cache.stats()["bytes"] == 5
+    assert LLMCache(str(tmp_path / "llm_cache.sqlite3")).get("b") == "x" * 5
+
+
+def test_a_page_evicted_from_disk_leaves_the_memory_front_too(tmp_path):
+    cache = PageCache(str(tmp_path / "page_cache.sqlite3"), max_bytes=250, compress=False)
+    cache.set("https://example.com/a", "a" * 100, 1.0, False)
+    time.sleep(0.01)
+    cache.set("https://example.com/b", "b" * 100, 1.0, False)
+    time.sleep(0.01)
+    cache.set("https://example.com/c", "c" * 100, 1.0, True)
+    assert cache.get("https://example.com/a") is None
+    assert cache.get("https://example.com/c") == "c" * 100
+    assert cache.stats()["disk_bytes"] <= 250
@@ -0,0 +1,61 @@
+"""Tests of the retention and compaction of research outputs."""
+import os
+
+from agent.storage import OutputsStore
+
+
+def make_store(tmp_path, **kwargs) -> OutputsStore:
+    return OutputsStore(root=str(tmp_path / "outputs"), index_path=str(tmp_path / "index.sqlite3"), **kwargs)
+
+
+def make_workspace(store: OutputsStore, name: str) -> str:
+    path = os.path.join(store.root, name)
+    os.makedirs(path)
+    with open(os.path.join(path, "research-query.txt"), "w") as file:
+        file.write("research")
+    store.index(name)
+    return path
+
+
+def test_deletes_expired_workspaces_but_not_pinned_ones(tmp_path):
+    store = make_store(tmp_path, max_age=0)
+    expired = make_workspace(store, "expired")
+    pinned = make_workspace(store, "pinned")
+    store.pin("pinned")
+    assert store.enforce() == ["expired"]
+    assert not os.path.exists(expired)
+    assert os.path.exists(pinned)
+
+
+def test_a_workspace_pinned_after_the_pins_were_read_is_kept(tmp_path, monkeypatch):
+    store = make_store(tmp_path, max_age=0)
+    path = make_workspace(store, "workspace")
+    delete = store._delete
+
+    def pin_first(workspace: str) -> bool:
+        # a run pins the workspace between enforce reading the pins and deleting it
+        store.pin(workspace)
+        return delete(workspace)
+
+    monkeypatch.setattr(store, "_delete", pin_first)
+    assert store.enforce() == []
+    assert os.path.exists(path)
+
+
+def test_compacts_a_released_workspace(tmp_path):
+    store = make_store(tmp_path)
+    path = make_workspace(store, "workspace")
+    store.pin("workspace")
+    store.release("workspace")
+    assert os.listdir(path) == ["research-query.txt.gz"]
+    assert store.stats()["pinned"] == 0
+
+
+def test_does_not_compact_a_workspace_another_run_has_pinned(tmp_path):
+    store = make_store(tmp_path)
+    path = make_workspace(store, "workspace")
+    store.pin("workspace")
+    store.pin("workspace")
+    store.release("workspace")
+    assert os.listdir(path) == ["research-query.txt"]
+    assert store.stats()["pinned"] == 1
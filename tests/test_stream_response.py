@@ -0,0 +1,61 @@
+"""Tests of streaming responses to slow clients."""
+import asyncio
+
+import pytest
+
+from agent import llm_utils
+
+MODEL = "test-model"
+MESSAGES = [{"role": "user", "content": "write the report"}]
+
+
+class SlowClient:
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.received = []
+
+    async def send_json(self, message: dict) -> None:
+        await asyncio.sleep(self.delay)
+        self.received.append(message["output"])
+
+
+@pytest.fixture(autouse=True)
+def upstream(monkeypatch):
+    async def acreate(**kwargs):
+        async def chunks():
+            for line in range(20):
+                yield {"choices": [{"delta": {"content": f"line {line}\n"}}]}
+        return chunks()
+
+    monkeypatch.setattr(llm_utils.lc_openai.ChatCompletion, "acreate", acreate)
+    monkeypatch.setattr(llm_utils, "_llm_semaphore", None)
+    monkeypatch.setattr(llm_utils.CFG, "llm_concurrency", 1)
+
+
+def test_a_slow_client_does_not_hold_the_llm_slot(monkeypatch):
+    monkeypatch.setattr(llm_utils.CFG, "stream_buffer_size", 64)
+    client = SlowClient(delay=0.01)
+
+    async def run():
+        streaming = asyncio.create_task(llm_utils.stream_response(MODEL, MESSAGES, 0, None, client))
+        await asyncio.sleep(0.02)
+        # the model finished generating, so another request gets the slot while the client catches up
+        await asyncio.wait_for(llm_utils.get_llm_semaphore().acquire(), timeout=0.05)
+        assert len(client.received) < 20
+        llm_utils.get_llm_semaphore().release()
+        return await streaming
+
+    response = asyncio.run(run())
+    assert response == "".join(f"line {line}\n" for line in range(20))
+    assert "".join(client.received) == response
+
+
+def test_a_client_too_far_behind_fails_its_stream(monkeypatch):
+    monkeypatch.setattr(llm_utils.CFG, "stream_buffer_size", 5)
+    client = SlowClient(delay=1)
+
+    async def run():
+        await llm_utils.stream_response(MODEL, MESSAGES, 0, None, client)
+
+    with pytest.raises(llm_utils.StreamOverflowError):
+        asyncio.run(run())
@@ -0,0 +1,85 @@
+"""Tests of splitting text into chunks that fit the model's context and summarizing them."""
+import asyncio
+
+import pytest
+
+import processing.text as text_module
+from processing.text import count_tokens, split_text, summarize_text
+
+
+def test_splits_non_ascii_text_with_fewer_characters_than_the_budget():
+    text = "🙂" * 800
+    chunks = list(split_text(text, max_tokens=1000, overlap_tokens=0))
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk) <= 1000 for chunk in chunks)
+    assert "".join(chunk.replace("\n", "") for chunk in chunks) == text
+
+
+def test_splits_oversized_mixed_text_into_chunks_within_the_budget():
+    paragraphs = ["日本語のテキストと English words 混在 " * 200 + "🙂" * 50 for _ in range(5)]
+    text = "\n".join(paragraphs)
+    chunks = list(split_text(text, max_tokens=500, overlap_tokens=0))
+    assert all(count_tokens(chunk) <= 500 for chunk in chunks)
+    assert "".join(chunks).replace("\n", "") == text.replace("\n", "")
+
+
+def test_keeps_short_text_whole():
+    assert list(split_text("数据 " * 10, max_tokens=100)) == ["数据 " * 10]
+
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """Answers every summary request with a numbered summary, padded to state["words"] words,
+    recording the requests"""
+    state = {"requests": [], "running": 0, "most_running": 0, "words": 0}
+
+    async def acreate_chat_completion(model, messages, **kwargs):
+        state["requests"].append(messages[0]["content"])
+        number = len(state["requests"])
+        state["running"] += 1
+        state["most_running"] = max(state["most_running"], state["running"])
+        await asyncio.sleep(0.01)
+        state["running"] -= 1
+        return " ".join([f"summary-{number}"] + ["word"] * state["words"])
+
+    monkeypatch.setattr(text_module, "acreate_chat_completion", acreate_chat_completion)
+    monkeypatch.setattr(text_module.CFG, "browse_chunk_max_length", 100)
+    monkeypatch.setattr(text_module.CFG, "summary_concurrency", 3)
+    return state
+
+
+def page(sentences: int) -> str:
+    return " ".join(f"Sentence {number} of the page is about mountains." for number in range(sentences))
+
+
+def test_a_single_chunk_is_summarized_once(llm):
+    assert asyncio.run(summarize_text("https://example.com", page(3), "mountains")) == "summary-1"
+    assert len(llm["requests"]) == 1
+
+
+def test_summarizes_the_chunks_concurrently_then_combines_their_summaries(llm):
+    text = page(100)
+    chunks = list(split_text(text, 100))
+    summary = asyncio.run(summarize_text("https://example.com", text, "mountains"))
+
+    assert len(chunks) > 3
+    # one request per chunk, then one to combine all their summaries, which fit together
+    assert len(llm["requests"]) == len(chunks) + 1
+    assert summary == f"summary-{len(chunks) + 1}"
+    assert llm["most_running"] == 3
+    assert all(f"summary-{number}\n" in llm["requests"][-1] for number in range(1, len(chunks)))
+
+
+def test_combines_summaries_that_do_not_fit_together_level_by_level(llm):
+    # summaries of ~40 tokens, so only two fit together in a chunk of 100
+    llm["words"] = 39
+    text = page(100)
+    chunks = list(split_text(text, 100))
+    summary = asyncio.run(summarize_text("https://example.com", text, "mountains"))
+
+    requests = llm["requests"]
+    # the summaries were combined over several levels, the last one combining two of them
+    assert len(requests) > len(chunks) + 1
+    assert requests[-1].count("summary-") == 2
+    assert summary.startswith(f"summary-{len(requests)} ")
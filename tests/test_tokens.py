@@ -0,0 +1,23 @@
+"""Tests of token counting."""
+from processing import tokens
+
+
+def test_a_tokenizer_that_failed_to_load_is_tried_again_later(monkeypatch):
+    loads = []
+
+    def encoding_for_model(model):
+        loads.append(model)
+        if len(loads) == 1:
+            raise OSError("download failed")
+        return "encoding"
+
+    monkeypatch.setattr(tokens.tiktoken, "encoding_for_model", encoding_for_model)
+    clock = [1000.0]
+    monkeypatch.setattr(tokens.time, "monotonic", lambda: clock[0])
+    assert tokens.get_encoding("retry-model") is None
+    assert tokens.get_encoding("retry-model") is None
+    assert loads == ["retry-model"]
+    clock[0] += tokens.RETRY_LOAD_AFTER
+    assert tokens.get_encoding("retry-model") == "encoding"
+    assert tokens.get_encoding("retry-model") == "encoding"
+    assert loads == ["retry-model", "retry-model"]
@@ -0,0 +1,44 @@
+"""Tests of canonical urls."""
+from actions.urls import VisitedIndex, canonicalize_url
+
+
+def test_drops_tracking_parameters_and_sorts_the_rest():
+    assert canonicalize_url("https://example.com/a?utm_source=news&id=3&fbclid=abc&b=2") == \
+        "https://example.com/a?b=2&id=3"
+    assert canonicalize_url("https://example.com/a?utm_campaign=x") == "https://example.com/a"
+
+
+def test_keeps_parameters_that_change_the_page():
+    assert canonicalize_url("https://example.com/a?id=3") != canonicalize_url("https://example.com/a?id=4")
+
+
+def test_drops_trailing_slashes_and_fragments():
+    assert canonicalize_url("https://example.com/a/") == "https://example.com/a"
+    assert canonicalize_url("https://example.com/a#section") == "https://example.com/a"
+    assert canonicalize_url("https://example.com") == canonicalize_url("https://example.com/") == "https://example.com/"
+
+
+def test_merges_the_scheme_www_and_default_port_variants_of_a_site():
+    variants = ["http://www.example.com/a", "https://example.com/a", "HTTPS://Example.COM:443/a",
+                "http://example.com:80/a", "https://www.example.com./a"]
+    assert {canonicalize_url(url) for url in variants} == {"https://example.com/a"}
+
+
+def test_keeps_distinct_sites_apart():
+    assert canonicalize_url("https://www2.example.com/a") != canonicalize_url("https://example.com/a")
+    assert canonicalize_url("https://www.com/a") != canonicalize_url("https://com/a")
+    assert canonicalize_url("https://wwwexample.com/a") != canonicalize_url("https://example.com/a")
+    assert canonicalize_url("http://example.com:8080/a") != canonicalize_url("http://example.com/a")
+    assert canonicalize_url("https://example.com/A") != canonicalize_url("https://example.com/a")
+
+
+def test_leaves_other_schemes_alone():
+    assert canonicalize_url("ftp://Example.com/a/") == "ftp://example.com/a/"
+
+
+def test_visited_index_counts_variants_once():
+    visited = VisitedIndex(max_urls=10)
+    assert visited.add("https://example.com/a?utm_source=x")
+    assert not visited.add("http://www.example.com/a/")
+    assert "https://example.com/a" in visited
+    assert visited.stats() == {"urls": 1, "duplicates": 1}
@@ -0,0 +1,54 @@
+"""Tests of the plain HTTP fast path against a local HTTP server."""
+import asyncio
+
+from aiohttp import web
+
+from actions import web_fetch
+
+PIECE = "<p>" + "x" * 16_380 + "</p>\n"
+
+
+async def serve_and_fetch(pieces: int, max_bytes: int) -> web_fetch.FetchedPage:
+    async def page(request: web.Request) -> web.StreamResponse:
+        # streamed in pieces, so the body arrives in more than one chunk
+        response = web.StreamResponse(headers={"Content-Type": "text/html; charset=utf-8"})
+        await response.prepare(request)
+        for _ in range(pieces):
+            await response.write(PIECE.encode("utf-8"))
+            await asyncio.sleep(0)
+        return response
+
+    app = web.Application()
+    app.router.add_get("/page.html", page)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    max_page_bytes = web_fetch.CFG.http_max_page_bytes
+    web_fetch.CFG.http_max_page_bytes = max_bytes
+    try:
+        return await web_fetch.fetch_page(f"http://127.0.0.1:{port}/page.html")
+    finally:
+        web_fetch.CFG.http_max_page_bytes = max_page_bytes
+        await web_fetch.close_session()
+        await runner.cleanup()
+
+
+def test_reads_the_whole_body_of_a_page_larger_than_one_chunk():
+    page = asyncio.run(serve_and_fetch(pieces=12, max_bytes=5 * 1024 * 1024))
+    assert page.status == 200
+    assert len(page.html) == 12 * len(PIECE)
+    assert not page.truncated
+
+
+def test_reads_a_body_of_exactly_the_cap_whole():
+    page = asyncio.run(serve_and_fetch(pieces=4, max_bytes=4 * len(PIECE)))
+    assert len(page.html) == 4 * len(PIECE)
+    assert not page.truncated
+
+
+def test_truncates_a_page_larger_than_the_cap():
+    page = asyncio.run(serve_and_fetch(pieces=12, max_bytes=100_000))
+    assert len(page.html) == 100_000
+    assert page.truncated
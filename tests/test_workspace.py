@@ -0,0 +1,71 @@
+"""Tests of research workspaces."""
+import os
+
+from agent.storage import OutputsStore
+from agent.workspace import PAGES, Workspace, workspace_id
+
+QUESTION = "What is the tallest mountain?"
+AGENT = "Geography Agent"
+
+
+def test_resumes_the_queries_completed_research_and_pages(tmp_path):
+    workspace = Workspace(QUESTION, AGENT, root=str(tmp_path))
+    workspace.set_queries(["mountains", "peaks"])
+    workspace.complete("mountains", "Everest is the tallest.")
+    workspace.save_page("https://www.example.com/everest/", "Everest: 8849 m")
+
+    resumed = Workspace(QUESTION, AGENT, root=str(tmp_path))
+    assert resumed.queries == ["mountains", "peaks"]
+    assert resumed.completed("mountains") == "Everest is the tallest."
+    assert resumed.page("https://example.com/everest") == "Everest: 8849 m"
+    assert not [name for name in os.listdir(workspace.path) if name.endswith(".tmp")]
+
+
+def test_saves_the_research_of_a_query_that_is_no_valid_file_name(tmp_path):
+    workspace = Workspace(QUESTION, AGENT, root=str(tmp_path))
+    workspace.complete("A/B testing of K2 routes", "Routes were compared.")
+    workspace.complete("../peaks", "Peaks were listed.")
+    assert os.path.dirname(workspace.research_path("../peaks")) == workspace.path
+
+    resumed = Workspace(QUESTION, AGENT, root=str(tmp_path))
+    assert resumed.completed("A/B testing of K2 routes") == "Routes were compared."
+    assert resumed.completed("../peaks") == "Peaks were listed."
+
+
+def test_refresh_ignores_earlier_research(tmp_path):
+    workspace = Workspace(QUESTION, AGENT, root=str(tmp_path))
+    workspace.set_queries(["mountains"])
+    workspace.save_page("https://example.com/everest", "Everest: 8849 m")
+
+    refreshed = Workspace(QUESTION, AGENT, refresh=True, root=str(tmp_path))
+    assert refreshed.queries is None
+    assert refreshed.page("https://example.com/everest") is None
+    assert Workspace(QUESTION, AGENT, root=str(tmp_path)).page("https://example.com/everest") is None
+
+
+def test_skips_a_page_record_cut_off_by_an_interrupted_run(tmp_path):
+    workspace = Workspace(QUESTION, AGENT, root=str(tmp_path))
+    workspace.save_page("https://example.com/everest", "Everest: 8849 m")
+    with open(os.path.join(workspace.path, PAGES), "a") as file:
+        file.write('{"url": "https://example.com/k2", "summ')
+
+    resumed = Workspace(QUESTION, AGENT, root=str(tmp_path))
+    resumed.save_page("https://example.com/lhotse", "Lhotse: 8516 m")
+    resumed = Workspace(QUESTION, AGENT, root=str(tmp_path))
+    assert resumed.stats()["pages"] == 2
+    assert resumed.page("https://example.com/lhotse") == "Lhotse: 8516 m"
+
+
+def test_a_concurrent_run_of_the_same_question_gets_a_workspace_of_its_own(tmp_path):
+    store = OutputsStore(root=str(tmp_path), index_path=str(tmp_path / "index.sqlite3"))
+    question_workspace = workspace_id(QUESTION, AGENT)
+    first = store.claim(question_workspace)
+    second = store.claim(question_workspace)
+    assert first == question_workspace
+    assert second != first and second.startswith(question_workspace)
+
+    assert Workspace(QUESTION, AGENT, root=str(tmp_path), name=second).path != \
+        Workspace(QUESTION, AGENT, root=str(tmp_path), name=first).path
+    store.release(first)
+    store.release(second)
+    assert store.claim(question_workspace) == question_workspace